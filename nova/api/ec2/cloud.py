@@ -1414,7 +1414,10 @@ class CloudController(object):
                 parts.pop(0)
 
             cluster_name, vlan_id = parts 
-            has_cluster = ofc_utils.has_region(FLAGS.ofc_service_url, cluster_name)
+            # a region to create must not exist right now, not as cached
+            has_cluster = ofc_utils.has_region(FLAGS.ofc_service_url,
+                                               cluster_name,
+                                               refresh=create_cluster)
             if create_cluster and has_cluster:
                 raise exception.OFCRegionExisted(region_name=cluster_name)
 
@@ -1424,15 +1427,12 @@ class CloudController(object):
             return create_cluster, cluster_name, vlan_id
 
         def _validate_max_count(max_count, zone):
-            bmms = db.bmm_get_all_by_instance_type(context, kwargs.get("instance_type", None))
-            available_count = 0
-            for bmm in bmms:
-                if zone == "resource_pool":
-                    if bmm["status"] == "inactive":
-                        available_count += 1
-                else:
-                    if bmm["status"] == "inactive" or bmm["status"] == "active":
-                        available_count += 1
+            if zone == "resource_pool":
+                statuses = ["inactive"]
+            else:
+                statuses = ["inactive", "active"]
+            available_count = db.bmm_capacity_count(
+                    context, kwargs.get("instance_type", None), statuses)
 
             if available_count < max_count:
                 raise exception.NotEnoughMachines(max_count=max_count, available_count=available_count)
@@ -22,8 +22,6 @@
 import novaclient
 import re
 import time
-import httplib
-import urllib
 
 from nova import block_device
 from nova import exception
@@ -40,6 +38,7 @@ from nova.compute import power_state
 from nova.compute import task_states
 from nova.compute import vm_states
 from nova.compute.utils import terminate_volumes
+from nova.virt.dodai import agent
 from nova.scheduler import api as scheduler_api
 from nova.db import base
 from nova import db
@@ -1439,28 +1438,16 @@ class API(base.Base):
             instance = self.get(context, instance_id)
             bmm = db.bmm_get_by_instance_id(context, instance_id)
     
-            conn = httplib.HTTPConnection(bmm["pxe_ip"], "4567")
-            params = {'ip_address': ip, 
-                      'subnet_mask': netmask, 
-                      'default_gateway': gw, 
-                      'dns': dns}
-            index = 0
-            if bmm["service_mac1"]:
-                params["mac_address[%d]" % index] = bmm["service_mac1"]
-                index += 1
-            if bmm["service_mac2"]:
-                params["mac_address[%d]" % index] = bmm["service_mac2"]
-    
-            params = urllib.urlencode(params)
-            headers = {'Content-type': 'application/x-www-form-urlencoded', 'Accept': 'text/plain'}
-            conn.request("PUT", "/services/dodai-instance/networks.json", params, headers)
-            response = conn.getresponse()
-            data = response.read()
-            LOG.debug(response.status)
-            LOG.debug(response.reason)
-            LOG.debug(data)
-    
-            if response.status != 200:
+            macs = [mac for mac in (bmm["service_mac1"], bmm["service_mac2"])
+                    if mac]
+            try:
+                status, data = agent.get_client().put_networks(
+                                        bmm["pxe_ip"], ip, netmask, gw,
+                                        dns, macs)
+            except exception.DodaiAgentUnreachable, e:
+                LOG.error(_("Associating %(ip)s failed: %(e)s") % locals())
+                raise exception.AssociateAddressFailed()
+            if status != 200:
                 raise exception.AssociateAddressFailed()
     
             db.bmm_update(context, bmm["id"], {"service_ip": ip})
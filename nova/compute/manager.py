@@ -49,6 +49,8 @@ from nova import block_device
 from nova import exception
 from nova import flags
 import nova.image
+from nova.image import cache as image_cache
+from nova.image import glance_pool
 from nova import log as logging
 from nova import manager
 from nova import network
@@ -62,6 +64,7 @@ from nova.compute import vm_states
 from nova.notifier import api as notifier
 from nova.compute.utils import terminate_volumes
 from nova.virt import driver
+from nova.virt import images
 
 FLAGS = flags.FLAGS
 flags.DEFINE_string('instances_path', '$state_path/instances',
@@ -1723,8 +1726,11 @@ class ComputeManager(manager.SchedulerDependentManager):
             LOG.info(_("Updating host status"))
             # This will grab info about the host and queue it
             # to be sent to the Schedulers.
-            self.update_service_capabilities(
-                self.driver.get_host_stats(refresh=True))
+            capabilities = dict(self.driver.get_host_stats(refresh=True))
+            capabilities['image_fetch'] = images.get_fetch_stats()
+            capabilities['glance_servers'] = glance_pool.get_pool().stats()
+            capabilities['image_meta_cache'] = image_cache.get_cache().stats()
+            self.update_service_capabilities(capabilities)
 
     def _sync_power_states(self, context):
         """Align power states between the database and the hypervisor.
@@ -1747,6 +1753,8 @@ class ComputeManager(manager.SchedulerDependentManager):
             LOG.info(_("Found %(num_db_instances)s in the database and "
                        "%(num_vm_instances)s on the hypervisor.") % locals())
 
+        # instance ids to update, keyed by their new power_state
+        power_state_changes = {}
         for db_instance in db_instances:
             name = db_instance["name"]
             db_power_state = db_instance['power_state']
@@ -1760,6 +1768,10 @@ class ComputeManager(manager.SchedulerDependentManager):
             if vm_power_state == db_power_state:
                 continue
 
-            self._instance_update(context,
-                                  db_instance["id"],
-                                  power_state=vm_power_state)
+            power_state_changes.setdefault(vm_power_state, []).\
+                                append(db_instance["id"])
+
+        for vm_power_state, instance_ids in power_state_changes.iteritems():
+            self.db.instance_update_all(context,
+                                        instance_ids,
+                                        {'power_state': vm_power_state})
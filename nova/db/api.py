@@ -526,6 +526,17 @@ def instance_get_all_by_user(context, user_id):
     return IMPL.instance_get_all_by_user(context, user_id)
 
 
+def instance_get_all_by_ids(context, instance_ids):
+    """Get all instances whose id is in instance_ids."""
+    return IMPL.instance_get_all_by_ids(context, instance_ids)
+
+
+def instance_get_all_by_host_created_since(context, host, since):
+    """Get all instances created on host since since, deleted ones
+    included."""
+    return IMPL.instance_get_all_by_host_created_since(context, host, since)
+
+
 def instance_get_all_by_project(context, project_id):
     """Get all instance belonging to a project."""
     return IMPL.instance_get_all_by_project(context, project_id)
@@ -584,6 +595,11 @@ def instance_update(context, instance_id, values):
     return IMPL.instance_update(context, instance_id, values)
 
 
+def instance_update_all(context, instance_ids, values):
+    """Set the same properties on many instances with one update."""
+    return IMPL.instance_update_all(context, instance_ids, values)
+
+
 def instance_add_security_group(context, instance_id, security_group_id):
     """Associate the given security group with the given instance."""
     return IMPL.instance_add_security_group(context, instance_id,
@@ -1615,6 +1631,17 @@ def bmm_get_all_by_instance_type_and_zone(context, instance_type, zone):
     """Get Bare Metal Machine records by instance type and zone."""
     return IMPL.bmm_get_all_by_instance_type_and_zone(context, instance_type, zone)
 
+def bmm_get_all_by_instance_type_and_status(context, instance_type, statuses,
+                                            zone=None):
+    """Get Bare Metal Machine records by instance type and status."""
+    return IMPL.bmm_get_all_by_instance_type_and_status(context, instance_type,
+                                                        statuses, zone)
+
+def bmm_compare_and_set_status(context, bmm_id, old_status, new_status):
+    """Change Bare Metal Machine status only if it is still old_status."""
+    return IMPL.bmm_compare_and_set_status(context, bmm_id, old_status,
+                                           new_status)
+
 def bmm_get_by_instance_id(context, instance_id):
     """Get Bare Metal Machine records by instance id."""
     return IMPL.bmm_get_by_instance_id(context, instance_id)
@@ -1623,6 +1650,38 @@ def bmm_get_by_availability_zone(context, zone):
     """Get Bare Metal Machine records by availability zone."""
     return IMPL.bmm_get_by_availability_zone(context, zone)
 
+def bmm_count_by_availability_zone(context, zone):
+    """Count Bare Metal Machine records in an availability zone."""
+    return IMPL.bmm_count_by_availability_zone(context, zone)
+
+def bmm_count_by_status(context):
+    """Count Bare Metal Machine records per instance type, zone and status.
+
+    Returns a list of (instance_type, availability_zone, status, count).
+    """
+    return IMPL.bmm_count_by_status(context)
+
+
+def bmm_capacity_get_all(context):
+    """Get the Bare Metal Machine counters.
+
+    The counters are maintained with every write of a Bare Metal Machine
+    record. Returns a list of (instance_type, availability_zone, status,
+    count).
+    """
+    return IMPL.bmm_capacity_get_all(context)
+
+
+def bmm_capacity_count(context, instance_type, statuses, zone=None):
+    """Count the Bare Metal Machines of instance_type with one of statuses
+    from the counters, optionally in one availability zone."""
+    return IMPL.bmm_capacity_count(context, instance_type, statuses, zone)
+
+
+def bmm_capacity_rebuild(context):
+    """Recount the Bare Metal Machine counters from their records."""
+    return IMPL.bmm_capacity_rebuild(context)
+
 
 ####################
 
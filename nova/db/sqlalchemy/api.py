@@ -1403,6 +1403,28 @@ def instance_get_all_by_host(context, host):
                    all()
 
 
+@require_admin_context
+def instance_get_all_by_ids(context, instance_ids):
+    if not instance_ids:
+        return []
+
+    session = get_session()
+    return session.query(models.Instance).\
+                   filter(models.Instance.id.in_(instance_ids)).\
+                   filter_by(deleted=can_read_deleted(context)).\
+                   all()
+
+
+@require_admin_context
+def instance_get_all_by_host_created_since(context, host, since):
+    session = get_session()
+    return session.query(models.Instance).\
+                   options(joinedload('instance_type')).\
+                   filter_by(host=host).\
+                   filter(models.Instance.created_at >= since).\
+                   all()
+
+
 @require_context
 def instance_get_all_by_project(context, project_id):
     authorize_project_context(context, project_id)
@@ -1553,6 +1575,21 @@ def instance_update(context, instance_id, values):
         return instance_ref
 
 
+@require_admin_context
+def instance_update_all(context, instance_ids, values):
+    if not instance_ids:
+        return
+
+    values = dict(values)
+    # the rows are updated without being loaded, stamp them explicitly
+    values.setdefault('updated_at', utils.utcnow())
+    session = get_session()
+    with session.begin():
+        session.query(models.Instance).\
+                filter(models.Instance.id.in_(instance_ids)).\
+                update(values, synchronize_session=False)
+
+
 def instance_add_security_group(context, instance_id, security_group_id):
     """Associate the given security group with the given instance"""
     session = get_session()
@@ -4001,6 +4038,7 @@ def bmm_create(context, values):
             bmm_ref = models.BareMetalMachine()
             bmm_ref.update(values)
             bmm_ref.save(session)
+            _bmm_capacity_adjust(session, _bmm_capacity_key(bmm_ref), 1)
     except Exception, e:
         raise exception.DBError(e)
     return bmm_ref
@@ -4010,13 +4048,23 @@ def bmm_update(context, bmm_id, values, session=None):
     """
     Updates Bare Metal Machine record.
     """
-    if not session:
-        session = get_session_dodai()
-        session.begin()
+    if session:
+        return _bmm_update(context, bmm_id, values, session)
 
+    session = get_session_dodai()
+    with session.begin():
+        return _bmm_update(context, bmm_id, values, session)
+
+
+def _bmm_update(context, bmm_id, values, session):
     bmm_ref = bmm_get(context, bmm_id, session=session)
+    old_key = _bmm_capacity_key(bmm_ref)
     bmm_ref.update(values)
     bmm_ref.save(session=session)
+    new_key = _bmm_capacity_key(bmm_ref)
+    if new_key != old_key:
+        _bmm_capacity_adjust(session, old_key, -1)
+        _bmm_capacity_adjust(session, new_key, 1)
     return bmm_ref
 
 
@@ -4026,11 +4074,19 @@ def bmm_destroy(context, bmm_id):
     """
     session = get_session_dodai()
     with session.begin():
+        bmm_ref = session.query(models.BareMetalMachine).\
+                          filter_by(id=bmm_id).\
+                          filter_by(deleted=False).\
+                          first()
+        if not bmm_ref:
+            return
         session.query(models.BareMetalMachine).\
                 filter_by(id=bmm_id).\
                 update({'deleted': True,
+                        'instance_id': None,
                         'deleted_at': utils.utcnow(),
                         'updated_at': literal_column('updated_at')})
+        _bmm_capacity_adjust(session, _bmm_capacity_key(bmm_ref), -1)
 
 
 def bmm_get(context, bmm_id, session=None):
@@ -4114,6 +4170,59 @@ def bmm_get_all_by_instance_type_and_zone(context, bmm_instance_type, bmm_zone,
                      filter_by(deleted=False).\
                      all()
 
+def bmm_get_all_by_instance_type_and_status(context, bmm_instance_type,
+                                            bmm_statuses, bmm_zone=None,
+                                            session=None):
+    """
+    Get Bare Metal Machine records by instance type and status,
+    optionally restricted to one availability zone.
+    """
+    if not session:
+        session = get_session_dodai()
+
+    query = session.query(models.BareMetalMachine).\
+                    filter_by(instance_type=bmm_instance_type).\
+                    filter(models.BareMetalMachine.status.in_(bmm_statuses)).\
+                    filter_by(deleted=False)
+    if bmm_zone is not None:
+        query = query.filter_by(availability_zone=bmm_zone)
+
+    return query.order_by(models.BareMetalMachine.id).all()
+
+def bmm_compare_and_set_status(context, bmm_id, old_status, new_status):
+    """
+    Set the status of a Bare Metal Machine only if it is still old_status.
+    Returns True if the status was changed.
+    """
+    session = get_session_dodai()
+    with session.begin():
+        bmm_ref = session.query(models.BareMetalMachine).\
+                          filter_by(id=bmm_id).\
+                          filter_by(status=old_status).\
+                          filter_by(deleted=False).\
+                          first()
+        if not bmm_ref:
+            return False
+        instance_type = bmm_ref.instance_type
+        zone = bmm_ref.availability_zone
+        # The type and zone are part of the condition so that the machine
+        # is counted where it was read.
+        count = session.query(models.BareMetalMachine).\
+                        filter_by(id=bmm_id).\
+                        filter_by(status=old_status).\
+                        filter_by(instance_type=instance_type).\
+                        filter_by(availability_zone=zone).\
+                        filter_by(deleted=False).\
+                        update({'status': new_status,
+                                'updated_at': utils.utcnow()},
+                               synchronize_session=False)
+        if count == 1:
+            _bmm_capacity_adjust(session,
+                                 (instance_type, zone, old_status), -1)
+            _bmm_capacity_adjust(session,
+                                 (instance_type, zone, new_status), 1)
+    return count == 1
+
 def bmm_get_by_instance_id(context, bmm_instance_id, session=None):
     """
     Get Bare Metal Machine record by instance id.
@@ -4142,10 +4251,127 @@ def bmm_get_by_availability_zone(context, bmm_zone, session=None):
     result = None
     result = session.query(models.BareMetalMachine).\
                      filter_by(availability_zone=bmm_zone).\
+                     filter_by(deleted=False).\
                      all()
 
     return result
 
+
+def bmm_count_by_availability_zone(context, bmm_zone, session=None):
+    """
+    Count Bare Metal Machine records in an availability zone.
+    """
+    if not session:
+        session = get_session_dodai()
+    return session.query(models.BareMetalMachine).\
+                   filter_by(availability_zone=bmm_zone).\
+                   filter_by(deleted=False).\
+                   count()
+
+def bmm_count_by_status(context, session=None):
+    """
+    Count Bare Metal Machine records per instance type, zone and status.
+    """
+    if not session:
+        session = get_session_dodai()
+    bmm = models.BareMetalMachine
+    return session.query(bmm.instance_type,
+                         bmm.availability_zone,
+                         bmm.status,
+                         func.count(bmm.id)).\
+                   filter_by(deleted=False).\
+                   group_by(bmm.instance_type,
+                            bmm.availability_zone,
+                            bmm.status).\
+                   all()
+
+
+def _bmm_capacity_key(bmm_ref):
+    return (bmm_ref.instance_type, bmm_ref.availability_zone,
+            bmm_ref.status)
+
+
+def _bmm_capacity_query(session, key):
+    instance_type, zone, status = key
+    capacity = models.BareMetalMachineCapacity
+    return session.query(capacity).\
+                   filter(capacity.instance_type == instance_type).\
+                   filter(capacity.availability_zone == zone).\
+                   filter(capacity.status == status)
+
+
+def _bmm_capacity_adjust(session, key, delta):
+    """Add delta to the counter of key in the transaction of session."""
+    values = {'count': models.BareMetalMachineCapacity.count + delta,
+              'updated_at': utils.utcnow()}
+    if _bmm_capacity_query(session, key).update(
+                        values, synchronize_session=False):
+        return
+    instance_type, zone, status = key
+    table = models.BareMetalMachineCapacity.__table__
+    try:
+        session.execute(table.insert().values(created_at=utils.utcnow(),
+                                              deleted=False,
+                                              instance_type=instance_type,
+                                              availability_zone=zone,
+                                              status=status,
+                                              count=delta))
+    except IntegrityError:
+        # Another transaction created the counter first.
+        _bmm_capacity_query(session, key).update(values,
+                                                 synchronize_session=False)
+
+
+def bmm_capacity_get_all(context, session=None):
+    """
+    Get the Bare Metal Machine counters per instance type, zone and status.
+    """
+    if not session:
+        session = get_session_dodai()
+    capacity = models.BareMetalMachineCapacity
+    return session.query(capacity.instance_type,
+                         capacity.availability_zone,
+                         capacity.status,
+                         capacity.count).\
+                   filter(capacity.count != 0).\
+                   all()
+
+
+def bmm_capacity_count(context, instance_type, statuses, zone=None,
+                       session=None):
+    """
+    Count the Bare Metal Machines of an instance type with one of statuses,
+    optionally in one availability zone, from the counters.
+    """
+    if not session:
+        session = get_session_dodai()
+    capacity = models.BareMetalMachineCapacity
+    query = session.query(func.sum(capacity.count)).\
+                    filter(capacity.instance_type == instance_type).\
+                    filter(capacity.status.in_(statuses))
+    if zone is not None:
+        query = query.filter(capacity.availability_zone == zone)
+    return int(query.scalar() or 0)
+
+
+def bmm_capacity_rebuild(context):
+    """
+    Recount the Bare Metal Machine counters from bare_metal_machines.
+    """
+    session = get_session_dodai()
+    with session.begin():
+        session.query(models.BareMetalMachineCapacity).\
+                delete(synchronize_session=False)
+        rows = bmm_count_by_status(context, session=session)
+        for instance_type, zone, status, count in rows:
+            capacity_ref = models.BareMetalMachineCapacity()
+            capacity_ref.update({'instance_type': instance_type,
+                                 'availability_zone': zone,
+                                 'status': status,
+                                 'count': count})
+            capacity_ref.save(session=session)
+    return rows
+
     ####################
 
 def switch_create(context, values, session=None):
@@ -0,0 +1,72 @@
+# vim: tabstop=4 shiftwidth=4 softtabstop=4
+
+#    Licensed under the Apache License, Version 2.0 (the "License"); you may
+#    not use this file except in compliance with the License. You may obtain
+#    a copy of the License at
+#
+#         http://www.apache.org/licenses/LICENSE-2.0
+#
+#    Unless required by applicable law or agreed to in writing, software
+#    distributed under the License is distributed on an "AS IS" BASIS, WITHOUT
+#    WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied. See the
+#    License for the specific language governing permissions and limitations
+#    under the License.
+
+from sqlalchemy import Boolean, Column, Index, Integer
+from sqlalchemy import MetaData, String, Table
+from nova import log as logging
+
+meta = MetaData()
+
+#
+# Tables to alter
+#
+bare_metal_machines = Table('bare_metal_machines', meta,
+        Column('deleted', Boolean(create_constraint=True, name=None)),
+        Column('id', Integer(), primary_key=True, nullable=False),
+        Column('name', String(length=255)),
+        Column('instance_id', Integer()),
+        Column('instance_type', String(length=255)),
+        Column('availability_zone', String(length=255)),
+        Column('status', String(length=255)),
+        )
+
+#
+# New Indexes
+#
+bmm = bare_metal_machines.c
+indexes = (
+    # bmm_get_all_by_instance_type_and_status
+    Index('bmm_instance_type_status_idx',
+          bmm.instance_type, bmm.status, bmm.deleted),
+    # bmm_get_all_by_instance_type_and_zone
+    Index('bmm_instance_type_zone_idx',
+          bmm.instance_type, bmm.availability_zone, bmm.deleted),
+    # bmm_get_by_availability_zone
+    Index('bmm_zone_idx', bmm.availability_zone, bmm.deleted),
+    # bmm_get_by_instance_id.  Deleted machines have no instance_id, and
+    # NULL never collides, so this only constrains machines in use.
+    Index('bmm_instance_id_idx', bmm.instance_id, unique=True),
+    )
+
+
+def upgrade(migrate_engine):
+    meta.bind = migrate_engine
+
+    # bmm_destroy used to keep the instance_id of deleted machines.
+    migrate_engine.execute(bare_metal_machines.update().
+                           where(bmm.deleted == True).
+                           values(instance_id=None))
+
+    for index in indexes:
+        try:
+            index.create(migrate_engine)
+        except Exception:
+            logging.error(_("Could not create index %s") % index.name)
+            raise
+
+
+def downgrade(migrate_engine):
+    meta.bind = migrate_engine
+    for index in indexes:
+        index.drop(migrate_engine)
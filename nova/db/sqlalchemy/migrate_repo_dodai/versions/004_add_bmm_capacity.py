@@ -0,0 +1,85 @@
+# vim: tabstop=4 shiftwidth=4 softtabstop=4
+
+#    Licensed under the Apache License, Version 2.0 (the "License"); you may
+#    not use this file except in compliance with the License. You may obtain
+#    a copy of the License at
+#
+#         http://www.apache.org/licenses/LICENSE-2.0
+#
+#    Unless required by applicable law or agreed to in writing, software
+#    distributed under the License is distributed on an "AS IS" BASIS, WITHOUT
+#    WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied. See the
+#    License for the specific language governing permissions and limitations
+#    under the License.
+
+from sqlalchemy import Boolean, Column, DateTime, Index, Integer
+from sqlalchemy import MetaData, String, Table
+from sqlalchemy import select
+from sqlalchemy.sql import func
+from nova import log as logging
+
+meta = MetaData()
+
+#
+# Tables to read
+#
+bare_metal_machines = Table('bare_metal_machines', meta,
+        Column('deleted', Boolean(create_constraint=True, name=None)),
+        Column('id', Integer(), primary_key=True, nullable=False),
+        Column('instance_type', String(length=255)),
+        Column('availability_zone', String(length=255)),
+        Column('status', String(length=255)),
+        )
+
+#
+# New Tables
+#
+bmm_capacity = Table('bmm_capacity', meta,
+        Column('created_at', DateTime(timezone=False)),
+        Column('updated_at', DateTime(timezone=False)),
+        Column('deleted_at', DateTime(timezone=False)),
+        Column('deleted', Boolean(create_constraint=True, name=None)),
+        Column('id', Integer(), primary_key=True, nullable=False),
+        Column('instance_type', String(length=255)),
+        Column('availability_zone', String(length=255)),
+        Column('status', String(length=255)),
+        Column('count', Integer(), nullable=False, default=0),
+        )
+
+#
+# New Indexes, created with the table
+#
+capacity_key_idx = Index('bmm_capacity_key_idx',
+                         bmm_capacity.c.instance_type,
+                         bmm_capacity.c.availability_zone,
+                         bmm_capacity.c.status,
+                         unique=True)
+
+
+def upgrade(migrate_engine):
+    meta.bind = migrate_engine
+    try:
+        bmm_capacity.create()
+    except Exception:
+        logging.info(repr(bmm_capacity))
+        raise
+
+    # Count the machines already registered.
+    bmm = bare_metal_machines.c
+    rows = migrate_engine.execute(
+            select([bmm.instance_type, bmm.availability_zone, bmm.status,
+                    func.count(bmm.id)]).
+            where(bmm.deleted == False).
+            group_by(bmm.instance_type, bmm.availability_zone, bmm.status))
+    for instance_type, zone, status, count in rows.fetchall():
+        migrate_engine.execute(bmm_capacity.insert().
+                               values(deleted=False,
+                                      instance_type=instance_type,
+                                      availability_zone=zone,
+                                      status=status,
+                                      count=count))
+
+
+def downgrade(migrate_engine):
+    meta.bind = migrate_engine
+    bmm_capacity.drop()
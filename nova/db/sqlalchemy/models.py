@@ -885,6 +885,17 @@ class BareMetalMachine(BASE, NovaBase):
     vlan_id = Column(Integer())
     status = Column(String(255))
 
+class BareMetalMachineCapacity(BASE, NovaBase):
+    """Represents the number of bare metal machines of an instance type
+    with a status in an availability zone."""
+
+    __tablename__ = 'bmm_capacity'
+    id = Column(Integer, primary_key=True)
+    instance_type = Column(String(255))
+    availability_zone = Column(String(255))
+    status = Column(String(255))
+    count = Column(Integer, nullable=False, default=0)
+
 class Switch(BASE, NovaBase):
     """Represents a switch."""
 
@@ -893,6 +904,20 @@ class Switch(BASE, NovaBase):
     dpid = Column(String(255))
     outer_port = Column(Integer())
 
+
+# indexes of the dodai tables, created by dodai migrations 003 and 004
+_bmm = BareMetalMachine.__table__.c
+schema.Index('bmm_instance_type_status_idx',
+             _bmm.instance_type, _bmm.status, _bmm.deleted)
+schema.Index('bmm_instance_type_zone_idx',
+             _bmm.instance_type, _bmm.availability_zone, _bmm.deleted)
+schema.Index('bmm_zone_idx', _bmm.availability_zone, _bmm.deleted)
+schema.Index('bmm_instance_id_idx', _bmm.instance_id, unique=True)
+_capacity = BareMetalMachineCapacity.__table__.c
+schema.Index('bmm_capacity_key_idx',
+             _capacity.instance_type, _capacity.availability_zone,
+             _capacity.status, unique=True)
+
 def register_models():
     """Register Models and create metadata.
 
@@ -921,7 +946,7 @@ def register_models_dodai():
     connection is lost and needs to be reestablished.
     """
     from sqlalchemy import create_engine_dodai
-    models = (BareMetalMachine, Switch)
+    models = (BareMetalMachine, BareMetalMachineCapacity, Switch)
     engine = create_engine(FLAGS.sql_connection_dodai, echo=False)
     for model in models:
         model.metadata.create_all(engine)
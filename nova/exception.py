@@ -854,6 +854,12 @@ class BareMetalMachineNotFoundByInstanceId(NotFound):
 class SwitchNotFound(NotFound):
     message = _("Switch %(id)d could not be found.")
 
+class BareMetalMachinePowerTimeout(NovaException):
+    message = _("IPMI of Bare Metal Machine %(ip)s did not answer in time.")
+
+class DodaiAgentUnreachable(NovaException):
+    message = _("Agent of %(host)s could not be reached: %(reason)s")
+
 class AssociateAddressFailed(NovaException):
     message = _("Assoicating addresss failed.")
 
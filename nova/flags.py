@@ -440,3 +440,103 @@ DEFINE_integer('dodai_partition_root_gb', 10, '')
 DEFINE_integer('dodai_partition_swap_gb', 2, '')
 DEFINE_integer('dodai_partition_ephemeral_gb', 10, '')
 DEFINE_integer('dodai_partition_kdump_gb', 10, '')
+DEFINE_string('dodai_default_deploy_mode', 'copy',
+              'How images without a dodai_deploy_mode property are '
+              'written onto machines: copy or stream')
+DEFINE_string('dodai_image_distribution', 'http',
+              'How installing nodes get images from cobbler: http or '
+              'multicast (udpcast)')
+DEFINE_integer('dodai_multicast_window', 30,
+               'Seconds during which installations of an image join the '
+               'same multicast session')
+DEFINE_integer('dodai_multicast_max_wait', 300,
+               'Seconds udp-sender waits for missing nodes after the '
+               'first one connected')
+DEFINE_integer('dodai_multicast_receiver_timeout', 900,
+               'Seconds a node waits for a multicast session to start '
+               'before downloading the image by http')
+DEFINE_integer('dodai_multicast_portbase', 9000,
+               'First udp port used by multicast sessions')
+DEFINE_integer('dodai_multicast_sessions', 50,
+               'Maximum number of concurrent multicast sessions')
+DEFINE_string('dodai_multicast_interface', None,
+              'Network interface udp-sender sends on')
+DEFINE_integer('dodai_ipmi_pool_size', 32,
+               'Maximum number of concurrent ipmitool processes')
+DEFINE_integer('dodai_ipmi_timeout', 30,
+               'Seconds to wait for ipmitool before giving up on a BMC')
+DEFINE_integer('dodai_ipmi_retries', 2,
+               'Number of retries ipmitool makes for a lan request')
+DEFINE_integer('dodai_ipmi_status_cache_ttl', 10,
+               'Seconds a BMC power status is cached')
+DEFINE_integer('dodai_state_poll_interval', 20,
+               'Seconds between state file checks while waiting for a node')
+DEFINE_bool('dodai_state_monitor_in_process', True,
+            'Run the machine state monitor inside nova-compute, so that '
+            'state reports wake up waiting instances immediately.  Turn it '
+            'off to run dodai-machine-state-monitor instead, whose reports '
+            'are seen every dodai_state_poll_interval seconds')
+DEFINE_string('dodai_state_log', '$state_path/dodai_states.log',
+              'File the machine state monitor appends state transitions '
+              'to, empty to disable')
+DEFINE_integer('dodai_monitor_pool_size', 2000,
+               'Maximum number of state reports handled at once')
+DEFINE_string('dodai_phase_log', '$state_path/dodai_phases.log',
+              'File the timings of the provisioning phases of each '
+              'instance are appended to, empty to disable')
+DEFINE_integer('dodai_warm_pool_interval', 300,
+               'Seconds between installs of popular images on idle '
+               'machines, 0 to disable')
+DEFINE_integer('dodai_warm_pool_history_hours', 24,
+               'Hours of launches the popularity of images is based on')
+DEFINE_integer('dodai_warm_pool_images', 3,
+               'Number of images kept warm per instance type')
+DEFINE_integer('dodai_warm_pool_max_per_image', 2,
+               'Maximum number of idle machines installed with an image')
+DEFINE_string('dodai_warm_pool_user_id', 'dodai_warm_pool',
+              'User owning the instances of the warm pool machines')
+DEFINE_string('dodai_warm_pool_project_id', 'dodai_warm_pool',
+              'Project owning the instances of the warm pool machines')
+DEFINE_integer('dodai_reinstall_concurrency', 4,
+               'Maximum number of machines installed for the resource '
+               'pool at once')
+DEFINE_string('dodai_wipe_strategy', 'quick',
+              'How the disk of a destroyed instance is wiped: none, quick '
+              '(partition table and filesystem signatures) or secure '
+              '(the whole disk)')
+DEFINE_integer('dodai_wipe_concurrency', 8,
+               'Maximum number of machines wiped at once')
+DEFINE_integer('dodai_wipe_timeout', 86400,
+               'Seconds after which a queued wipe is given up')
+DEFINE_integer('dodai_wipe_report_timeout', 85800,
+               'Seconds after which the wait for the "deleted" report of a '
+               'wiped machine is given up; keep it below dodai_wipe_timeout')
+DEFINE_integer('dodai_ofc_pool_size', 4,
+               'Maximum number of SOAP clients per OFC service')
+DEFINE_integer('dodai_ofc_region_cache_ttl', 60,
+               'Seconds the list of OFC regions is cached')
+DEFINE_string('dodai_ofc_wsdl_cache_path', '$state_path/ofc_wsdl',
+              'Directory where the parsed OFC WSDL is kept')
+DEFINE_integer('dodai_ofc_wsdl_cache_days', 1,
+               'Days the parsed OFC WSDL is kept on disk')
+DEFINE_integer('dodai_ofc_reconcile_interval', 600,
+               'Seconds between checks of the OFC regions against the '
+               'machines in the db, 0 to disable')
+DEFINE_list('dodai_provision_phase_limits', ['image:4', 'power:16'],
+            'Maximum number of instances in a provisioning phase at once, '
+            'as phase:limit; phases are select, image, pxe, install, '
+            'power, reboot and installed')
+DEFINE_integer('dodai_image_cache_max_gb', 0,
+               'Size over which unused images are evicted from '
+               'cobbler_path/images, 0 for no limit')
+DEFINE_integer('dodai_agent_port', 4567,
+               'Port of the agent running on dodai instances')
+DEFINE_integer('dodai_agent_timeout', 10,
+               'Seconds to wait for the agent of an instance to answer')
+DEFINE_integer('dodai_agent_retries', 3,
+               'Number of times a failed request to an agent is retried')
+DEFINE_float('dodai_agent_retry_backoff', 1.0,
+             'Seconds before the first retry of a request to an agent, '
+             'doubled at each retry')
+DEFINE_integer('dodai_agent_concurrency', 32,
+               'Maximum number of agents sent a batch of requests at once')
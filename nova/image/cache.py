@@ -0,0 +1,157 @@
+# vim: tabstop=4 shiftwidth=4 softtabstop=4
+
+#    Licensed under the Apache License, Version 2.0 (the "License"); you may
+#    not use this file except in compliance with the License. You may obtain
+#    a copy of the License at
+#
+#         http://www.apache.org/licenses/LICENSE-2.0
+#
+#    Unless required by applicable law or agreed to in writing, software
+#    distributed under the License is distributed on an "AS IS" BASIS, WITHOUT
+#    WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied. See the
+#    License for the specific language governing permissions and limitations
+#    under the License.
+
+"""
+Cache of image metadata shared by the image services of a process.
+
+Entries are kept image_meta_cache_ttl seconds, images an image service
+reported as missing image_meta_cache_negative_ttl seconds, for the project
+they were looked up by only.  The image services invalidate the entries of
+the images they create, update or delete; changes made by other processes
+are seen once the entries expire.  Compute hosts report the counters of
+the cache in their image_meta_cache capability.
+
+"""
+
+import copy
+import time
+
+from nova import flags
+
+
+FLAGS = flags.FLAGS
+flags.DEFINE_integer('image_meta_cache_ttl', 60,
+                     'Seconds the metadata of an image is cached, '
+                     '0 to disable the cache')
+flags.DEFINE_integer('image_meta_cache_negative_ttl', 10,
+                     'Seconds an image found missing is remembered')
+flags.DEFINE_integer('image_meta_cache_size', 1000,
+                     'Maximum number of cached image lookups')
+
+# returned by get() for the keys cached as missing
+NOT_FOUND = object()
+
+
+class ImageMetaCache(object):
+    """Caches image metadata by id and image ids by name."""
+
+    def __init__(self, ttl=None, negative_ttl=None, size=None):
+        self.ttl = ttl
+        self.negative_ttl = negative_ttl
+        self.size = size
+        # key -> (expires, value)
+        self._entries = {}
+        self._stats = {'hits': 0, 'negative_hits': 0, 'misses': 0,
+                       'evictions': 0}
+
+    def _ttl(self, value):
+        if value is NOT_FOUND:
+            if self.negative_ttl is not None:
+                return self.negative_ttl
+            return FLAGS.image_meta_cache_negative_ttl
+        if self.ttl is not None:
+            return self.ttl
+        return FLAGS.image_meta_cache_ttl
+
+    def get(self, *keys):
+        """Return the value cached for the first cached of keys, NOT_FOUND
+        or None."""
+        now = time.time()
+        entry = None
+        for key in keys:
+            entry = self._entries.get(key)
+            if entry is not None and entry[0] <= now:
+                del self._entries[key]
+                entry = None
+            if entry is not None:
+                break
+        if entry is None:
+            self._stats['misses'] += 1
+            return None
+        if entry[1] is NOT_FOUND:
+            self._stats['negative_hits'] += 1
+            return NOT_FOUND
+        self._stats['hits'] += 1
+        return copy.deepcopy(entry[1])
+
+    def set(self, key, value):
+        """Cache value, or NOT_FOUND, for key."""
+        ttl = self._ttl(value)
+        if ttl <= 0:
+            return
+        if key not in self._entries:
+            self._make_room()
+        if value is not NOT_FOUND:
+            value = copy.deepcopy(value)
+        self._entries[key] = (time.time() + ttl, value)
+
+    def _make_room(self):
+        size = self.size or FLAGS.image_meta_cache_size
+        if len(self._entries) < size:
+            return
+        now = time.time()
+        for key, (expires, value) in self._entries.items():
+            if expires <= now:
+                del self._entries[key]
+        while len(self._entries) >= size:
+            key = min(self._entries, key=lambda k: self._entries[k][0])
+            del self._entries[key]
+            self._stats['evictions'] += 1
+
+    def invalidate(self, image_id=None, name=None):
+        """Forget image_id and the lookups of name."""
+        for key in self._entries.keys():
+            if image_id is not None and key[:2] == id_key(image_id):
+                del self._entries[key]
+            elif name is not None and key[0] == 'name' and key[-1] == name:
+                del self._entries[key]
+
+    def clear(self):
+        self._entries.clear()
+
+    def stats(self):
+        """Return the counters of the cache and its hit rate."""
+        stats = dict(self._stats)
+        lookups = stats['hits'] + stats['negative_hits'] + stats['misses']
+        stats['entries'] = len(self._entries)
+        stats['hit_rate'] = 0.0
+        if lookups:
+            stats['hit_rate'] = float(stats['hits'] +
+                                      stats['negative_hits']) / lookups
+        return stats
+
+
+_CACHE = None
+
+
+def get_cache():
+    """Return the cache shared by the image services of this process."""
+    global _CACHE
+    if _CACHE is None:
+        _CACHE = ImageMetaCache()
+    return _CACHE
+
+
+def id_key(image_id):
+    return ('id', str(image_id))
+
+
+def missing_key(context, image_id):
+    # glance may hide a private image from some projects only
+    return id_key(image_id) + (getattr(context, 'project_id', None),)
+
+
+def name_key(context, name):
+    # names are looked up among the images the project can see
+    return ('name', getattr(context, 'project_id', None), name)
@@ -21,8 +21,8 @@ from __future__ import absolute_import
 
 import copy
 import datetime
+import httplib
 import json
-import random
 from urlparse import urlparse
 
 from glance.common import exception as glance_exception
@@ -31,6 +31,8 @@ from nova import exception
 from nova import flags
 from nova import log as logging
 from nova import utils
+from nova.image import cache
+from nova.image import glance_pool
 from nova.image import service
 
 
@@ -69,22 +71,19 @@ def _create_glance_client(context, host, port):
                                      creds=creds)
     else:
         glance_client = GlanceClient(host, port)
+    glance_pool.get_pool().attach(glance_client)
     return glance_client
 
 
 def pick_glance_api_server():
     """Return which Glance API server to use for the request
 
-    This method provides a very primitive form of load-balancing suitable for
-    testing and sandbox environments. In production, it would be better to use
-    one IP and route that to a real load-balancer.
+    Servers failing requests are avoided for a while and the faster of two
+    servers is preferred, see nova.image.glance_pool.
 
         Returns (host, port)
     """
-    host_port = random.choice(FLAGS.glance_api_servers)
-    host, port_str = host_port.split(':')
-    port = int(port_str)
-    return host, port
+    return glance_pool.get_pool().pick()
 
 
 def get_glance_client(context, image_href):
@@ -110,7 +109,7 @@ def get_glance_client(context, image_href):
         (image_id, host, port) = _parse_image_ref(image_href)
     except ValueError:
         raise exception.InvalidImageRef(image_href=image_href)
-    glance_client = _create_glance_client(context, glance_host, glance_port)
+    glance_client = _create_glance_client(context, host, port)
     return (glance_client, image_id)
 
 
@@ -127,6 +126,12 @@ class GlanceImageService(service.BaseImageService):
 
     def __init__(self, client=None):
         self._client = client
+        # NOTE: a given client may talk to another glance than the one of
+        # glance_api_servers, so its lookups are not shared.
+        if client is None:
+            self._cache = cache.get_cache()
+        else:
+            self._cache = cache.ImageMetaCache()
 
     def _get_client(self, context):
         # NOTE(sirp): we want to load balance each request across glance
@@ -216,10 +221,7 @@ class GlanceImageService(service.BaseImageService):
 
     def show(self, context, image_id):
         """Returns a dict with image data for the given opaque image id."""
-        try:
-            image_meta = self._get_client(context).get_image_meta(image_id)
-        except glance_exception.NotFound:
-            raise exception.ImageNotFound(image_id=image_id)
+        image_meta = self._get_image_meta(context, image_id)
 
         if not self._is_image_available(context, image_meta):
             raise exception.ImageNotFound(image_id=image_id)
@@ -227,14 +229,46 @@ class GlanceImageService(service.BaseImageService):
         base_image_meta = self._translate_to_base(image_meta)
         return base_image_meta
 
+    def _get_image_meta(self, context, image_id):
+        """Return the glance metadata of image_id, cached or fetched."""
+        key = cache.id_key(image_id)
+        missing_key = cache.missing_key(context, image_id)
+        image_meta = self._cache.get(key, missing_key)
+        if image_meta is cache.NOT_FOUND:
+            raise exception.ImageNotFound(image_id=image_id)
+        if image_meta is not None:
+            return image_meta
+
+        try:
+            image_meta = self._get_client(context).get_image_meta(image_id)
+        except glance_exception.NotFound:
+            self._cache.set(missing_key, cache.NOT_FOUND)
+            raise exception.ImageNotFound(image_id=image_id)
+        self._cache.set(key, image_meta)
+        return image_meta
+
     def show_by_name(self, context, name):
         """Returns a dict containing image data for the given name."""
+        key = cache.name_key(context, name)
+        image_id = self._cache.get(key)
+        if image_id is cache.NOT_FOUND:
+            raise exception.ImageNotFound(image_id=name)
+        if image_id is not None:
+            try:
+                image_meta = self.show(context, image_id)
+                if image_meta.get('name') == name:
+                    return image_meta
+            except exception.ImageNotFound:
+                pass
+
         # TODO(vish): replace this with more efficient call when glance
         #             supports it.
         image_metas = self.detail(context)
         for image_meta in image_metas:
             if name == image_meta.get('name'):
+                self._cache.set(key, image_meta['id'])
                 return image_meta
+        self._cache.set(key, cache.NOT_FOUND)
         raise exception.ImageNotFound(image_id=name)
 
     def get(self, context, image_id, data):
@@ -251,6 +285,39 @@ class GlanceImageService(service.BaseImageService):
         base_image_meta = self._translate_to_base(image_meta)
         return base_image_meta
 
+    def get_range(self, context, image_id, offset=0, length=None):
+        """Open the data of an image starting at byte offset.
+
+        :returns: a tuple of (response, partial). The data is read from
+                  response; partial is False when the server ignored the
+                  range and sends the image from its first byte.
+        """
+        client = self._get_client(context)
+        headers = {}
+        if getattr(client, 'auth_tok', None):
+            headers['x-auth-token'] = client.auth_tok
+        if offset or length is not None:
+            end = ''
+            if length is not None:
+                end = offset + length - 1
+            headers['Range'] = 'bytes=%s-%s' % (offset, end)
+
+        conn = glance_pool.get_pool().connection(
+                        client.host, client.port,
+                        use_ssl=getattr(client, 'use_ssl', False))
+        conn.request('GET', '%s/images/%s' % (getattr(client, 'doc_root',
+                                                      '/v1'), image_id),
+                     headers=headers)
+        response = conn.getresponse()
+        if response.status == httplib.NOT_FOUND:
+            raise exception.ImageNotFound(image_id=image_id)
+        if response.status not in (httplib.OK, httplib.PARTIAL_CONTENT):
+            raise exception.Error(_('Unexpected status %(status)s getting '
+                                    'image %(image_id)s') %
+                                  {'status': response.status,
+                                   'image_id': image_id})
+        return response, response.status == httplib.PARTIAL_CONTENT
+
     def create(self, context, image_meta, data=None):
         """Store the image data and return the new image id.
 
@@ -269,6 +336,8 @@ class GlanceImageService(service.BaseImageService):
 
         # Translate Service -> Base
         base_image_meta = self._translate_to_base(recv_service_image_meta)
+        self._cache.invalidate(base_image_meta.get('id'),
+                               base_image_meta.get('name'))
         LOG.debug(_('Metadata returned from Glance formatted for Base %s'),
                   base_image_meta)
         return base_image_meta
@@ -280,13 +349,19 @@ class GlanceImageService(service.BaseImageService):
 
         """
         # NOTE(vish): show is to check if image is available
-        self.show(context, image_id)
+        old_image_meta = self.show(context, image_id)
         image_meta = _convert_to_string(image_meta)
+        new_name = image_meta.get('name')
         try:
             client = self._get_client(context)
             image_meta = client.update_image(image_id, image_meta, data)
         except glance_exception.NotFound:
             raise exception.ImageNotFound(image_id=image_id)
+        finally:
+            # a show running during the update may have cached the old
+            # metadata again
+            self._cache.invalidate(image_id, old_image_meta.get('name'))
+            self._cache.invalidate(name=new_name)
 
         base_image_meta = self._translate_to_base(image_meta)
         return base_image_meta
@@ -321,6 +396,8 @@ class GlanceImageService(service.BaseImageService):
             result = self._get_client(context).delete_image(image_id)
         except glance_exception.NotFound:
             raise exception.ImageNotFound(image_id=image_id)
+        finally:
+            self._cache.invalidate(image_id, image_meta.get('name'))
         return result
 
     def delete_all(self):
@@ -0,0 +1,295 @@
+# vim: tabstop=4 shiftwidth=4 softtabstop=4
+
+#    Licensed under the Apache License, Version 2.0 (the "License"); you may
+#    not use this file except in compliance with the License. You may obtain
+#    a copy of the License at
+#
+#         http://www.apache.org/licenses/LICENSE-2.0
+#
+#    Unless required by applicable law or agreed to in writing, software
+#    distributed under the License is distributed on an "AS IS" BASIS, WITHOUT
+#    WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied. See the
+#    License for the specific language governing permissions and limitations
+#    under the License.
+
+"""
+Keep-alive connections to the glance API servers and their health.
+
+The requests to a glance API server go over a pool of keep-alive
+connections, at most glance_connection_pool_size of them kept per server.
+Each answer updates the average latency of the server; pick() compares two
+servers in service and returns the faster one.  A server failing
+glance_server_failure_threshold requests in a row (connection errors,
+timeouts and 5xx answers) is taken out of service for
+glance_server_cooldown seconds, after which a single further failure takes
+it out again.  When every server is out of service, the one coming back
+first is used.  The counters of each server are reported by compute hosts
+in their glance_servers capability.
+
+"""
+
+import functools
+import httplib
+import random
+import socket
+import time
+
+from nova import flags
+from nova import log as logging
+
+
+LOG = logging.getLogger('nova.image.glance_pool')
+FLAGS = flags.FLAGS
+flags.DEFINE_integer('glance_connection_pool_size', 8,
+                     'Maximum number of keep-alive connections per glance '
+                     'API server')
+flags.DEFINE_integer('glance_server_failure_threshold', 3,
+                     'Number of failed requests in a row after which a '
+                     'glance API server is taken out of service')
+flags.DEFINE_integer('glance_server_cooldown', 30,
+                     'Seconds a failing glance API server is kept out of '
+                     'service')
+flags.DEFINE_integer('glance_socket_timeout', 60,
+                     'Seconds a glance API server may keep a request '
+                     'waiting before it fails, 0 to wait forever')
+
+# weight of the last answer in the average latency of a server
+_LATENCY_DECAY = 0.3
+# seconds after which an idle connection may have been closed by the server
+_MAX_IDLE = 30
+
+
+class GlanceServer(object):
+    """Health and keep-alive connections of a glance API server."""
+
+    def __init__(self, host, port):
+        self.host = host
+        self.port = port
+        # average seconds to an answer, None until the first one
+        self.latency = None
+        self.requests = 0
+        self.failures = 0
+        self.consecutive_failures = 0
+        self.ejections = 0
+        self.ejected_until = 0
+        self.connections = []
+
+    def available(self, now=None):
+        return self.ejected_until <= (now or time.time())
+
+    def _measure(self, latency):
+        self.requests += 1
+        if latency is None:
+            return
+        if self.latency is None:
+            self.latency = latency
+        else:
+            self.latency += _LATENCY_DECAY * (latency - self.latency)
+
+    def succeeded(self, latency):
+        self._measure(latency)
+        self.consecutive_failures = 0
+
+    def failed(self, latency=None):
+        self._measure(latency)
+        self.failures += 1
+        self.consecutive_failures += 1
+        if self.consecutive_failures >= \
+                FLAGS.glance_server_failure_threshold and self.available():
+            self.ejected_until = time.time() + FLAGS.glance_server_cooldown
+            self.ejections += 1
+            LOG.warn(_("Glance API server %(host)s:%(port)s failed "
+                       "%(failures)s requests in a row, out of service for "
+                       "%(cooldown)s seconds") %
+                     {'host': self.host, 'port': self.port,
+                      'failures': self.consecutive_failures,
+                      'cooldown': FLAGS.glance_server_cooldown})
+
+    def stats(self):
+        return {'requests': self.requests,
+                'failures': self.failures,
+                'consecutive_failures': self.consecutive_failures,
+                'ejections': self.ejections,
+                'available': self.available(),
+                'latency': self.latency,
+                'connections': len(self.connections),
+                'idle_connections': len([conn for conn in self.connections
+                                         if conn.idle()])}
+
+
+class _PooledConnectionMixin:
+    """Keep-alive connection reporting its answers to its server."""
+
+    def _setup(self, server):
+        self.server = server
+        # the last response, None while a request is under way
+        self.response = None
+        self.broken = False
+        self.uses = 0
+        self.last_used = time.time()
+        self._request = None
+        self._started = None
+
+    def idle(self):
+        """Return whether the connection may send another request."""
+        if self.broken or self.response is None:
+            return False
+        if not self.response.isclosed():
+            # HEAD and empty answers have nothing left to read
+            if self.response.length != 0:
+                return False
+            self.response.close()
+        return True
+
+    def checkout(self):
+        self.response = None
+        self.uses += 1
+
+    def _fail(self):
+        if not self.broken:
+            self.broken = True
+            self.close()
+            if self in self.server.connections:
+                self.server.connections.remove(self)
+            self.server.failed()
+
+    def putrequest(self, *args, **kwargs):
+        self._started = time.time()
+        httplib.HTTPConnection.putrequest(self, *args, **kwargs)
+
+    def request(self, method, url, body=None, headers={}):
+        if body is None or isinstance(body, basestring):
+            self._request = (method, url, body, headers)
+        else:
+            self._request = None
+        httplib.HTTPConnection.request(self, method, url, body, headers)
+
+    def send(self, data):
+        try:
+            httplib.HTTPConnection.send(self, data)
+        except socket.error:
+            self._fail()
+            raise
+
+    def getresponse(self, *args, **kwargs):
+        try:
+            try:
+                response = httplib.HTTPConnection.getresponse(self, *args,
+                                                              **kwargs)
+            except (socket.error, httplib.BadStatusLine), e:
+                if self.uses < 2 or self._request is None or \
+                   isinstance(e, socket.timeout):
+                    raise
+                # the server closed the connection while it was idle
+                self.close()
+                httplib.HTTPConnection.request(self, *self._request)
+                response = httplib.HTTPConnection.getresponse(self, *args,
+                                                              **kwargs)
+        except (socket.error, httplib.HTTPException):
+            self._fail()
+            raise
+
+        latency = time.time() - self._started
+        if response.status >= 500:
+            self.server.failed(latency)
+        else:
+            self.server.succeeded(latency)
+        self.response = response
+        self.last_used = time.time()
+        return response
+
+
+class _PooledHTTPConnection(_PooledConnectionMixin, httplib.HTTPConnection):
+    pass
+
+
+class _PooledHTTPSConnection(_PooledConnectionMixin, httplib.HTTPSConnection):
+    pass
+
+
+def _split(host_port):
+    host, port = host_port.split(':')
+    return host, int(port)
+
+
+class GlanceServerPool(object):
+    """Tracks the glance API servers and pools connections to them."""
+
+    def __init__(self):
+        # (host, port) -> GlanceServer
+        self.servers = {}
+
+    def server(self, host, port):
+        key = (host, int(port))
+        if key not in self.servers:
+            self.servers[key] = GlanceServer(*key)
+        return self.servers[key]
+
+    def pick(self, host_ports=None):
+        """Return the (host, port) of the glance API server to use."""
+        servers = [self.server(*_split(host_port))
+                   for host_port in host_ports or FLAGS.glance_api_servers]
+        now = time.time()
+        candidates = [server for server in servers if server.available(now)]
+        if not candidates:
+            server = min(servers, key=lambda server: server.ejected_until)
+            LOG.warn(_("All glance API servers are out of service, "
+                       "using %(host)s:%(port)s") %
+                     {'host': server.host, 'port': server.port})
+            return server.host, server.port
+
+        if len(candidates) > 2:
+            candidates = random.sample(candidates, 2)
+        else:
+            random.shuffle(candidates)
+        # servers not measured yet are tried first
+        server = min(candidates, key=lambda server: server.latency or 0)
+        return server.host, server.port
+
+    def connection(self, host, port, use_ssl=False, **kwargs):
+        """Return an idle connection to host:port, or a new one."""
+        server = self.server(host, port)
+        if use_ssl:
+            cls = _PooledHTTPSConnection
+        else:
+            cls = _PooledHTTPConnection
+
+        now = time.time()
+        conn = None
+        for pooled in list(server.connections):
+            if pooled.idle() and now - pooled.last_used > _MAX_IDLE:
+                pooled.close()
+                server.connections.remove(pooled)
+            elif conn is None and pooled.__class__ is cls and pooled.idle():
+                conn = pooled
+
+        if conn is None:
+            conn = cls(host, port, timeout=FLAGS.glance_socket_timeout or None,
+                       **kwargs)
+            conn._setup(server)
+            if len(server.connections) < FLAGS.glance_connection_pool_size:
+                server.connections.append(conn)
+        conn.checkout()
+        return conn
+
+    def attach(self, client):
+        """Make a glance client send its requests through the pool."""
+        use_ssl = getattr(client, 'use_ssl', False)
+        client.get_connection_type = lambda: functools.partial(
+                                        self.connection, use_ssl=use_ssl)
+
+    def stats(self):
+        """Return the counters of each glance API server by host:port."""
+        return dict(('%s:%s' % key, server.stats())
+                    for key, server in self.servers.iteritems())
+
+
+_POOL = None
+
+
+def get_pool():
+    """Return the glance API server pool of this process."""
+    global _POOL
+    if _POOL is None:
+        _POOL = GlanceServerPool()
+    return _POOL
@@ -19,14 +19,17 @@
 """Proxy AMI-related calls from cloud controller to objectstore service."""
 
 import binascii
-import os
-import shutil
+import collections
+import copy
 import tarfile
-import tempfile
+import time
 from xml.etree import ElementTree
 
 import boto.s3.connection
 import eventlet
+from eventlet import event
+from eventlet import timeout
+from eventlet.green import subprocess
 
 from nova import crypto
 from nova import exception
@@ -41,11 +44,221 @@ from nova.api.ec2 import ec2utils
 LOG = logging.getLogger("nova.image.s3")
 FLAGS = flags.FLAGS
 flags.DEFINE_string('image_decryption_dir', '/tmp',
-                    'parent dir for tempdir used for image decryption')
+                    'unused, bundles are no longer decrypted to disk')
 flags.DEFINE_string('s3_access_key', 'notchecked',
                     'access key to use for s3 server for images')
 flags.DEFINE_string('s3_secret_key', 'notchecked',
                     'secret key to use for s3 server for images')
+flags.DEFINE_integer('s3_import_concurrency', 4,
+                     'number of parts of a bundle downloaded at once')
+flags.DEFINE_integer('s3_import_progress_interval', 10,
+                     'seconds between two reports of the progress of a '
+                     'bundle import in the image_progress property')
+
+# Bytes read at a time from the decrypted image.
+_CHUNK_SIZE = 65536
+
+
+class _ImportError(exception.Error):
+    """A stage of a bundle import failed."""
+
+    def __init__(self, stage, message):
+        super(_ImportError, self).__init__(message)
+        self.stage = stage
+
+
+class _StageReader(object):
+    """File-like reader counting the bytes read through a stage."""
+
+    def __init__(self, fileobj, stats, stage):
+        self.fileobj = fileobj
+        self.stats = stats
+        self.stage = stage
+
+    def read(self, size=-1):
+        data = self.fileobj.read(size)
+        self.stats.add(self.stage, len(data))
+        return data
+
+
+class ImportStats(object):
+    """Bytes and throughput of each stage of a bundle import."""
+
+    STAGES = ('download', 'decrypt', 'upload')
+
+    def __init__(self):
+        self.bytes = dict((stage, 0) for stage in self.STAGES)
+        self.started = dict((stage, None) for stage in self.STAGES)
+        self.updated = dict((stage, None) for stage in self.STAGES)
+        self.parts = 0
+
+    def add(self, stage, count):
+        now = time.time()
+        if self.started[stage] is None:
+            self.started[stage] = now
+        self.updated[stage] = now
+        self.bytes[stage] += count
+
+    def rate(self, stage):
+        """Return the throughput of stage in bytes per second."""
+        if self.started[stage] is None:
+            return 0.0
+        elapsed = self.updated[stage] - self.started[stage]
+        if elapsed <= 0:
+            return 0.0
+        return self.bytes[stage] / elapsed
+
+    def summary(self, total_parts):
+        stages = ['%s %.1fMB %.1fMB/s' % (stage,
+                                          self.bytes[stage] / 1048576.0,
+                                          self.rate(stage) / 1048576.0)
+                  for stage in self.STAGES]
+        return 'parts %d/%d, %s' % (self.parts, total_parts,
+                                    ', '.join(stages))
+
+
+class BundleImporter(object):
+    """Streams the parts of a bundle into the image service.
+
+    Parts are downloaded s3_import_concurrency at a time and fed in order
+    to openssl, whose output is gunzipped and untarred on the fly while
+    the image service reads the image from the tar stream, so the image
+    is never written to local disk.  At most s3_import_concurrency + 1
+    parts are held in memory.
+
+    on_state is called with "decrypting", "untarring" and "uploading" as
+    the import reaches each stage, before the image service is called.
+
+    """
+
+    def __init__(self, bucket, filenames, key, iv, concurrency=None,
+                 on_state=None):
+        self.bucket = bucket
+        self.filenames = filenames
+        self.key = key
+        self.iv = iv
+        self.concurrency = concurrency or FLAGS.s3_import_concurrency
+        self.on_state = on_state
+        self.stats = ImportStats()
+
+    def _state(self, state):
+        if self.on_state:
+            self.on_state(state)
+
+    def _download(self, filename):
+        try:
+            return self.bucket.get_key(filename).get_contents_as_string()
+        except Exception, e:
+            raise _ImportError('download', _('Failed to download %(part)s: '
+                                             '%(err)s') %
+                                             {'part': filename, 'err': e})
+
+    def parts(self):
+        """Yield the contents of the parts in order."""
+        filenames = iter(self.filenames)
+        pending = collections.deque()
+        for filename in filenames:
+            pending.append(eventlet.spawn(self._download, filename))
+            if len(pending) >= self.concurrency:
+                break
+        try:
+            while pending:
+                data = pending.popleft().wait()
+                for filename in filenames:
+                    pending.append(eventlet.spawn(self._download, filename))
+                    break
+                self.stats.parts += 1
+                self.stats.add('download', len(data))
+                yield data
+        finally:
+            for thread in pending:
+                thread.kill()
+
+    def _feed(self, process):
+        try:
+            try:
+                for data in self.parts():
+                    process.stdin.write(data)
+                    process.stdin.flush()
+            finally:
+                process.stdin.close()
+        except IOError:
+            # openssl exited, its return code tells why
+            pass
+
+    def run(self, upload):
+        """Call upload with a file-like object of the image and return its
+        result.
+
+        :raises: _ImportError naming the stage which failed.
+        """
+        process = subprocess.Popen(['openssl', 'enc', '-d', '-aes-128-cbc',
+                                    '-K', self.key, '-iv', self.iv],
+                                   stdin=subprocess.PIPE,
+                                   stdout=subprocess.PIPE,
+                                   stderr=subprocess.PIPE)
+        feeder = eventlet.spawn(self._feed, process)
+        try:
+            decrypted = _StageReader(process.stdout, self.stats, 'decrypt')
+            self._state('decrypting')
+            try:
+                tar_file = tarfile.open(fileobj=decrypted, mode='r|gz')
+                self._state('untarring')
+                image_file = tar_file.extractfile(tar_file.next())
+            except Exception, e:
+                # garbage out of openssl may be the actual error
+                self._drain(decrypted)
+                self._check(feeder, process)
+                raise _ImportError('untar', _('Failed to untar image: %s')
+                                   % e)
+
+            reader = _StageReader(image_file, self.stats, 'upload')
+            self._state('uploading')
+            try:
+                result = upload(reader)
+                # the image service may not read the image to the end,
+                # and openssl waits for the end of the tar stream to be
+                # read
+                while reader.read(_CHUNK_SIZE):
+                    pass
+                self._drain(decrypted)
+            except Exception, e:
+                if isinstance(e, tarfile.TarError):
+                    self._drain(decrypted)
+                self._check(feeder, process)
+                if isinstance(e, tarfile.TarError):
+                    raise _ImportError('untar', _('Failed to untar image: '
+                                                  '%s') % e)
+                raise _ImportError('upload', _('Failed to upload image: %s')
+                                   % e)
+            self._check(feeder, process)
+            return result
+        finally:
+            if process.returncode is None:
+                process.kill()
+                process.wait()
+            feeder.kill()
+
+    @staticmethod
+    def _drain(decrypted):
+        try:
+            while decrypted.read(_CHUNK_SIZE):
+                pass
+        except Exception:
+            pass
+
+    def _check(self, feeder, process):
+        """Raise the error of the download or decrypt stage, if any."""
+        killed = not feeder.dead
+        if killed:
+            # a later stage stopped reading, unblock the feeder
+            process.kill()
+        feeder.wait()
+        process.stdout.close()
+        err = process.stderr.read()
+        if process.wait() != 0 and not killed:
+            raise _ImportError('decrypt', _('Failed to decrypt image: %s')
+                               % err)
 
 
 class S3ImageService(service.BaseImageService):
@@ -97,13 +310,6 @@ class S3ImageService(service.BaseImageService):
                                                port=FLAGS.s3_port,
                                                host=FLAGS.s3_host)
 
-    @staticmethod
-    def _download_file(bucket, filename, local_dir):
-        key = bucket.get_key(filename)
-        local_filename = os.path.join(local_dir, filename)
-        key.get_contents_to_filename(local_filename)
-        return local_filename
-
     def _s3_parse_manifest(self, context, metadata, manifest):
         manifest = ElementTree.fromstring(manifest)
         image_format = 'ami'
@@ -179,8 +385,6 @@ class S3ImageService(service.BaseImageService):
     def _s3_create(self, context, metadata):
         """Gets a manifext from s3 and makes an image."""
 
-        image_path = tempfile.mkdtemp(dir=FLAGS.image_decryption_dir)
-
         image_location = metadata['properties']['image_location']
         bucket_name = image_location.split('/')[0]
         manifest_path = image_location[len(bucket_name) + 1:]
@@ -191,38 +395,14 @@ class S3ImageService(service.BaseImageService):
         manifest, image = self._s3_parse_manifest(context, metadata, manifest)
         image_id = image['id']
 
-        def delayed_create():
-            """This handles the fetching and decrypting of the part files."""
-            log_vars = {'image_location': image_location,
-                        'image_path': image_path}
-            metadata['properties']['image_state'] = 'downloading'
+        def _update_state(state):
+            metadata['properties']['image_state'] = state
             self.service.update(context, image_id, metadata)
 
-            try:
-                parts = []
-                elements = manifest.find('image').getiterator('filename')
-                for fn_element in elements:
-                    part = self._download_file(bucket,
-                                               fn_element.text,
-                                               image_path)
-                    parts.append(part)
-
-                # NOTE(vish): this may be suboptimal, should we use cat?
-                enc_filename = os.path.join(image_path, 'image.encrypted')
-                with open(enc_filename, 'w') as combined:
-                    for filename in parts:
-                        with open(filename) as part:
-                            shutil.copyfileobj(part, combined)
-
-            except Exception:
-                LOG.exception(_("Failed to download %(image_location)s "
-                                "to %(image_path)s"), log_vars)
-                metadata['properties']['image_state'] = 'failed_download'
-                self.service.update(context, image_id, metadata)
-                return
-
-            metadata['properties']['image_state'] = 'decrypting'
-            self.service.update(context, image_id, metadata)
+        def delayed_create():
+            """This streams the part files into the image service."""
+            log_vars = {'image_location': image_location}
+            _update_state('downloading')
 
             try:
                 hex_key = manifest.find('image/ec2_encrypted_key').text
@@ -234,55 +414,77 @@ class S3ImageService(service.BaseImageService):
                 #              any host.
                 cloud_pk = crypto.key_path(context.project_id)
 
-                dec_filename = os.path.join(image_path, 'image.tar.gz')
-                self._decrypt_image(enc_filename, encrypted_key,
-                                    encrypted_iv, cloud_pk,
-                                    dec_filename)
+                key, iv = self._decrypt_key(encrypted_key, encrypted_iv,
+                                            cloud_pk)
             except Exception:
-                LOG.exception(_("Failed to decrypt %(image_location)s "
-                                "to %(image_path)s"), log_vars)
-                metadata['properties']['image_state'] = 'failed_decrypt'
-                self.service.update(context, image_id, metadata)
+                LOG.exception(_("Failed to decrypt the key of "
+                                "%(image_location)s"), log_vars)
+                _update_state('failed_decrypt')
                 return
 
-            metadata['properties']['image_state'] = 'untarring'
-            self.service.update(context, image_id, metadata)
-
+            filenames = [element.text for element in
+                         manifest.find('image').getiterator('filename')]
+            importer = BundleImporter(bucket, filenames, key, iv,
+                                      on_state=_update_state)
+            stop = event.Event()
+            reporter = eventlet.spawn(self._report_progress, context,
+                                      image_id, metadata, importer,
+                                      len(filenames), stop)
             try:
-                unz_filename = self._untarzip_image(image_path, dec_filename)
-            except Exception:
-                LOG.exception(_("Failed to untar %(image_location)s "
-                                "to %(image_path)s"), log_vars)
-                metadata['properties']['image_state'] = 'failed_untar'
-                self.service.update(context, image_id, metadata)
-                return
-
-            metadata['properties']['image_state'] = 'uploading'
-            self.service.update(context, image_id, metadata)
-            try:
-                with open(unz_filename) as image_file:
-                    self.service.update(context, image_id,
-                                        metadata, image_file)
-            except Exception:
-                LOG.exception(_("Failed to upload %(image_location)s "
-                                "to %(image_path)s"), log_vars)
-                metadata['properties']['image_state'] = 'failed_upload'
-                self.service.update(context, image_id, metadata)
+                try:
+                    importer.run(lambda image_file: self.service.update(
+                                    context, image_id, metadata, image_file))
+                finally:
+                    # let a report under way finish before the next update
+                    stop.send()
+                    reporter.wait()
+            except _ImportError, e:
+                LOG.exception(_("Failed to import %(image_location)s"),
+                              log_vars)
+                metadata['properties']['image_progress'] = \
+                        importer.stats.summary(len(filenames))
+                _update_state('failed_%s' % e.stage)
                 return
 
+            metadata['properties']['image_progress'] = \
+                    importer.stats.summary(len(filenames))
+            LOG.info(_("Imported %(image_location)s: %(progress)s") %
+                     {'image_location': image_location,
+                      'progress': metadata['properties']['image_progress']})
             metadata['properties']['image_state'] = 'available'
             metadata['status'] = 'active'
             self.service.update(context, image_id, metadata)
 
-            shutil.rmtree(image_path)
-
         eventlet.spawn_n(delayed_create)
 
         return image
 
+    def _report_progress(self, context, image_id, metadata, importer,
+                         total_parts, stop):
+        """Publish the progress of importer in image_progress until stop
+        is sent.
+
+        Each report sends a copy of metadata, which the import goes on
+        changing and sending meanwhile.
+        """
+        while True:
+            with timeout.Timeout(FLAGS.s3_import_progress_interval, False):
+                stop.wait()
+            if stop.ready():
+                return
+            progress = copy.deepcopy(metadata)
+            progress['properties']['image_progress'] = \
+                    importer.stats.summary(total_parts)
+            try:
+                self.service.update(context, image_id, progress)
+            except Exception:
+                LOG.exception(_("Failed to report the progress of image "
+                                "%s"), image_id)
+
     @staticmethod
-    def _decrypt_image(encrypted_filename, encrypted_key, encrypted_iv,
-                       cloud_private_key, decrypted_filename):
+    def _decrypt_key(encrypted_key, encrypted_iv, cloud_private_key):
+        """Return the key and iv of a bundle, decrypted with the cloud
+        private key."""
         key, err = utils.execute('openssl',
                                  'rsautl',
                                  '-decrypt',
@@ -301,24 +503,4 @@ class S3ImageService(service.BaseImageService):
         if err:
             raise exception.Error(_('Failed to decrypt initialization '
                                     'vector: %s') % err)
-
-        _out, err = utils.execute('openssl', 'enc',
-                                  '-d', '-aes-128-cbc',
-                                  '-in', '%s' % (encrypted_filename,),
-                                  '-K', '%s' % (key,),
-                                  '-iv', '%s' % (iv,),
-                                  '-out', '%s' % (decrypted_filename,),
-                                  check_exit_code=False)
-        if err:
-            raise exception.Error(_('Failed to decrypt image file '
-                                    '%(image_file)s: %(err)s') %
-                                    {'image_file': encrypted_filename,
-                                     'err': err})
-
-    @staticmethod
-    def _untarzip_image(path, filename):
-        tar_file = tarfile.open(filename, 'r|gz')
-        tar_file.extractall(path)
-        image_file = tar_file.getnames()[0]
-        tar_file.close()
-        return os.path.join(path, image_file)
+        return key, iv
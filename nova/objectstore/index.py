@@ -0,0 +1,125 @@
+# vim: tabstop=4 shiftwidth=4 softtabstop=4
+
+#    Licensed under the Apache License, Version 2.0 (the "License"); you may
+#    not use this file except in compliance with the License. You may obtain
+#    a copy of the License at
+#
+#         http://www.apache.org/licenses/LICENSE-2.0
+#
+#    Unless required by applicable law or agreed to in writing, software
+#    distributed under the License is distributed on an "AS IS" BASIS, WITHOUT
+#    WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied. See the
+#    License for the specific language governing permissions and limitations
+#    under the License.
+
+"""Sorted index of the objects of the S3 objectstore buckets.
+
+Bucket listings are served from a sqlite table keyed by (bucket, name), so
+a page of keys costs an index seek plus the page instead of a walk and a
+sort of the whole bucket, and the size and modification time of each key
+are read from the index instead of stat'ed.  The index is updated by
+every PUT and DELETE of an object and rebuilt from the files when the
+server starts.
+
+"""
+
+import os
+import sqlite3
+
+from nova import log as logging
+from nova import utils
+
+
+LOG = logging.getLogger('nova.objectstore.index')
+
+
+class ObjectIndex(object):
+    """Keeps (bucket, name, size, mtime) of every object."""
+
+    def __init__(self, path):
+        self.path = path
+        self._conn = sqlite3.connect(path)
+        # object names are byte strings
+        self._conn.text_factory = str
+        self._conn.execute("CREATE TABLE IF NOT EXISTS objects ("
+                           "bucket TEXT NOT NULL, "
+                           "name TEXT NOT NULL, "
+                           "size INTEGER NOT NULL, "
+                           "mtime REAL NOT NULL, "
+                           "PRIMARY KEY (bucket, name))")
+        self._conn.commit()
+
+    def add(self, bucket, name, size, mtime):
+        """Add or replace an object."""
+        self._conn.execute("INSERT OR REPLACE INTO objects "
+                           "VALUES (?, ?, ?, ?)",
+                           (bucket, name, size, mtime))
+        self._conn.commit()
+
+    def remove(self, bucket, name):
+        self._conn.execute("DELETE FROM objects WHERE bucket = ? "
+                           "AND name = ?", (bucket, name))
+        self._conn.commit()
+
+    def remove_bucket(self, bucket):
+        self._conn.execute("DELETE FROM objects WHERE bucket = ?",
+                           (bucket,))
+        self._conn.commit()
+
+    def list(self, bucket, prefix="", marker="", max_keys=None):
+        """Return the (name, size, mtime) of the objects of bucket after
+        marker whose names start with prefix, in name order, and whether
+        more objects follow."""
+        prefix = utils.utf8(prefix)
+        marker = utils.utf8(marker)
+        if marker and marker >= prefix:
+            # the marker itself was on the previous page
+            start, comparison = marker, ">"
+        else:
+            start, comparison = prefix, ">="
+        query = ("SELECT name, size, mtime FROM objects WHERE bucket = ? "
+                 "AND name %s ? ORDER BY name" % comparison)
+        params = [bucket, start]
+        if max_keys is not None:
+            query += " LIMIT ?"
+            params.append(max_keys + 1)
+
+        objects = []
+        truncated = False
+        for name, size, mtime in self._conn.execute(query, params):
+            if not name.startswith(prefix):
+                break
+            if max_keys is not None and len(objects) >= max_keys:
+                truncated = True
+                break
+            objects.append((name, size, mtime))
+        return objects, truncated
+
+    def rebuild(self, directory, bucket_depth=0, ignore_prefix=None):
+        """Replace the index with the objects found under directory,
+        except the files whose names start with ignore_prefix."""
+        self._conn.execute("DELETE FROM objects")
+        count = 0
+        for bucket in os.listdir(directory):
+            path = os.path.join(directory, bucket)
+            if bucket.startswith(".") or not os.path.isdir(path):
+                continue
+            skip = len(path) + 1
+            for i in range(bucket_depth):
+                skip += 2 * (i + 1) + 1
+            for root, dirs, files in os.walk(path):
+                for file_name in files:
+                    if ignore_prefix and file_name.startswith(ignore_prefix):
+                        continue
+                    file_path = os.path.join(root, file_name)
+                    info = os.stat(file_path)
+                    self._conn.execute("INSERT OR REPLACE INTO objects "
+                                       "VALUES (?, ?, ?, ?)",
+                                       (bucket, file_path[skip:],
+                                        info.st_size, info.st_mtime))
+                    count += 1
+        self._conn.commit()
+        LOG.info(_("Indexed %(count)d objects of %(directory)s") % locals())
+
+    def close(self):
+        self._conn.close()
@@ -34,11 +34,12 @@ S3 client with this module:
 
 """
 
-import bisect
+import base64
 import datetime
 import hashlib
 import os
 import os.path
+import tempfile
 import urllib
 
 import routes
@@ -48,11 +49,22 @@ from nova import flags
 from nova import log as logging
 from nova import utils
 from nova import wsgi
+from nova.objectstore import index
 
 
 FLAGS = flags.FLAGS
 flags.DEFINE_string('buckets_path', '$state_path/buckets',
                     'path to s3 buckets')
+flags.DEFINE_integer('s3_chunk_size', 65536,
+                     'bytes read or written at a time when streaming objects')
+
+# Objects being uploaded are written next to their final path under this
+# prefix, and renamed once complete.
+_PARTIAL_PREFIX = '.s3tmp-'
+
+# The listing index, in the root directory; bucket names never start with
+# a dot.
+_INDEX_NAME = '.s3index.sqlite'
 
 
 class S3Application(wsgi.Router):
@@ -78,6 +90,9 @@ class S3Application(wsgi.Router):
         if not os.path.exists(self.directory):
             os.makedirs(self.directory)
         self.bucket_depth = bucket_depth
+        self.index = index.ObjectIndex(os.path.join(self.directory,
+                                                    _INDEX_NAME))
+        self.index.rebuild(self.directory, bucket_depth, _PARTIAL_PREFIX)
         super(S3Application, self).__init__(mapper)
 
 
@@ -193,6 +208,8 @@ class RootHandler(BaseRequestHandler):
         names = os.listdir(self.application.directory)
         buckets = []
         for name in names:
+            if name.startswith('.'):
+                continue
             path = os.path.join(self.application.directory, name)
             info = os.stat(path)
             buckets.append({
@@ -217,38 +234,16 @@ class BucketHandler(BaseRequestHandler):
            not os.path.isdir(path):
             self.set_status(404)
             return
-        object_names = []
-        for root, dirs, files in os.walk(path):
-            for file_name in files:
-                object_names.append(os.path.join(root, file_name))
-        skip = len(path) + 1
-        for i in range(self.application.bucket_depth):
-            skip += 2 * (i + 1) + 1
-        object_names = [n[skip:] for n in object_names]
-        object_names.sort()
+        objects, truncated = self.application.index.list(
+                bucket_name, prefix, marker, max_keys)
         contents = []
-
-        start_pos = 0
-        if marker:
-            start_pos = bisect.bisect_right(object_names, marker, start_pos)
-        if prefix:
-            start_pos = bisect.bisect_left(object_names, prefix, start_pos)
-
-        truncated = False
-        for object_name in object_names[start_pos:]:
-            if not object_name.startswith(prefix):
-                break
-            if len(contents) >= max_keys:
-                truncated = True
-                break
-            object_path = self._object_path(bucket_name, object_name)
+        for object_name, size, mtime in objects:
             c = {"Key": object_name}
             if not terse:
-                info = os.stat(object_path)
                 c.update({
                     "LastModified": datetime.datetime.utcfromtimestamp(
-                        info.st_mtime),
-                    "Size": info.st_size,
+                        mtime),
+                    "Size": size,
                 })
             contents.append(c)
             marker = object_name
@@ -282,10 +277,48 @@ class BucketHandler(BaseRequestHandler):
             self.set_status(403)
             return
         os.rmdir(path)
+        self.application.index.remove_bucket(bucket_name)
         self.set_status(204)
         self.finish()
 
 
+class FileIter(object):
+    """Iterates over a file, or a byte range of it, chunk by chunk.
+
+    Used as the app_iter of object responses, so that webob serves Range
+    requests by seeking instead of reading the skipped bytes.
+
+    """
+
+    def __init__(self, file, chunk_size=None, start=0, stop=None):
+        self.file = file
+        self.chunk_size = chunk_size or FLAGS.s3_chunk_size
+        self.start = start
+        self.stop = stop
+
+    def __iter__(self):
+        self.file.seek(self.start)
+        remaining = None
+        if self.stop is not None:
+            remaining = self.stop - self.start
+        while remaining is None or remaining > 0:
+            size = self.chunk_size
+            if remaining is not None:
+                size = min(size, remaining)
+                remaining -= size
+            chunk = self.file.read(size)
+            if not chunk:
+                break
+            yield chunk
+        self.close()
+
+    def app_iter_range(self, start, stop):
+        return FileIter(self.file, self.chunk_size, start, stop)
+
+    def close(self):
+        self.file.close()
+
+
 class ObjectHandler(BaseRequestHandler):
     def get(self, bucket, object_name):
         object_name = urllib.unquote(object_name)
@@ -295,14 +328,23 @@ class ObjectHandler(BaseRequestHandler):
             self.set_status(404)
             return
         info = os.stat(path)
+        last_modified = datetime.datetime.utcfromtimestamp(
+                int(info.st_mtime))
+        if_unmodified_since = self.request.if_unmodified_since
+        if if_unmodified_since and \
+           last_modified > if_unmodified_since.replace(tzinfo=None):
+            self.set_status(412)
+            return
         self.set_header("Content-Type", "application/unknown")
-        self.set_header("Last-Modified", datetime.datetime.utcfromtimestamp(
-            info.st_mtime))
-        object_file = open(path, "r")
-        try:
-            self.finish(object_file.read())
-        finally:
-            object_file.close()
+        self.response.last_modified = last_modified
+        # webob answers If-Modified-Since, If-Range and Range requests
+        # from the iterator without reading the whole object.
+        self.response.conditional_response = True
+        self.response.accept_ranges = "bytes"
+        self.response.app_iter = FileIter(open(path, "rb"))
+        self.response.content_length = info.st_size
+
+    head = get
 
     def put(self, bucket, object_name):
         object_name = urllib.unquote(object_name)
@@ -319,13 +361,50 @@ class ObjectHandler(BaseRequestHandler):
         directory = os.path.dirname(path)
         if not os.path.exists(directory):
             os.makedirs(directory)
-        object_file = open(path, "w")
-        object_file.write(self.request.body)
-        object_file.close()
-        self.set_header('ETag',
-                        '"%s"' % hashlib.md5(self.request.body).hexdigest())
+
+        fd, partial_path = tempfile.mkstemp(dir=directory,
+                                            prefix=_PARTIAL_PREFIX)
+        try:
+            digest = self._receive(os.fdopen(fd, "wb"))
+            content_md5 = self.request.headers.get('Content-MD5')
+            if content_md5 and \
+               base64.b64decode(content_md5) != digest.digest():
+                os.unlink(partial_path)
+                self.set_status(400)
+                return
+            os.chmod(partial_path, 0644)
+            os.rename(partial_path, path)
+            info = os.stat(path)
+            self.application.index.add(bucket, object_name, info.st_size,
+                                       info.st_mtime)
+        except Exception:
+            if os.path.exists(partial_path):
+                os.unlink(partial_path)
+            raise
+        self.set_header('ETag', '"%s"' % digest.hexdigest())
         self.finish()
 
+    def _receive(self, object_file):
+        """Copy the request body to object_file, returning its md5."""
+        digest = hashlib.md5()
+        body_file = self.request.body_file
+        remaining = self.request.content_length
+        try:
+            while remaining is None or remaining > 0:
+                size = FLAGS.s3_chunk_size
+                if remaining is not None:
+                    size = min(size, remaining)
+                chunk = body_file.read(size)
+                if not chunk:
+                    break
+                if remaining is not None:
+                    remaining -= len(chunk)
+                digest.update(chunk)
+                object_file.write(chunk)
+        finally:
+            object_file.close()
+        return digest
+
     def delete(self, bucket, object_name):
         object_name = urllib.unquote(object_name)
         path = self._object_path(bucket, object_name)
@@ -334,5 +413,6 @@ class ObjectHandler(BaseRequestHandler):
             self.set_status(404)
             return
         os.unlink(path)
+        self.application.index.remove(bucket, object_name)
         self.set_status(204)
         self.finish()
@@ -32,5 +32,6 @@ InstanceType filter.
 
 from abstract_filter import AbstractHostFilter
 from all_hosts_filter import AllHostsFilter
+from dodai_machine_filter import DodaiMachineFilter
 from instance_type_filter import InstanceTypeFilter
 from json_filter import JsonFilter
@@ -0,0 +1,39 @@
+# vim: tabstop=4 shiftwidth=4 softtabstop=4
+
+#    Licensed under the Apache License, Version 2.0 (the "License"); you may
+#    not use this file except in compliance with the License. You may obtain
+#    a copy of the License at
+#
+#         http://www.apache.org/licenses/LICENSE-2.0
+#
+#    Unless required by applicable law or agreed to in writing, software
+#    distributed under the License is distributed on an "AS IS" BASIS, WITHOUT
+#    WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied. See the
+#    License for the specific language governing permissions and limitations
+#    under the License.
+
+
+from nova.scheduler.filters import abstract_filter
+
+
+class DodaiMachineFilter(abstract_filter.AbstractHostFilter):
+    """HostFilter selecting dodai hosts with free machines of the
+    requested instance type, as reported in their dodai_machines
+    capability."""
+    def instance_type_to_filter(self, instance_type):
+        """Use instance_type to filter hosts."""
+        return (self._full_name(), instance_type)
+
+    def filter_hosts(self, zone_manager, query):
+        """Return a list of hosts with a free machine of instance_type."""
+        instance_type = query
+        selected_hosts = []
+        for host, services in zone_manager.service_states.iteritems():
+            capabilities = services.get('compute', {})
+            machines = capabilities.get('dodai_machines')
+            if not machines:
+                continue
+            free = machines.get(instance_type['name'], {}).get('free', 0)
+            if free > 0:
+                selected_hosts.append((host, capabilities))
+        return selected_hosts
@@ -45,6 +45,8 @@ flags.DEFINE_integer('noop_cost_fn_weight', 1,
              'How much weight to give the noop cost function')
 flags.DEFINE_integer('compute_fill_first_cost_fn_weight', 1,
              'How much weight to give the fill-first cost function')
+flags.DEFINE_integer('compute_dodai_provisioning_cost_fn_weight', 1,
+             'How much weight to give the dodai provisioning cost function')
 
 
 def noop_cost_fn(host):
@@ -62,6 +64,17 @@ def compute_fill_first_cost_fn(host):
     return free_mem
 
 
+def compute_dodai_provisioning_cost_fn(host):
+    """Prefer dodai hosts with fewer instances being provisioned and, among
+    them, with more free machines.
+    """
+    hostname, service = host
+    caps = service.get("compute", {})
+    machines = caps.get("dodai_machines", {})
+    free = sum(counts.get("free", 0) for counts in machines.itervalues())
+    return caps.get("dodai_provisioning", 0) + 1.0 / (free + 1)
+
+
 def normalize_list(L):
     """Normalize an array of numbers such that each element satisfies:
         0 <= e <= 1
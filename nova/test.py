@@ -31,6 +31,7 @@ import unittest
 
 import mox
 import nose.plugins.skip
+import nova.image.cache
 import nova.image.fake
 import shutil
 import stubout
@@ -48,6 +49,8 @@ from nova.virt import fake
 FLAGS = flags.FLAGS
 flags.DEFINE_string('sqlite_clean_db', 'clean.sqlite',
                     'File name of clean sqlite db')
+flags.DEFINE_string('sqlite_clean_db_dodai', 'clean_dodai.sqlite',
+                    'File name of clean dodai sqlite db')
 flags.DEFINE_bool('fake_tests', True,
                   'should we use everything for testing')
 
@@ -122,6 +125,9 @@ class TestCase(unittest.TestCase):
         self.start = utils.utcnow()
         shutil.copyfile(os.path.join(FLAGS.state_path, FLAGS.sqlite_clean_db),
                         os.path.join(FLAGS.state_path, FLAGS.sqlite_db))
+        shutil.copyfile(os.path.join(FLAGS.state_path,
+                                     FLAGS.sqlite_clean_db_dodai),
+                        os.path.join(FLAGS.state_path, FLAGS.sqlite_db_dodai))
 
         # emulate some of the mox stuff, we can't use the metaclass
         # because it screws with our generators
@@ -152,6 +158,8 @@ class TestCase(unittest.TestCase):
             if FLAGS.image_service == 'nova.image.fake.FakeImageService':
                 nova.image.fake.FakeImageService_reset()
 
+            nova.image.cache.get_cache().clear()
+
             # Reset any overriden flags
             self.reset_flags()
 
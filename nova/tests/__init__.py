@@ -74,3 +74,9 @@ def setup():
 
     cleandb = os.path.join(FLAGS.state_path, FLAGS.sqlite_clean_db)
     shutil.copyfile(testdb, cleandb)
+
+    migration.db_sync_dodai()
+    testdb_dodai = os.path.join(FLAGS.state_path, FLAGS.sqlite_db_dodai)
+    cleandb_dodai = os.path.join(FLAGS.state_path,
+                                 FLAGS.sqlite_clean_db_dodai)
+    shutil.copyfile(testdb_dodai, cleandb_dodai)
@@ -0,0 +1,105 @@
+# vim: tabstop=4 shiftwidth=4 softtabstop=4
+
+#    Licensed under the Apache License, Version 2.0 (the "License"); you may
+#    not use this file except in compliance with the License. You may obtain
+#    a copy of the License at
+#
+#         http://www.apache.org/licenses/LICENSE-2.0
+#
+#    Unless required by applicable law or agreed to in writing, software
+#    distributed under the License is distributed on an "AS IS" BASIS, WITHOUT
+#    WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied. See the
+#    License for the specific language governing permissions and limitations
+#    under the License.
+
+"""Tests for the client of the dodai instance agent."""
+
+import socket
+import urlparse
+
+import eventlet
+from eventlet import wsgi
+import webob
+
+from nova import exception
+from nova import test
+from nova.virt.dodai import agent
+
+
+class _NullLogger(object):
+    def write(self, *args):
+        pass
+
+
+class AgentClientTestCase(test.TestCase):
+    def setUp(self):
+        super(AgentClientTestCase, self).setUp()
+        self.requests = []
+        sock = eventlet.listen(("127.0.0.1", 0))
+        self.port = sock.getsockname()[1]
+        self.server = eventlet.spawn(wsgi.server, sock, self._app,
+                                     log=_NullLogger())
+        self.client = agent.AgentClient(port=self.port, timeout=1,
+                                        retries=2, backoff=0.01)
+
+    def tearDown(self):
+        self.client.close()
+        self.server.kill()
+        super(AgentClientTestCase, self).tearDown()
+
+    def _app(self, environ, start_response):
+        request = webob.Request(environ)
+        self.requests.append((request.method, request.path,
+                              dict(urlparse.parse_qsl(request.body)),
+                              environ["REMOTE_PORT"]))
+        return webob.Response("ok")(environ, start_response)
+
+    def test_put_key_reuses_connection(self):
+        self.assertEqual(self.client.put_key("127.0.0.1", "key\n"),
+                         (200, "ok"))
+        self.client.put_key("127.0.0.1", "key")
+
+        self.assertEqual(len(self.requests), 2)
+        method, path, params, port = self.requests[0]
+        self.assertEqual((method, path, params),
+                         ("PUT", "/services/dodai-instance/key.json",
+                          {"key_data": "key"}))
+        self.assertEqual(port, self.requests[1][3])
+        metrics = self.client.metrics["/services/dodai-instance/key.json"]
+        self.assertEqual(metrics["requests"], 2)
+        self.assertEqual(metrics["failures"], 0)
+
+    def test_put_networks(self):
+        self.client.put_networks("127.0.0.1", "10.0.0.2", "255.0.0.0",
+                                 "10.0.0.1", "10.0.0.3", ["m1", "m2"])
+        self.assertEqual(self.requests[0][2],
+                         {"ip_address": "10.0.0.2",
+                          "subnet_mask": "255.0.0.0",
+                          "default_gateway": "10.0.0.1",
+                          "dns": "10.0.0.3",
+                          "mac_address[0]": "m1",
+                          "mac_address[1]": "m2"})
+
+    def test_unreachable_agent_is_retried(self):
+        sock = eventlet.listen(("127.0.0.1", 0))
+        port = sock.getsockname()[1]
+        sock.close()
+        client = agent.AgentClient(port=port, timeout=1, retries=2,
+                                   backoff=0.01)
+        self.assertRaises(exception.DodaiAgentUnreachable,
+                          client.put_key, "127.0.0.1", "key")
+        metrics = client.metrics["/services/dodai-instance/key.json"]
+        self.assertEqual(metrics["retries"], 2)
+        self.assertEqual(metrics["failures"], 1)
+
+    def test_batch_isolates_failures(self):
+        def _put(host):
+            if host == "dead":
+                raise socket.error("dead")
+            return self.client.put_key(host, "key")
+
+        results = self.client.batch(_put, [("127.0.0.1",), ("dead",),
+                                           ("127.0.0.1",)])
+        self.assertEqual(results[0], (200, "ok"))
+        self.assertTrue(isinstance(results[1], socket.error))
+        self.assertEqual(results[2], (200, "ok"))
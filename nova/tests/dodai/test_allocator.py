@@ -0,0 +1,114 @@
+# vim: tabstop=4 shiftwidth=4 softtabstop=4
+
+#    Licensed under the Apache License, Version 2.0 (the "License"); you may
+#    not use this file except in compliance with the License. You may obtain
+#    a copy of the License at
+#
+#         http://www.apache.org/licenses/LICENSE-2.0
+#
+#    Unless required by applicable law or agreed to in writing, software
+#    distributed under the License is distributed on an "AS IS" BASIS, WITHOUT
+#    WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied. See the
+#    License for the specific language governing permissions and limitations
+#    under the License.
+
+"""Tests for the dodai bare metal machine allocator."""
+
+from nova import context
+from nova import db
+from nova import exception
+from nova import test
+from nova.virt.dodai import allocator
+
+
+class MachineAllocatorTestCase(test.TestCase):
+    def setUp(self):
+        super(MachineAllocatorTestCase, self).setUp()
+        self.context = context.get_admin_context()
+        self.allocator = allocator.MachineAllocator()
+
+    def _create_bmm(self, status, image_ref=None, zone="resource_pool",
+                    instance_type="m1.small"):
+        values = {"instance_type": instance_type,
+                  "availability_zone": zone,
+                  "status": status}
+        if image_ref is not None:
+            instance = db.instance_create(self.context,
+                                          {"image_ref": image_ref})
+            values["instance_id"] = instance["id"]
+        return db.bmm_create(self.context, values)
+
+    def _status(self, bmm):
+        return db.bmm_get(self.context, bmm["id"])["status"]
+
+    def test_reuse_machine_with_same_image(self):
+        self._create_bmm("inactive")
+        self._create_bmm("active", image_ref=2)
+        reusable = self._create_bmm("active", image_ref=1)
+        [(bmm, reuse)] = self.allocator.allocate(self.context, "m1.small", 1)
+        self.assertEqual(bmm["id"], reusable["id"])
+        self.assertTrue(reuse)
+        self.assertEqual(self._status(bmm), "processing")
+
+    def test_prefer_machine_without_os(self):
+        self._create_bmm("active", image_ref=2)
+        inactive = self._create_bmm("inactive")
+        [(bmm, reuse)] = self.allocator.allocate(self.context, "m1.small", 1)
+        self.assertEqual(bmm["id"], inactive["id"])
+        self.assertFalse(reuse)
+
+    def test_skip_used_and_other_types(self):
+        self._create_bmm("used", zone="cluster1")
+        self._create_bmm("processing")
+        self._create_bmm("inactive", instance_type="m1.large")
+        self.assertRaises(exception.BareMetalMachineUnavailable,
+                          self.allocator.allocate,
+                          self.context, "m1.small", 1)
+
+    def test_resource_pool_only_takes_inactive(self):
+        self._create_bmm("active", image_ref=1)
+        inactive = self._create_bmm("inactive")
+        [(bmm, reuse)] = self.allocator.allocate(self.context, "m1.small", 1,
+                                                 for_resource_pool=True)
+        self.assertEqual(bmm["id"], inactive["id"])
+
+    def test_allocate_many(self):
+        bmms = [self._create_bmm("inactive") for i in xrange(3)]
+        claimed = self.allocator.allocate(self.context, "m1.small", 1, 3)
+        self.assertEqual(sorted([bmm["id"] for bmm, reuse in claimed]),
+                         sorted([bmm["id"] for bmm in bmms]))
+
+    def test_allocate_too_many_claims_nothing(self):
+        bmms = [self._create_bmm("inactive") for i in xrange(2)]
+        self.assertRaises(exception.BareMetalMachineUnavailable,
+                          self.allocator.allocate,
+                          self.context, "m1.small", 1, 3)
+        for bmm in bmms:
+            self.assertEqual(self._status(bmm), "inactive")
+
+    def test_machine_claimed_by_another_worker(self):
+        first = self._create_bmm("inactive")
+        second = self._create_bmm("inactive")
+        orig_cas = db.bmm_compare_and_set_status
+
+        def racing_cas(context, bmm_id, old_status, new_status):
+            if bmm_id == first["id"]:
+                # another worker wins the race for the first machine
+                orig_cas(context, bmm_id, old_status, new_status)
+            return orig_cas(context, bmm_id, old_status, new_status)
+
+        self.stubs.Set(db, 'bmm_compare_and_set_status', racing_cas)
+        [(bmm, reuse)] = self.allocator.allocate(self.context, "m1.small", 1)
+        self.assertEqual(bmm["id"], second["id"])
+
+    def test_compare_and_set_status(self):
+        bmm = self._create_bmm("inactive")
+        self.assertTrue(db.bmm_compare_and_set_status(self.context,
+                                                      bmm["id"],
+                                                      "inactive",
+                                                      "processing"))
+        self.assertFalse(db.bmm_compare_and_set_status(self.context,
+                                                       bmm["id"],
+                                                       "inactive",
+                                                       "processing"))
+        self.assertEqual(self._status(bmm), "processing")
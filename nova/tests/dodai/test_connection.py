@@ -0,0 +1,324 @@
+# vim: tabstop=4 shiftwidth=4 softtabstop=4
+
+#    Licensed under the Apache License, Version 2.0 (the "License"); you may
+#    not use this file except in compliance with the License. You may obtain
+#    a copy of the License at
+#
+#         http://www.apache.org/licenses/LICENSE-2.0
+#
+#    Unless required by applicable law or agreed to in writing, software
+#    distributed under the License is distributed on an "AS IS" BASIS, WITHOUT
+#    WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied. See the
+#    License for the specific language governing permissions and limitations
+#    under the License.
+
+"""Tests for the dodai compute driver."""
+
+import os
+import shutil
+import tempfile
+
+import eventlet
+from eventlet import event
+
+from nova import context
+from nova import db
+from nova import exception
+from nova import flags
+from nova import test
+from nova.compute import instance_types
+from nova.compute import power_state
+from nova.compute import vm_states
+from nova.virt.dodai import connection
+from nova.virt.dodai import pipeline
+from nova.virt.dodai import power
+from nova.virt.dodai import timing
+
+
+FLAGS = flags.FLAGS
+
+
+class FakeBmcPool(object):
+    def __init__(self, statuses):
+        self.statuses = statuses
+        self.queries = 0
+
+    def status_all(self, ips, refresh=False):
+        self.queries += 1
+        return dict((ip, self.statuses.get(ip)) for ip in ips)
+
+
+class DodaiConnectionTestCase(test.TestCase):
+    def setUp(self):
+        super(DodaiConnectionTestCase, self).setUp()
+        self.context = context.get_admin_context()
+        self.conn = connection.DodaiConnection()
+        self.bmms = []
+        self.stubs.Set(db, 'bmm_get_all_by_instance_id_not_null',
+                       lambda context: self.bmms)
+
+    def _create_instance(self, vm_state, ipmi_ip):
+        instance = db.instance_create(self.context, {'vm_state': vm_state})
+        self.bmms.append({'instance_id': instance['id'], 'ipmi_ip': ipmi_ip})
+        return instance
+
+    def test_list_instances_detail(self):
+        active_off = self._create_instance(vm_states.ACTIVE, "10.0.0.1")
+        stopped_on = self._create_instance(vm_states.STOPPED, "10.0.0.2")
+        active_on = self._create_instance(vm_states.ACTIVE, "10.0.0.3")
+        unknown = self._create_instance(vm_states.ACTIVE, "10.0.0.4")
+        bmc_pool = FakeBmcPool({"10.0.0.1": "off",
+                                "10.0.0.2": "on",
+                                "10.0.0.3": "on"})
+        self.stubs.Set(power, 'get_bmc_pool', lambda: bmc_pool)
+
+        updates = []
+        orig_update_all = db.instance_update_all
+
+        def fake_update_all(context, instance_ids, values):
+            updates.append((sorted(instance_ids), values))
+            return orig_update_all(context, instance_ids, values)
+
+        self.stubs.Set(db, 'instance_update_all', fake_update_all)
+
+        infos = self.conn.list_instances_detail(self.context)
+        states = dict((info.name, info.state) for info in infos)
+
+        self.assertEqual(bmc_pool.queries, 1)
+        self.assertEqual(states[active_off['name']], power_state.SHUTOFF)
+        self.assertEqual(states[stopped_on['name']], power_state.RUNNING)
+        self.assertEqual(states[active_on['name']], power_state.RUNNING)
+        self.assertEqual(states[unknown['name']], power_state.NOSTATE)
+        self.assertTrue(([active_off['id']],
+                         {'vm_state': vm_states.STOPPED}) in updates)
+        self.assertTrue(([stopped_on['id']],
+                         {'vm_state': vm_states.ACTIVE}) in updates)
+
+        def _vm_state(instance):
+            return db.instance_get(self.context, instance['id'])['vm_state']
+
+        self.assertEqual(_vm_state(active_off), vm_states.STOPPED)
+        self.assertEqual(_vm_state(stopped_on), vm_states.ACTIVE)
+        self.assertEqual(_vm_state(active_on), vm_states.ACTIVE)
+        self.assertEqual(_vm_state(unknown), vm_states.ACTIVE)
+
+    def test_deploy_mode_defaults_to_copy(self):
+        self.assertEqual(self.conn._get_deploy_mode({"properties": {}}),
+                         ("copy", "none"))
+
+    def test_deploy_mode_from_image_properties(self):
+        image_meta = {"size": 1000,
+                      "properties": {"dodai_deploy_mode": "stream",
+                                     "dodai_image_compression": "gzip"}}
+        self.assertEqual(self.conn._get_deploy_mode(image_meta),
+                         ("stream", "gzip"))
+
+    def test_deploy_mode_copy_when_image_is_too_large(self):
+        self.flags(dodai_default_deploy_mode="stream",
+                   dodai_partition_root_gb=1)
+        image_meta = {"id": 1, "size": 2 * 1000 * 1000 * 1000,
+                      "properties": {}}
+        self.assertEqual(self.conn._get_deploy_mode(image_meta),
+                         ("copy", "none"))
+
+    def test_get_host_stats_counts_machines(self):
+        for zone, status in [("resource_pool", "inactive"),
+                             ("resource_pool", "active"),
+                             ("resource_pool", "processing"),
+                             ("zone1", "used")]:
+            db.bmm_create(self.context, {"instance_type": "m1.small",
+                                         "availability_zone": zone,
+                                         "status": status})
+        stats = self.conn.get_host_stats(refresh=True)
+        self.assertEqual(stats["dodai_machines"],
+                         {"m1.small": {"inactive": 1, "active": 1,
+                                       "processing": 1, "used": 1,
+                                       "error": 0, "free": 2}})
+        self.assertEqual(stats["dodai_zones"]["zone1"]["used"], 1)
+        self.assertEqual(stats["dodai_provisioning"], 0)
+        self.assertEqual(stats["dodai_image_cache"]["hits"], 0)
+        self.assertTrue("dodai_agent" in stats)
+        # the legacy capabilities are still reported
+        self.assertTrue("host_memory_free" in stats)
+
+        db.bmm_create(self.context, {"instance_type": "m1.small",
+                                     "availability_zone": "resource_pool",
+                                     "status": "inactive"})
+        stats = self.conn.get_host_stats()
+        self.assertEqual(stats["dodai_machines"]["m1.small"]["free"], 2)
+        stats = self.conn.get_host_stats(refresh=True)
+        self.assertEqual(stats["dodai_machines"]["m1.small"]["free"], 3)
+
+    def test_destroy_while_wipe_runs(self):
+        path = tempfile.mkdtemp()
+        self.conn.timer.log_path = os.path.join(path, "phases.log")
+        self.flags(dodai_wipe_strategy="quick")
+        instance = db.instance_create(self.context, {})
+        bmm = db.bmm_create(self.context, {"instance_type": "m1.small",
+                                           "instance_id": instance["id"],
+                                           "status": "used"})
+        wiping = event.Event()
+        wiped = event.Event()
+
+        def _delete_os(instance, bmm, strategy):
+            with self.conn.pipeline.phase(instance["id"], "delete", "wipe"):
+                wiping.send()
+                wiped.wait()
+
+        bmm_get = db.bmm_get
+
+        def _bmm_get(context, bmm_id):
+            # the wipe starts before the destroy is done
+            wiping.wait()
+            return bmm_get(context, bmm_id)
+
+        self.stubs.Set(self.conn, '_update_ofc_for_destroy',
+                       lambda context, bmm: None)
+        self.stubs.Set(self.conn, '_delete_os', _delete_os)
+        self.stubs.Set(connection.utils, 'execute', lambda *cmd: None)
+        self.stubs.Set(connection.db, 'bmm_get', _bmm_get)
+        try:
+            self.conn.destroy(self.context, instance, None)
+            self.assertEqual(self.conn.pipeline.status()["delete"],
+                             {"waiting": [], "running": [instance["id"]]})
+            wiped.send()
+            self.conn.wipe_queue.wait(bmm["id"])
+            records = timing.load(self.conn.timer.log_path)
+        finally:
+            shutil.rmtree(path)
+
+        self.assertEqual([(record["operation"], record["result"],
+                           sorted(record["phases"].keys()))
+                          for record in records],
+                         [("destroy", "success", []),
+                          ("wipe", "success", ["delete"])])
+
+    def test_init_host_runs_the_state_monitor(self):
+        self.flags(dodai_warm_pool_interval=0, ofc_service_url=None)
+        servers = []
+
+        class FakeServer(object):
+            def __init__(server, name, app, port, pool_size):
+                servers.append(app)
+
+            def start(server):
+                pass
+
+        self.stubs.Set(connection.wsgi, 'Server', FakeServer)
+        self.conn.init_host("host1")
+        self.assertEqual(len(servers), 1)
+        # reports wake the waiters of this process
+        self.assertTrue(servers[0].tracker is self.conn.state_tracker)
+
+    def test_failed_wipe_sets_machine_to_error(self):
+        path = tempfile.mkdtemp()
+        self.conn.timer.log_path = os.path.join(path, "phases.log")
+        self.flags(dodai_wipe_strategy="quick")
+        instance = db.instance_create(self.context, {})
+        bmm = db.bmm_create(self.context, {"name": "node1",
+                                           "instance_type": "m1.small",
+                                           "instance_id": instance["id"],
+                                           "status": "used"})
+
+        def _delete_os(instance, bmm, strategy):
+            raise exception.Error("no deleted report")
+
+        self.stubs.Set(self.conn, '_update_ofc_for_destroy',
+                       lambda context, bmm: None)
+        self.stubs.Set(self.conn, '_delete_os', _delete_os)
+        self.stubs.Set(connection.utils, 'execute', lambda *cmd: None)
+        self.stubs.Set(self.conn.warm_pool, 'reinstall',
+                       lambda *args: self.fail("reinstalled"))
+        try:
+            self.conn.destroy(self.context, instance, None)
+            instance_new = db.instance_create(
+                                self.context,
+                                {"vm_state": vm_states.BUILDING})
+
+            self.assertRaises(exception.Error,
+                              self.conn.add_to_resource_pool,
+                              self.context, instance_new, bmm)
+        finally:
+            shutil.rmtree(path)
+        bmm = db.bmm_get(self.context, bmm["id"])
+        self.assertEqual(bmm["status"], "error")
+        self.assertEqual(bmm["instance_id"], None)
+        self.assertRaises(exception.InstanceNotFound, db.instance_get,
+                          self.context, instance_new["id"])
+
+    def test_wipe_report_timeout_is_below_the_wipe_timeout(self):
+        self.assertTrue(FLAGS.dodai_wipe_report_timeout <
+                        FLAGS.dodai_wipe_timeout)
+
+    def test_reboot_waits_for_the_power_limit(self):
+        self.conn.pipeline = pipeline.ProvisioningPipeline({"power": 1})
+        instance = db.instance_create(self.context, {})
+        db.bmm_create(self.context, {"instance_id": instance["id"],
+                                     "ipmi_ip": "10.0.0.1"})
+        commands = []
+
+        class FakePowerManager(object):
+            def __init__(self, ip):
+                self.ip = ip
+
+            def reboot(self):
+                commands.append((self.ip, "reboot"))
+
+        self.stubs.Set(power, 'PowerManager', FakePowerManager)
+        with self.conn.pipeline.phase(0, "power"):
+            thread = eventlet.spawn(self.conn.reboot, instance, None)
+            eventlet.sleep(0)
+            self.assertEqual(self.conn.pipeline.status()["power"],
+                             {"waiting": [instance["id"]], "running": [0]})
+            self.assertEqual(commands, [])
+        thread.wait()
+        self.assertEqual(commands, [("10.0.0.1", "reboot")])
+
+    def _create_reservation(self, count):
+        inst_type = instance_types.get_instance_type_by_name("m1.small")
+        instances = [db.instance_create(self.context,
+                                        {"reservation_id": "r-1",
+                                         "instance_type_id": inst_type["id"],
+                                         "availability_zone": "resource_pool",
+                                         "vm_state": vm_states.BUILDING,
+                                         "host": FLAGS.host,
+                                         "image_ref": 1})
+                     for i in xrange(count)]
+        bmms = [db.bmm_create(self.context,
+                              {"name": "node%d" % i,
+                               "instance_type": "m1.small",
+                               "availability_zone": "resource_pool",
+                               "status": "inactive"})
+                for i in xrange(count)]
+        return instances, bmms
+
+    def test_max_count_launch_claims_all_machines_at_once(self):
+        instances, bmms = self._create_reservation(3)
+        counts = []
+        allocate = self.conn.allocator.allocate
+
+        def _allocate(context, instance_type, image_ref, count,
+                      for_resource_pool):
+            counts.append(count)
+            return allocate(context, instance_type, image_ref, count,
+                            for_resource_pool)
+
+        self.stubs.Set(self.conn.allocator, 'allocate', _allocate)
+        claims = [self.conn._select_machine(self.context, instance)
+                  for instance in instances]
+        self.assertEqual(counts, [3])
+        self.assertEqual(sorted([bmm["id"] for bmm, reuse in claims]),
+                         sorted([bmm["id"] for bmm in bmms]))
+        for bmm in bmms:
+            self.assertEqual(db.bmm_get(self.context, bmm["id"])["status"],
+                             "processing")
+
+    def test_claim_of_a_deleted_instance_is_released(self):
+        instances, bmms = self._create_reservation(2)
+        bmm, reuse = self.conn._select_machine(self.context, instances[0])
+        db.instance_destroy(self.context, instances[1]["id"])
+        self.conn.get_host_stats(refresh=True)
+        self.assertEqual(self.conn._claims, {})
+        statuses = [db.bmm_get(self.context, other["id"])["status"]
+                    for other in bmms if other["id"] != bmm["id"]]
+        self.assertEqual(statuses, ["inactive"])
@@ -0,0 +1,139 @@
+# vim: tabstop=4 shiftwidth=4 softtabstop=4
+
+#    Licensed under the Apache License, Version 2.0 (the "License"); you may
+#    not use this file except in compliance with the License. You may obtain
+#    a copy of the License at
+#
+#         http://www.apache.org/licenses/LICENSE-2.0
+#
+#    Unless required by applicable law or agreed to in writing, software
+#    distributed under the License is distributed on an "AS IS" BASIS, WITHOUT
+#    WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied. See the
+#    License for the specific language governing permissions and limitations
+#    under the License.
+
+"""Tests for the dodai image cache."""
+
+import hashlib
+import os
+import shutil
+import tempfile
+
+import eventlet
+
+from nova import exception
+from nova import test
+import nova.image
+from nova.virt import images
+from nova.virt.dodai import image_cache
+
+
+class FakeImageService(object):
+    def __init__(self):
+        self.images = {}
+        self.downloads = []
+
+    def add(self, image_id, data, checksum=None):
+        if checksum is None:
+            checksum = hashlib.md5(data).hexdigest()
+        self.images[image_id] = (data, checksum)
+
+    def show(self, context, image_id):
+        data, checksum = self.images[image_id]
+        return {"id": image_id, "name": "image", "checksum": checksum}
+
+    def get(self, context, image_id, f):
+        self.downloads.append(image_id)
+        data, checksum = self.images[image_id]
+        half = len(data) / 2
+        f.write(data[:half])
+        eventlet.sleep(0.01)
+        f.write(data[half:])
+        return self.show(context, image_id)
+
+
+class ImageCacheTestCase(test.TestCase):
+    def setUp(self):
+        super(ImageCacheTestCase, self).setUp()
+        self.base_path = tempfile.mkdtemp()
+        self.service = FakeImageService()
+        self.stubs.Set(nova.image, 'get_image_service',
+                       lambda context, image_ref: (self.service,
+                                                   str(image_ref)))
+        self.stubs.Set(images, 'show',
+                       lambda context, image_ref:
+                           self.service.show(context, str(image_ref)))
+        self.cache = image_cache.ImageCache(self.base_path, 0)
+
+    def tearDown(self):
+        shutil.rmtree(self.base_path)
+        super(ImageCacheTestCase, self).tearDown()
+
+    def _read(self, image_ref):
+        return open(self.cache.path(image_ref)).read()
+
+    def test_single_flight(self):
+        self.service.add("1", "x" * 100)
+        threads = [eventlet.spawn(self.cache.fetch, None, 1, "u", "p")
+                   for i in xrange(5)]
+        for thread in threads:
+            self.assertEqual(thread.wait()["id"], "1")
+
+        self.assertEqual(self.service.downloads, ["1"])
+        self.assertEqual(self._read(1), "x" * 100)
+        self.assertEqual(self.cache.metrics["misses"], 1)
+        self.assertEqual(self.cache.metrics["coalesced"], 4)
+        self.assertEqual(self.cache.metrics["bytes_downloaded"], 100)
+
+    def test_hit(self):
+        self.service.add("1", "data")
+        self.cache.fetch(None, 1, "u", "p")
+        self.cache.fetch(None, 1, "u", "p")
+        self.assertEqual(self.service.downloads, ["1"])
+        self.assertEqual(self.cache.metrics["hits"], 1)
+
+    def test_no_partial_file_while_downloading(self):
+        self.service.add("1", "data")
+        thread = eventlet.spawn(self.cache.fetch, None, 1, "u", "p")
+        eventlet.sleep(0)
+        self.assertFalse(os.path.exists(self.cache.path(1)))
+        thread.wait()
+        self.assertEqual(os.listdir(self.base_path), ["1"])
+
+    def test_checksum_mismatch(self):
+        self.service.add("1", "data", checksum="bad")
+        self.assertRaises(exception.ImageUnacceptable,
+                          self.cache.fetch, None, 1, "u", "p")
+        self.assertEqual(os.listdir(self.base_path), [])
+        self.assertEqual(self.cache.metrics["checksum_failures"], 1)
+
+    def test_evict_least_recently_used(self):
+        self.cache.max_size = 250
+        for image_id in ("1", "2", "3"):
+            self.service.add(image_id, "x" * 100)
+        self.cache.fetch(None, 1, "u", "p")
+        self.cache.fetch(None, 2, "u", "p")
+        self.cache.release(1)
+        self.cache.release(2)
+        os.utime(self.cache.path(1), (0, 0))
+        os.utime(self.cache.path(2), (1, 1))
+
+        self.cache.fetch(None, 3, "u", "p")
+        self.assertEqual(sorted(os.listdir(self.base_path)), ["2", "3"])
+        self.assertEqual(self.cache.metrics["evictions"], 1)
+        stats = self.cache.stats()
+        self.assertEqual(stats["evictions"], 1)
+        self.assertEqual(stats["misses"], 3)
+        self.assertEqual(stats["images_in_use"], 1)
+
+    def test_images_in_use_are_kept(self):
+        self.cache.max_size = 150
+        for image_id in ("1", "2"):
+            self.service.add(image_id, "x" * 100)
+        self.cache.fetch(None, 1, "u", "p")
+        self.cache.fetch(None, 2, "u", "p")
+        self.assertEqual(sorted(os.listdir(self.base_path)), ["1", "2"])
+
+        self.cache.release(1)
+        self.cache.evict()
+        self.assertEqual(os.listdir(self.base_path), ["2"])
@@ -0,0 +1,78 @@
+# vim: tabstop=4 shiftwidth=4 softtabstop=4
+
+#    Licensed under the Apache License, Version 2.0 (the "License"); you may
+#    not use this file except in compliance with the License. You may obtain
+#    a copy of the License at
+#
+#         http://www.apache.org/licenses/LICENSE-2.0
+#
+#    Unless required by applicable law or agreed to in writing, software
+#    distributed under the License is distributed on an "AS IS" BASIS, WITHOUT
+#    WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied. See the
+#    License for the specific language governing permissions and limitations
+#    under the License.
+
+"""Tests for multicast image distribution of dodai."""
+
+import eventlet
+
+from nova import exception
+from nova import test
+from nova import utils
+from nova.virt.dodai import multicast
+
+
+class MulticastDistributorTestCase(test.TestCase):
+    def setUp(self):
+        super(MulticastDistributorTestCase, self).setUp()
+        self.flags(dodai_multicast_portbase=9000, dodai_multicast_sessions=2)
+        self.senders = []
+        self.stubs.Set(utils, 'execute', self._fake_execute)
+        self.distributor = multicast.MulticastDistributor(window=0.01,
+                                                          max_wait=60)
+
+    def tearDown(self):
+        # let the sessions of this test finish sending
+        eventlet.sleep(0.1)
+        super(MulticastDistributorTestCase, self).tearDown()
+
+    def _fake_execute(self, *cmd, **kwargs):
+        self.senders.append(cmd)
+        eventlet.sleep(0.05)
+        return "", ""
+
+    def _option(self, cmd, name):
+        return cmd[list(cmd).index(name) + 1]
+
+    def test_one_session_per_image(self):
+        ports = [self.distributor.join(1, "/images/1") for i in xrange(3)]
+        other = self.distributor.join(2, "/images/2")
+        self.assertEqual(ports, [9000, 9000, 9000])
+        self.assertEqual(other, 9002)
+
+        eventlet.sleep(0.03)
+        self.assertEqual(len(self.senders), 2)
+        sender = [cmd for cmd in self.senders if "/images/1" in cmd][0]
+        self.assertEqual(self._option(sender, "--min-receivers"), 3)
+        self.assertEqual(self._option(sender, "--portbase"), 9000)
+        self.assertEqual(self._option(sender, "--max-wait"), 60)
+
+    def test_new_session_after_window(self):
+        self.distributor.join(1, "/images/1")
+        eventlet.sleep(0.03)
+        # 9000 is still being sent
+        self.assertEqual(self.distributor.join(1, "/images/1"), 9002)
+        eventlet.sleep(0.1)
+        self.assertEqual(len(self.senders), 2)
+
+    def test_no_free_port(self):
+        self.distributor.join(1, "/images/1")
+        self.distributor.join(2, "/images/2")
+        self.assertRaises(exception.Error, self.distributor.join, 3,
+                          "/images/3")
+
+    def test_port_reused_after_send(self):
+        self.distributor.join(1, "/images/1")
+        self.distributor.join(2, "/images/2")
+        eventlet.sleep(0.1)
+        self.assertTrue(self.distributor.join(3, "/images/3") in (9000, 9002))
@@ -0,0 +1,171 @@
+# vim: tabstop=4 shiftwidth=4 softtabstop=4
+
+#    Licensed under the Apache License, Version 2.0 (the "License"); you may
+#    not use this file except in compliance with the License. You may obtain
+#    a copy of the License at
+#
+#         http://www.apache.org/licenses/LICENSE-2.0
+#
+#    Unless required by applicable law or agreed to in writing, software
+#    distributed under the License is distributed on an "AS IS" BASIS, WITHOUT
+#    WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied. See the
+#    License for the specific language governing permissions and limitations
+#    under the License.
+
+"""Tests for the OpenFlow controller client of dodai."""
+
+import tempfile
+
+from nova import context
+from nova import db
+from nova import test
+from nova.virt.dodai import ofc_utils
+
+
+class FakeObject(object):
+    def __init__(self, **kwargs):
+        self.__dict__.update(kwargs)
+
+
+class FakeService(object):
+    def __init__(self, ofc):
+        self.ofc = ofc
+
+    def showRegion(self):
+        self.ofc.calls.append("showRegion")
+        return [FakeObject(regionName=name) for name in sorted(self.ofc.regions)]
+
+    def clearServerPort(self, dpid, port):
+        self.ofc.ports.pop((dpid, port), None)
+
+    def showSwitchDatapathId(self):
+        self.ofc.calls.append("showSwitchDatapathId")
+        return [FakeObject(dpid=dpid)
+                for dpid in set(dpid for dpid, port in self.ofc.ports)]
+
+    def showPorts(self, dpid):
+        self.ofc.calls.append("showPorts")
+        return [FakeObject(type="ServerPort", regionName=region_name)
+                for (port_dpid, port), region_name in self.ofc.ports.items()
+                if port_dpid == dpid]
+
+    def createRegion(self, name):
+        self.ofc.regions.add(name)
+
+    def destroyRegion(self, name):
+        self.ofc.regions.discard(name)
+
+    def setOuterPortAssociationSetting(self, *args):
+        pass
+
+    def clearOuterPortAssociationSetting(self, *args):
+        pass
+
+    def save(self):
+        pass
+
+
+class FakeOFC(object):
+    """Stands in for suds.client.Client and counts WSDL parses."""
+
+    def __init__(self):
+        self.regions = set()
+        # (dpid, port) -> region name
+        self.ports = {}
+        self.calls = []
+        self.parses = 0
+
+    def client(self, url, cache=None):
+        self.parses += 1
+        return FakeClient(self)
+
+
+class FakeClient(object):
+    def __init__(self, ofc):
+        self.ofc = ofc
+        self.service = FakeService(ofc)
+
+    def clone(self):
+        return FakeClient(self.ofc)
+
+
+class OFCUtilsTestCase(test.TestCase):
+    def setUp(self):
+        super(OFCUtilsTestCase, self).setUp()
+        self.flags(dodai_ofc_wsdl_cache_path=tempfile.mkdtemp())
+        self.ofc = FakeOFC()
+        self.stubs.Set(ofc_utils, 'Client', self.ofc.client)
+        self.stubs.Set(ofc_utils, '_POOLS', {})
+        self.stubs.Set(ofc_utils.db, 'switch_get_all', lambda ctxt: [])
+        self.url = "http://ofc/service"
+
+    def test_wsdl_is_parsed_once(self):
+        pool = ofc_utils.get_pool(self.url)
+        with pool.item() as first:
+            with pool.item() as second:
+                self.assertNotEqual(first, second)
+        ofc_utils.has_region(self.url, "a")
+        self.assertEqual(self.ofc.parses, 1)
+
+    def test_has_region_is_cached(self):
+        self.ofc.regions.add("a")
+        self.assertTrue(ofc_utils.has_region(self.url, "a"))
+        self.assertTrue(ofc_utils.has_region(self.url, "a"))
+        self.assertEqual(self.ofc.calls, ["showRegion"])
+
+    def test_missing_region_is_looked_up_again(self):
+        self.assertFalse(ofc_utils.has_region(self.url, "a"))
+        # created by another process
+        self.ofc.regions.add("a")
+        self.assertTrue(ofc_utils.has_region(self.url, "a"))
+        self.assertEqual(self.ofc.calls, ["showRegion", "showRegion"])
+
+    def test_refresh_bypasses_the_cache(self):
+        self.ofc.regions.add("a")
+        self.assertTrue(ofc_utils.has_region(self.url, "a"))
+        # removed by another process
+        self.ofc.regions.discard("a")
+        self.assertFalse(ofc_utils.has_region(self.url, "a", refresh=True))
+
+    def test_region_cache_expires(self):
+        self.flags(dodai_ofc_region_cache_ttl=0)
+        ofc_utils.has_region(self.url, "a")
+        ofc_utils.has_region(self.url, "a")
+        self.assertEqual(self.ofc.calls, ["showRegion", "showRegion"])
+
+    def test_create_and_remove_invalidate_regions(self):
+        self.assertFalse(ofc_utils.has_region(self.url, "a"))
+        ofc_utils.create_region(self.url, "a", 100)
+        self.assertTrue(ofc_utils.has_region(self.url, "a"))
+        ofc_utils.remove_region(self.url, "a", 100)
+        self.assertFalse(ofc_utils.has_region(self.url, "a"))
+
+    def test_terminate_keeps_region_in_use(self):
+        self.ofc.regions.add("a")
+        self.ofc.ports[("1", 1)] = "a"
+        self.ofc.ports[("1", 2)] = "a"
+        db.bmm_create(context.get_admin_context(),
+                      {"availability_zone": "a"})
+        ofc_utils.update_for_terminate_instance(self.url, "a", 1, 1,
+                                                "1", "1", 100)
+        self.assertTrue("a" in self.ofc.regions)
+        self.assertFalse("showPorts" in self.ofc.calls)
+
+    def test_terminate_removes_unused_region(self):
+        self.ofc.regions.add("a")
+        self.ofc.ports[("1", 1)] = "a"
+        ofc_utils.update_for_terminate_instance(self.url, "a", 1, 1,
+                                                "1", "1", 100)
+        self.assertFalse("a" in self.ofc.regions)
+        self.assertFalse("showPorts" in self.ofc.calls)
+
+    def test_reconcile_regions(self):
+        ctxt = context.get_admin_context()
+        db.bmm_create(ctxt, {"availability_zone": "a"})
+        db.bmm_create(ctxt, {"availability_zone": "b"})
+        db.bmm_create(ctxt, {"availability_zone": "resource_pool"})
+        self.ofc.ports[("1", 1)] = "a"
+        self.ofc.ports[("2", 1)] = "c"
+        only_db, only_ofc = ofc_utils.reconcile_regions(self.url)
+        self.assertEqual(only_db, set(["b"]))
+        self.assertEqual(only_ofc, set(["c"]))
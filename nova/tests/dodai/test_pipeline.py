@@ -0,0 +1,96 @@
+# vim: tabstop=4 shiftwidth=4 softtabstop=4
+
+#    Licensed under the Apache License, Version 2.0 (the "License"); you may
+#    not use this file except in compliance with the License. You may obtain
+#    a copy of the License at
+#
+#         http://www.apache.org/licenses/LICENSE-2.0
+#
+#    Unless required by applicable law or agreed to in writing, software
+#    distributed under the License is distributed on an "AS IS" BASIS, WITHOUT
+#    WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied. See the
+#    License for the specific language governing permissions and limitations
+#    under the License.
+
+"""Tests for the dodai provisioning pipeline."""
+
+import eventlet
+from eventlet import timeout
+
+from nova import exception
+from nova import test
+from nova.virt.dodai import pipeline
+from nova.virt.dodai import timing
+
+
+class ProvisioningPipelineTestCase(test.TestCase):
+    def test_parse_limits(self):
+        self.assertEqual(pipeline.parse_limits(["image:4", "power:16"]),
+                         {"image": 4, "power": 16})
+        self.assertRaises(exception.Error, pipeline.parse_limits, ["image"])
+        self.assertRaises(exception.Error, pipeline.parse_limits,
+                          ["unknown:1"])
+
+    def test_phase_limit(self):
+        p = pipeline.ProvisioningPipeline({"image": 2})
+        running = []
+        peak = []
+
+        def _provision(instance_id):
+            with p.phase(instance_id, "image"):
+                running.append(instance_id)
+                peak.append(len(running))
+                eventlet.sleep(0.01)
+                running.remove(instance_id)
+
+        threads = [eventlet.spawn(_provision, i) for i in xrange(6)]
+        eventlet.sleep(0)
+        status = p.status()
+        self.assertEqual(len(status["image"]["running"]), 2)
+        self.assertEqual(len(status["image"]["waiting"]), 4)
+
+        for thread in threads:
+            thread.wait()
+        self.assertEqual(max(peak), 2)
+        self.assertEqual(len(peak), 6)
+
+    def test_unlimited_phase(self):
+        p = pipeline.ProvisioningPipeline({"image": 0})
+        with p.phase(1, "image"):
+            with p.phase(2, "image"):
+                self.assertEqual(sorted(p.status()["image"]["running"]),
+                                 [1, 2])
+
+    def test_nested_phase(self):
+        p = pipeline.ProvisioningPipeline({})
+        with p.phase(1, "install"):
+            with p.phase(1, "power"):
+                self.assertEqual(p.status()["power"]["running"], [1])
+                self.assertEqual(p.status()["install"]["running"], [])
+            self.assertEqual(p.status()["install"]["running"], [1])
+        for phase, states in p.status().iteritems():
+            self.assertEqual(states, {"waiting": [], "running": []})
+
+    def test_phase_released_on_error(self):
+        p = pipeline.ProvisioningPipeline({"power": 1})
+
+        def _fail():
+            with p.phase(1, "power"):
+                raise exception.Error()
+
+        self.assertRaises(exception.Error, _fail)
+        with timeout.Timeout(1):
+            with p.phase(2, "power"):
+                pass
+
+    def test_phases_are_timed(self):
+        timer = timing.PhaseTimer("")
+        timer.start(1, "spawn")
+        p = pipeline.ProvisioningPipeline({"image": 1}, timer)
+        with p.phase(1, "image"):
+            with p.phase(1, "pxe"):
+                pass
+
+        record = timer.finish(1, "spawn")
+        self.assertEqual(sorted(record["phases"].keys()),
+                         ["image", "image_wait", "pxe"])
@@ -0,0 +1,126 @@
+# vim: tabstop=4 shiftwidth=4 softtabstop=4
+
+#    Licensed under the Apache License, Version 2.0 (the "License"); you may
+#    not use this file except in compliance with the License. You may obtain
+#    a copy of the License at
+#
+#         http://www.apache.org/licenses/LICENSE-2.0
+#
+#    Unless required by applicable law or agreed to in writing, software
+#    distributed under the License is distributed on an "AS IS" BASIS, WITHOUT
+#    WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied. See the
+#    License for the specific language governing permissions and limitations
+#    under the License.
+
+"""Tests for dodai IPMI power management."""
+
+import eventlet
+
+from nova import exception
+from nova import test
+from nova.virt.dodai import power
+
+
+class FakeIpmitool(object):
+    """Stands for the ipmitool process of a BmcPoolTestCase."""
+
+    def __init__(self, test, cmd, **kwargs):
+        self.test = test
+        self.ip = cmd[cmd.index("-H") + 1]
+        self.subcommand = cmd[-1]
+        self.returncode = None
+        self.killed = False
+        self.reaped = False
+        test.processes.append(self)
+
+    def communicate(self):
+        self.test.calls.append((self.ip, self.subcommand))
+        if self.ip in self.test.hung:
+            eventlet.sleep(10)
+        eventlet.sleep(0.01)
+        self.returncode = 0
+        power = self.test.power
+        if self.subcommand == "status":
+            return ("Chassis Power is %s\n" % power.get(self.ip, "off"), "")
+        power[self.ip] = self.subcommand == "on" and "on" or "off"
+        return ("Chassis Power Control: Up/On\n", "")
+
+    def kill(self):
+        self.killed = True
+
+    def wait(self):
+        self.reaped = True
+        return self.returncode
+
+
+class BmcPoolTestCase(test.TestCase):
+    def setUp(self):
+        super(BmcPoolTestCase, self).setUp()
+        self.calls = []
+        self.power = {}
+        self.hung = set()
+        self.processes = []
+        self.stubs.Set(power.subprocess, 'Popen',
+                       lambda cmd, **kwargs: FakeIpmitool(self, cmd,
+                                                          **kwargs))
+        self.pool = power.BmcPool(pool_size=4, cache_ttl=60, ipmi_timeout=1)
+
+    def test_status(self):
+        self.power["10.0.0.1"] = "on"
+        self.assertEqual(self.pool.status("10.0.0.1"), "on")
+
+    def test_status_is_cached(self):
+        self.pool.status("10.0.0.1")
+        self.pool.status("10.0.0.1")
+        self.assertEqual(len(self.calls), 1)
+
+    def test_refresh_bypasses_cache(self):
+        self.pool.status("10.0.0.1")
+        self.pool.status("10.0.0.1", refresh=True)
+        self.assertEqual(len(self.calls), 2)
+
+    def test_power_command_invalidates_cache(self):
+        self.assertEqual(self.pool.status("10.0.0.1"), "off")
+        self.pool.execute("10.0.0.1", "on")
+        self.assertEqual(self.pool.status("10.0.0.1"), "on")
+
+    def test_concurrent_queries_are_coalesced(self):
+        threads = [eventlet.spawn(self.pool.status, "10.0.0.1")
+                   for i in xrange(5)]
+        results = [thread.wait() for thread in threads]
+        self.assertEqual(results, ["off"] * 5)
+        self.assertEqual(len(self.calls), 1)
+
+    def test_status_all(self):
+        ips = ["10.0.0.%d" % i for i in xrange(10)]
+        self.power["10.0.0.3"] = "on"
+        statuses = self.pool.status_all(ips)
+        self.assertEqual(len(statuses), 10)
+        self.assertEqual(statuses["10.0.0.3"], "on")
+        self.assertEqual(statuses["10.0.0.4"], "off")
+
+    def test_hung_bmc_does_not_stall_others(self):
+        self.hung.add("10.0.0.2")
+        statuses = self.pool.status_all(["10.0.0.1", "10.0.0.2"])
+        self.assertEqual(statuses["10.0.0.1"], "off")
+        self.assertEqual(statuses["10.0.0.2"], None)
+
+    def test_single_status_raises_timeout(self):
+        self.hung.add("10.0.0.2")
+        self.assertRaises(exception.BareMetalMachinePowerTimeout,
+                          self.pool.status, "10.0.0.2")
+
+    def test_hung_ipmitool_is_killed(self):
+        self.hung.add("10.0.0.2")
+        self.assertRaises(exception.BareMetalMachinePowerTimeout,
+                          self.pool.status, "10.0.0.2")
+        process = self.processes[0]
+        self.assertTrue(process.killed)
+        self.assertTrue(process.reaped)
+
+    def test_power_manager_uses_pool(self):
+        manager = power.PowerManager("10.0.0.1", self.pool)
+        manager.on()
+        self.assertEqual(manager.status(), "on")
+        manager.soft_off()
+        self.assertEqual(manager.status(), "off")
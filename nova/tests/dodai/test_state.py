@@ -0,0 +1,179 @@
+# vim: tabstop=4 shiftwidth=4 softtabstop=4
+
+#    Licensed under the Apache License, Version 2.0 (the "License"); you may
+#    not use this file except in compliance with the License. You may obtain
+#    a copy of the License at
+#
+#         http://www.apache.org/licenses/LICENSE-2.0
+#
+#    Unless required by applicable law or agreed to in writing, software
+#    distributed under the License is distributed on an "AS IS" BASIS, WITHOUT
+#    WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied. See the
+#    License for the specific language governing permissions and limitations
+#    under the License.
+
+"""Tests for the dodai install state tracker."""
+
+import os
+import shutil
+import tempfile
+import time
+
+import eventlet
+
+from nova import exception
+from nova import test
+from nova import utils
+from nova.virt.dodai import state
+
+
+class StateTrackerTestCase(test.TestCase):
+    def setUp(self):
+        super(StateTrackerTestCase, self).setUp()
+        self.instances_path = tempfile.mkdtemp()
+        self.log_path = os.path.join(self.instances_path, "states.log")
+        self.tracker = state.StateTracker(self.instances_path, self.log_path)
+
+    def tearDown(self):
+        shutil.rmtree(self.instances_path)
+        super(StateTrackerTestCase, self).tearDown()
+
+    def test_get_state_without_report(self):
+        self.assertEqual(self.tracker.get_state(1), "")
+
+    def test_set_and_get_state(self):
+        self.tracker.set_state(1, "install")
+        self.assertEqual(self.tracker.get_state(1), "install")
+
+    def test_wait_returns_current_state(self):
+        self.tracker.set_state(1, "installed")
+        self.assertEqual(self.tracker.wait_for_state(1, "installed"),
+                         "installed")
+
+    def test_set_state_wakes_waiter(self):
+        waiter = eventlet.spawn(self.tracker.wait_for_state, 1,
+                                "install", interval=60)
+        eventlet.sleep(0)
+        start = time.time()
+        self.tracker.set_state(1, "install")
+        self.assertEqual(waiter.wait(), "install")
+        self.assertTrue(time.time() - start < 5)
+
+    def test_wait_ignores_other_states(self):
+        waiter = eventlet.spawn(self.tracker.wait_for_state, 1,
+                                ["installed"], interval=60)
+        eventlet.sleep(0)
+        self.tracker.set_state(1, "install")
+        eventlet.sleep(0)
+        self.assertFalse(waiter.dead)
+        self.tracker.set_state(1, "installed")
+        self.assertEqual(waiter.wait(), "installed")
+
+    def test_wait_falls_back_to_polling(self):
+        waiter = eventlet.spawn(self.tracker.wait_for_state, 1,
+                                "deleted", interval=0.1)
+        eventlet.sleep(0)
+        # Written by another process: nobody is notified.
+        other = state.StateTracker(self.instances_path, "")
+        other.set_state(1, "deleted")
+        self.assertEqual(waiter.wait(), "deleted")
+
+    def test_check_aborts_wait(self):
+        def _check():
+            raise exception.InstanceNotFound(instance_id=1)
+
+        self.assertRaises(exception.InstanceNotFound,
+                          self.tracker.wait_for_state, 1, "installed",
+                          check=_check)
+
+    def test_wait_gives_up_at_deadline(self):
+        start = time.time()
+        self.assertRaises(exception.Error,
+                          self.tracker.wait_for_state, 1, "deleted",
+                          interval=0.05, deadline=0.2)
+        self.assertTrue(time.time() - start < 5)
+
+    def test_monitor_app_records_state(self):
+        app = state.StateMonitorApp(self.tracker)
+        responses = []
+
+        def start_response(status, headers):
+            responses.append(status)
+
+        app({"PATH_INFO": "/1/install_reboot"}, start_response)
+        self.assertEqual(responses, ["200 OK"])
+        self.assertEqual(self.tracker.get_state(1), "install_reboot")
+
+    def test_monitor_app_rejects_bad_path(self):
+        app = state.StateMonitorApp(self.tracker)
+        responses = []
+
+        def start_response(status, headers):
+            responses.append(status)
+
+        app({"PATH_INFO": "/1"}, start_response)
+        self.assertEqual(responses, ["400 Bad Request"])
+
+    def test_monitor_app_rejects_unknown_state(self):
+        app = state.StateMonitorApp(self.tracker)
+        responses = []
+
+        def start_response(status, headers):
+            responses.append(status)
+
+        app({"PATH_INFO": "/1/rebooting"}, start_response)
+        app({"PATH_INFO": "/../installed"}, start_response)
+        self.assertEqual(responses, ["400 Bad Request"] * 2)
+        self.assertEqual(self.tracker.get_state(1), "")
+
+    def test_transitions_are_logged_and_timed(self):
+        self.tracker.set_state(1, "install")
+        self.tracker.set_state(1, "install_reboot")
+        self.tracker.set_state(1, "installed")
+        self.tracker.set_state(1, "deleted")
+
+        lines = [line.split()[1:] for line in open(self.log_path)]
+        self.assertEqual(lines, [["1", "-", "install"],
+                                 ["1", "install", "install_reboot"],
+                                 ["1", "install_reboot", "installed"],
+                                 ["1", "installed", "deleted"]])
+
+        stats = self.tracker.stats()
+        self.assertEqual(sorted(stats.keys()), ["install", "install_reboot"])
+        self.assertEqual(stats["install"]["count"], 1)
+        self.assertEqual(stats["install"]["buckets"][0], ("30", 1))
+        self.assertEqual(self.tracker._last, {})
+
+    def test_durations_are_measured_within_a_run(self):
+        self.tracker.set_state(1, "install")
+        self.tracker.set_state(1, "install_reboot")
+        self.tracker.set_state(1, "installed")
+        self.assertEqual(self.tracker._last, {})
+
+        self.tracker.set_state(1, "install")
+        self.tracker._last["1"] = ("install", time.time() - 100)
+        self.tracker.set_state(1, "install")
+        self.tracker.set_state(1, "deleted")
+        self.assertEqual(self.tracker._last, {})
+
+        stats = self.tracker.stats()
+        self.assertEqual(stats["install"]["count"], 1)
+        self.assertEqual(stats["install_reboot"]["count"], 1)
+        self.assertTrue(stats["install"]["sum"] < 30)
+
+    def test_monitor_app_returns_stats(self):
+        app = state.StateMonitorApp(self.tracker)
+        self.tracker.set_state(1, "install")
+        self.tracker.set_state(1, "install_reboot")
+
+        body = app({"PATH_INFO": "/stats"}, lambda status, headers: None)
+        self.assertEqual(utils.loads(body)["install"]["count"], 1)
+
+    def test_histogram(self):
+        histogram = state.Histogram((10, 100))
+        for value in (5, 10, 50, 500):
+            histogram.observe(value)
+        self.assertEqual(histogram.to_dict(),
+                         {"count": 4,
+                          "sum": 565.0,
+                          "buckets": [("10", 2), ("100", 1), ("inf", 1)]})
@@ -0,0 +1,62 @@
+# vim: tabstop=4 shiftwidth=4 softtabstop=4
+
+#    Licensed under the Apache License, Version 2.0 (the "License"); you may
+#    not use this file except in compliance with the License. You may obtain
+#    a copy of the License at
+#
+#         http://www.apache.org/licenses/LICENSE-2.0
+#
+#    Unless required by applicable law or agreed to in writing, software
+#    distributed under the License is distributed on an "AS IS" BASIS, WITHOUT
+#    WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied. See the
+#    License for the specific language governing permissions and limitations
+#    under the License.
+
+"""Tests for the dodai install script templates."""
+
+import os
+import shutil
+import stat
+import tempfile
+
+from nova import exception
+from nova import test
+from nova.virt.dodai import template
+
+
+class TemplateTestCase(test.TestCase):
+    def setUp(self):
+        super(TemplateTestCase, self).setUp()
+        self.path = tempfile.mkdtemp()
+
+    def tearDown(self):
+        shutil.rmtree(self.path)
+        super(TemplateTestCase, self).tearDown()
+
+    def test_render(self):
+        tmpl = template.Template("a=@A@ b=@B@ a=@A@ $@ x@y", "t")
+        self.assertEqual(tmpl.placeholders, frozenset(["A", "B"]))
+        self.assertEqual(tmpl.render({"A": 1, "B": "@A@"}),
+                         "a=1 b=@A@ a=1 $@ x@y")
+
+    def test_render_missing_placeholder(self):
+        tmpl = template.Template("@A@ @B@", "t")
+        self.assertRaises(exception.Error, tmpl.render, {"A": 1})
+
+    def test_write_replaces_file(self):
+        dest = os.path.join(self.path, "instances", "1", "create.sh")
+        tmpl = template.Template("id=@ID@\n", "t")
+        tmpl.write(dest, {"ID": 1})
+        tmpl.write(dest, {"ID": 2})
+
+        self.assertEqual(open(dest).read(), "id=2\n")
+        self.assertEqual(stat.S_IMODE(os.stat(dest).st_mode), 0644)
+        self.assertEqual(os.listdir(os.path.dirname(dest)), ["create.sh"])
+
+    def test_template_set(self):
+        templates = template.TemplateSet()
+        self.assertTrue("INSTANCE_ID" in
+                        templates.get("create.sh").placeholders)
+        self.assertEqual(templates.get("pxeboot_start").placeholders,
+                         frozenset())
+        self.assertRaises(exception.Error, templates.get, "unknown")
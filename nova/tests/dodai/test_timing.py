@@ -0,0 +1,87 @@
+# vim: tabstop=4 shiftwidth=4 softtabstop=4
+
+#    Licensed under the Apache License, Version 2.0 (the "License"); you may
+#    not use this file except in compliance with the License. You may obtain
+#    a copy of the License at
+#
+#         http://www.apache.org/licenses/LICENSE-2.0
+#
+#    Unless required by applicable law or agreed to in writing, software
+#    distributed under the License is distributed on an "AS IS" BASIS, WITHOUT
+#    WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied. See the
+#    License for the specific language governing permissions and limitations
+#    under the License.
+
+"""Tests for the timing of dodai provisioning phases."""
+
+import os
+import shutil
+import tempfile
+
+from nova import test
+from nova.notifier import test_notifier
+from nova.virt.dodai import timing
+
+
+class PhaseTimerTestCase(test.TestCase):
+    def setUp(self):
+        super(PhaseTimerTestCase, self).setUp()
+        self.flags(notification_driver='nova.notifier.test_notifier')
+        test_notifier.NOTIFICATIONS = []
+        self.path = tempfile.mkdtemp()
+        self.log_path = os.path.join(self.path, "phases.log")
+        self.timer = timing.PhaseTimer(self.log_path)
+
+    def tearDown(self):
+        shutil.rmtree(self.path)
+        super(PhaseTimerTestCase, self).tearDown()
+
+    def test_finish_publishes_and_logs(self):
+        self.timer.start(1, "spawn", instance_type="m1", image_ref=2)
+        self.timer.record(1, "spawn", "image", 3.0)
+        self.timer.record(1, "spawn", "image", 1.0)
+        self.timer.finish(1, "spawn")
+
+        self.assertEqual(len(test_notifier.NOTIFICATIONS), 1)
+        message = test_notifier.NOTIFICATIONS[0]
+        self.assertEqual(message["event_type"], "dodai.instance.spawn")
+        self.assertEqual(message["payload"]["phases"], {"image": 4.0})
+
+        records = timing.load(self.log_path)
+        self.assertEqual(len(records), 1)
+        self.assertEqual(records[0]["instance_type"], "m1")
+        self.assertEqual(records[0]["result"], "success")
+
+    def test_record_without_start_is_ignored(self):
+        self.timer.record(1, "spawn", "image", 3.0)
+        self.assertEqual(self.timer.finish(1, "spawn"), None)
+        self.assertEqual(test_notifier.NOTIFICATIONS, [])
+
+    def test_operations_of_an_instance_are_kept_apart(self):
+        self.timer.start(1, "destroy")
+        self.timer.start(1, "wipe", strategy="quick")
+        self.timer.record(1, "wipe", "delete", 2.0)
+        self.assertEqual(self.timer.finish(1, "destroy")["phases"], {})
+        record = self.timer.finish(1, "wipe")
+        self.assertEqual(record["phases"], {"delete": 2.0})
+        self.assertEqual(record["strategy"], "quick")
+
+    def test_percentile(self):
+        values = range(1, 101)
+        self.assertEqual(timing.percentile(values, 50), 50)
+        self.assertEqual(timing.percentile(values, 95), 95)
+        self.assertEqual(timing.percentile(values, 99), 99)
+        self.assertEqual(timing.percentile([7], 99), 7)
+        self.assertEqual(timing.percentile([], 50), None)
+
+    def test_report(self):
+        records = [{"operation": "spawn", "instance_type": "m1",
+                    "phases": {"image": seconds}, "total": seconds * 2}
+                   for seconds in (1.0, 2.0, 3.0)]
+        records.append({"operation": "destroy", "instance_type": "m1",
+                        "phases": {"delete": 5.0}, "total": 5.0})
+
+        rows = timing.report(records, "instance_type", "spawn")
+        self.assertEqual(rows, [("m1", "image", 3, 2.0, 3.0, 3.0),
+                                ("m1", "total", 3, 4.0, 6.0, 6.0)])
+        self.assertEqual(len(timing.report(records)), 3)
@@ -0,0 +1,145 @@
+# vim: tabstop=4 shiftwidth=4 softtabstop=4
+
+#    Licensed under the Apache License, Version 2.0 (the "License"); you may
+#    not use this file except in compliance with the License. You may obtain
+#    a copy of the License at
+#
+#         http://www.apache.org/licenses/LICENSE-2.0
+#
+#    Unless required by applicable law or agreed to in writing, software
+#    distributed under the License is distributed on an "AS IS" BASIS, WITHOUT
+#    WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied. See the
+#    License for the specific language governing permissions and limitations
+#    under the License.
+
+"""Tests for the warm pool of dodai machines."""
+
+import eventlet
+
+from nova import context
+from nova import db
+from nova import flags
+from nova import test
+from nova.compute import instance_types
+from nova.virt.dodai import warm_pool
+
+
+FLAGS = flags.FLAGS
+
+
+class FakeDriver(object):
+    def __init__(self):
+        self.installs = []
+        self.running = 0
+        self.peak = 0
+
+    def _install_machine(self, context, instance, bmm, cluster_name,
+                         vlan_id, update_instance=False):
+        self.running += 1
+        self.peak = max(self.peak, self.running)
+        eventlet.sleep(0.01)
+        self.running -= 1
+        self.installs.append((bmm["id"], str(instance["image_ref"])))
+        db.bmm_update(context, bmm["id"], {"status": "active",
+                                           "instance_id": instance["id"]})
+
+
+class WarmPoolManagerTestCase(test.TestCase):
+    def setUp(self):
+        super(WarmPoolManagerTestCase, self).setUp()
+        self.flags(dodai_warm_pool_images=2,
+                   dodai_warm_pool_max_per_image=2,
+                   dodai_default_image=1)
+        self.context = context.get_admin_context()
+        self.driver = FakeDriver()
+        self.manager = warm_pool.WarmPoolManager(self.driver, concurrency=2)
+
+    def _create_bmm(self, status="inactive", image_ref=None):
+        values = {"instance_type": "m1.small",
+                  "availability_zone": "resource_pool",
+                  "status": status}
+        if image_ref is not None:
+            instance = db.instance_create(self.context,
+                                          {"image_ref": image_ref})
+            values["instance_id"] = instance["id"]
+        return db.bmm_create(self.context, values)
+
+    def _create_instance(self, image_ref, **values):
+        inst_type = instance_types.get_instance_type_by_name("m1.small")
+        values.setdefault("host", FLAGS.host)
+        values.update({"instance_type_id": inst_type["id"],
+                       "image_ref": image_ref})
+        return db.instance_create(self.context, values)
+
+    def _launch(self, image_ref, count):
+        for i in xrange(count):
+            instance = self._create_instance(image_ref)
+            self.manager.record_launch(instance["id"], "m1.small", image_ref)
+
+    def test_targets_follow_popular_images(self):
+        self._launch(5, 3)
+        self._launch(6, 1)
+        self._launch(7, 2)
+        self.assertEqual(self.manager.targets(self.context),
+                         {("m1.small", "5"): 2, ("m1.small", "7"): 2})
+
+    def test_old_launches_are_forgotten(self):
+        self.flags(dodai_warm_pool_history_hours=0)
+        self._launch(5, 1)
+        eventlet.sleep(0.01)
+        self.assertEqual(self.manager.targets(self.context), {})
+
+    def test_launches_are_read_from_the_instances_table(self):
+        terminated = self._create_instance(5)
+        self._launch(5, 1)
+        self._launch(6, 1)
+        self.manager.targets(self.context)
+        self._launch(6, 2)
+        # terminated launches count, resource pool installs and launches
+        # of other hosts do not
+        db.instance_destroy(self.context, terminated["id"])
+        for i in xrange(3):
+            self._create_instance(7, availability_zone="resource_pool")
+            self._create_instance(8, host="other")
+
+        restarted = warm_pool.WarmPoolManager(self.driver)
+        self.assertEqual(restarted.targets(self.context),
+                         self.manager.targets(self.context))
+        self.assertEqual(restarted.targets(self.context),
+                         {("m1.small", "5"): 2, ("m1.small", "6"): 2})
+
+    def test_deficits_count_warm_machines(self):
+        self._launch(5, 2)
+        self._create_bmm("active", image_ref=5)
+        self._create_bmm("active", image_ref=6)
+        self.assertEqual(self.manager.deficits(self.context),
+                         {("m1.small", "5"): 1})
+
+    def test_replenish_installs_inactive_machines(self):
+        self._launch(5, 2)
+        self._launch(6, 1)
+        for i in xrange(4):
+            self._create_bmm()
+
+        for thread in self.manager.replenish(self.context):
+            thread.wait()
+
+        self.assertEqual(sorted(image for bmm_id, image
+                                in self.driver.installs),
+                         ["5", "5", "6"])
+        self.assertEqual(self.driver.peak, 2)
+        for bmm_id, image in self.driver.installs:
+            instance = db.instance_get(self.context, db.bmm_get(
+                                self.context, bmm_id)["instance_id"])
+            self.assertEqual(instance["user_id"], "dodai_warm_pool")
+            self.assertEqual(instance["project_id"], "dodai_warm_pool")
+        self.assertEqual(self.manager.deficits(self.context), {})
+        # nothing more to do
+        self.assertEqual(self.manager.replenish(self.context), [])
+
+    def test_image_for_reinstall(self):
+        self.assertEqual(self.manager.image_for(self.context, "m1.small"),
+                         "1")
+        self._launch(5, 2)
+        self.assertEqual(self.manager.image_for(self.context, "m1.small"),
+                         "5")
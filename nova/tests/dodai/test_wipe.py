@@ -0,0 +1,77 @@
+# vim: tabstop=4 shiftwidth=4 softtabstop=4
+
+#    Licensed under the Apache License, Version 2.0 (the "License"); you may
+#    not use this file except in compliance with the License. You may obtain
+#    a copy of the License at
+#
+#         http://www.apache.org/licenses/LICENSE-2.0
+#
+#    Unless required by applicable law or agreed to in writing, software
+#    distributed under the License is distributed on an "AS IS" BASIS, WITHOUT
+#    WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied. See the
+#    License for the specific language governing permissions and limitations
+#    under the License.
+
+"""Tests for the deferred disk wipes of dodai machines."""
+
+import eventlet
+
+from nova import exception
+from nova import test
+from nova.virt.dodai import wipe
+
+
+class WipeQueueTestCase(test.TestCase):
+    def setUp(self):
+        super(WipeQueueTestCase, self).setUp()
+        self.running = 0
+        self.peak = 0
+        self.wiped = []
+
+    def _wipe(self, name, fail=False):
+        self.running += 1
+        self.peak = max(self.peak, self.running)
+        eventlet.sleep(0.01)
+        self.running -= 1
+        if fail:
+            raise exception.Error("disk on fire")
+        self.wiped.append(name)
+
+    def test_submit_returns_at_once(self):
+        queue = wipe.WipeQueue(self._wipe, concurrency=2)
+        for i in xrange(5):
+            queue.submit(i, "node%d" % i)
+        self.assertEqual(sorted(queue.pending()), range(5))
+        self.assertEqual(self.wiped, [])
+
+        for i in xrange(5):
+            queue.wait(i)
+        self.assertEqual(sorted(self.wiped),
+                         ["node%d" % i for i in xrange(5)])
+        self.assertEqual(self.peak, 2)
+        self.assertEqual(queue.pending(), [])
+
+    def test_wait_raises_failed_wipe(self):
+        queue = wipe.WipeQueue(self._wipe)
+        queue.submit(1, "node1", True)
+        self.assertRaises(exception.Error, queue.wait, 1)
+        # still failed once the thread is gone
+        self.assertRaises(exception.Error, queue.wait, 1)
+
+        queue.submit(1, "node1")
+        queue.wait(1)
+        self.assertEqual(self.wiped, ["node1"])
+
+    def test_wipe_timeout(self):
+        queue = wipe.WipeQueue(lambda: eventlet.sleep(1), wipe_timeout=0.01)
+        queue.submit(1)
+        self.assertRaises(exception.Error, queue.wait, 1)
+
+    def test_wait_without_wipe(self):
+        wipe.WipeQueue(self._wipe).wait(1)
+
+    def test_strategy(self):
+        self.flags(dodai_wipe_strategy="secure")
+        self.assertEqual(wipe.get_strategy(), "secure")
+        self.flags(dodai_wipe_strategy="shred")
+        self.assertRaises(exception.Error, wipe.get_strategy)
@@ -41,5 +41,6 @@ FLAGS['blades_per_shelf'].SetDefault(4)
 FLAGS['iscsi_num_targets'].SetDefault(8)
 FLAGS['verbose'].SetDefault(True)
 FLAGS['sqlite_db'].SetDefault("tests.sqlite")
+FLAGS['sqlite_db_dodai'].SetDefault("tests_dodai.sqlite")
 FLAGS['use_ipv6'].SetDefault(True)
 FLAGS['flat_network_bridge'].SetDefault('br100')
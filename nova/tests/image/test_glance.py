@@ -19,9 +19,12 @@
 import datetime
 import unittest
 
+from glance.common import exception as glance_exception
+
 from nova import context
 from nova import exception
 from nova import test
+from nova.image import cache
 from nova.image import glance
 
 
@@ -278,6 +281,161 @@ class TestMutatorDateTimeTests(BaseGlanceTest):
         return fixture
 
 
+class CountingGlanceClient(StubGlanceClient):
+
+    def __init__(self, images):
+        super(CountingGlanceClient, self).__init__(images)
+        self.calls = []
+
+    def get_image_meta(self, image_id):
+        self.calls.append(('get_image_meta', image_id))
+        try:
+            return self.images[image_id]
+        except KeyError:
+            raise glance_exception.NotFound()
+
+    def get_images_detailed(self, **kwargs):
+        self.calls.append(('get_images_detailed', kwargs.get('marker')))
+        return super(CountingGlanceClient, self).get_images_detailed(**kwargs)
+
+    def update_image(self, image_id, metadata, data):
+        self.images[image_id] = dict(self.images[image_id], **metadata)
+        return self.images[image_id]
+
+    def delete_image(self, image_id):
+        del self.images[image_id]
+
+
+class TestImageMetaCache(BaseGlanceTest):
+    def setUp(self):
+        super(TestImageMetaCache, self).setUp()
+        self.client = CountingGlanceClient(
+                {'1': {'id': '1', 'name': 'image1', 'is_public': True},
+                 '2': {'id': '2', 'name': 'image2', 'is_public': True}})
+        self.service = glance.GlanceImageService(client=self.client)
+
+    def test_show_is_cached(self):
+        for i in xrange(3):
+            image_meta = self.service.show(self.context, '1')
+            self.assertEqual(image_meta['name'], 'image1')
+        self.assertEqual(self.client.calls, [('get_image_meta', '1')])
+        stats = self.service._cache.stats()
+        self.assertEqual(stats['hits'], 2)
+        self.assertEqual(stats['misses'], 1)
+        self.assertAlmostEqual(stats['hit_rate'], 2.0 / 3)
+
+    def test_cached_metadata_is_a_copy(self):
+        self.service.show(self.context, '1')['properties']['foo'] = 'bar'
+        image_meta = self.service.show(self.context, '1')
+        self.assertEqual(image_meta['properties'], {})
+
+    def test_not_found_is_cached(self):
+        for i in xrange(2):
+            self.assertRaises(exception.ImageNotFound,
+                              self.service.show, self.context, '3')
+        self.assertEqual(self.client.calls, [('get_image_meta', '3')])
+        self.assertEqual(self.service._cache.stats()['negative_hits'], 1)
+
+    def test_not_found_is_cached_per_project(self):
+        other = context.RequestContext('user', 'other')
+        owner = context.RequestContext('user', 'owner')
+        # glance hides the private image from the other project
+        self.assertRaises(exception.ImageNotFound,
+                          self.service.show, other, '3')
+        self.client.images['3'] = {'id': '3', 'name': 'private',
+                                   'is_public': False,
+                                   'properties': {'project_id': 'owner'}}
+        self.assertEqual(self.service.show(owner, '3')['name'], 'private')
+        self.assertRaises(exception.ImageNotFound,
+                          self.service.show, other, '3')
+        self.assertEqual(self.client.calls, [('get_image_meta', '3'),
+                                             ('get_image_meta', '3')])
+
+    def test_entries_expire(self):
+        self.service.show(self.context, '1')
+        self.service.show(self.context, '1')
+        self.assertEqual(len(self.client.calls), 1)
+        self.service._cache._entries[cache.id_key('1')] = (0, {})
+        self.service.show(self.context, '1')
+        self.assertEqual(len(self.client.calls), 2)
+
+    def test_zero_ttl_disables_the_cache(self):
+        self.service._cache.ttl = 0
+        self.service.show(self.context, '1')
+        self.service.show(self.context, '1')
+        self.assertEqual(len(self.client.calls), 2)
+
+    def test_availability_is_checked_on_hits(self):
+        self.client.images['1']['is_public'] = False
+        self.client.images['1']['properties'] = {'project_id': 'other'}
+        admin = context.RequestContext('admin', 'admin', is_admin=True)
+        self.service.show(admin, '1')
+        user = context.RequestContext('user', 'project')
+        self.assertRaises(exception.ImageNotFound,
+                          self.service.show, user, '1')
+        self.assertEqual(len(self.client.calls), 1)
+
+    def test_show_by_name_is_cached(self):
+        self.assertEqual(self.service.show_by_name(self.context,
+                                                   'image2')['id'], '2')
+        del self.client.calls[:]
+        self.assertEqual(self.service.show_by_name(self.context,
+                                                   'image2')['id'], '2')
+        self.assertEqual(self.client.calls, [('get_image_meta', '2')])
+
+    def test_show_by_name_not_found_is_cached(self):
+        self.assertRaises(exception.ImageNotFound,
+                          self.service.show_by_name, self.context, 'image3')
+        del self.client.calls[:]
+        self.assertRaises(exception.ImageNotFound,
+                          self.service.show_by_name, self.context, 'image3')
+        self.assertEqual(self.client.calls, [])
+
+    def test_update_invalidates(self):
+        self.service.show(self.context, '1')
+        self.assertRaises(exception.ImageNotFound,
+                          self.service.show_by_name, self.context, 'renamed')
+        self.service.update(self.context, '1', {'name': 'renamed'})
+        self.assertEqual(self.service.show(self.context, '1')['name'],
+                         'renamed')
+        self.assertEqual(self.service.show_by_name(self.context,
+                                                   'renamed')['id'], '1')
+
+    def test_show_during_update_is_invalidated(self):
+        update_image = self.client.update_image
+
+        def _update_image(image_id, metadata, data):
+            # a show of another request runs while glance updates
+            self.service.show(self.context, image_id)
+            return update_image(image_id, metadata, data)
+
+        self.client.update_image = _update_image
+        self.service.update(self.context, '1', {'name': 'renamed'})
+        self.assertEqual(self.service.show(self.context, '1')['name'],
+                         'renamed')
+
+    def test_delete_invalidates(self):
+        self.service.show_by_name(self.context, 'image1')
+        self.service.delete(self.context, '1')
+        self.assertRaises(exception.ImageNotFound,
+                          self.service.show, self.context, '1')
+        self.assertRaises(exception.ImageNotFound,
+                          self.service.show_by_name, self.context, 'image1')
+
+    def test_size_is_bounded(self):
+        image_cache = cache.ImageMetaCache(ttl=60, size=2)
+        for i in xrange(3):
+            image_cache.set(cache.id_key(i), {'id': i})
+        self.assertEqual(image_cache.get(cache.id_key(0)), None)
+        self.assertEqual(image_cache.get(cache.id_key(2)), {'id': 2})
+        self.assertEqual(image_cache.stats()['evictions'], 1)
+
+    def test_default_services_share_a_cache(self):
+        self.assertTrue(glance.GlanceImageService()._cache is
+                        glance.GlanceImageService()._cache)
+        self.assertFalse(self.service._cache is cache.get_cache())
+
+
 class TestGlanceSerializer(unittest.TestCase):
     def test_serialize(self):
         metadata = {'name': 'image1',
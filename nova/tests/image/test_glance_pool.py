@@ -0,0 +1,214 @@
+# vim: tabstop=4 shiftwidth=4 softtabstop=4
+
+#    Licensed under the Apache License, Version 2.0 (the "License"); you may
+#    not use this file except in compliance with the License. You may obtain
+#    a copy of the License at
+#
+#         http://www.apache.org/licenses/LICENSE-2.0
+#
+#    Unless required by applicable law or agreed to in writing, software
+#    distributed under the License is distributed on an "AS IS" BASIS, WITHOUT
+#    WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied. See the
+#    License for the specific language governing permissions and limitations
+#    under the License.
+
+"""Tests for the connections to the glance API servers."""
+
+import httplib
+import socket
+import threading
+
+from nova import test
+from nova.image import glance_pool
+
+
+class FakeGlanceServer(object):
+    """Answers every request with status, closing connections after
+    requests_per_connection requests."""
+
+    def __init__(self, status=200, requests_per_connection=None):
+        self.status = status
+        self.requests_per_connection = requests_per_connection
+        self.connections = 0
+        self.requests = 0
+        self.sock = socket.socket()
+        self.sock.bind(('127.0.0.1', 0))
+        self.sock.listen(8)
+        self.port = self.sock.getsockname()[1]
+        thread = threading.Thread(target=self._serve)
+        thread.daemon = True
+        thread.start()
+
+    def _serve(self):
+        while True:
+            try:
+                sock, addr = self.sock.accept()
+            except socket.error:
+                return
+            self.connections += 1
+            thread = threading.Thread(target=self._handle, args=(sock,))
+            thread.daemon = True
+            thread.start()
+
+    def _handle(self, sock):
+        data = ''
+        served = 0
+        try:
+            while (self.requests_per_connection is None or
+                   served < self.requests_per_connection):
+                while '\r\n\r\n' not in data:
+                    chunk = sock.recv(4096)
+                    if not chunk:
+                        return
+                    data += chunk
+                request, data = data.split('\r\n\r\n', 1)
+                self.requests += 1
+                served += 1
+                body = 'ok'
+                if request.startswith('HEAD'):
+                    body = ''
+                sock.sendall('HTTP/1.1 %d X\r\nContent-Length: 2\r\n\r\n%s' %
+                             (self.status, body))
+        finally:
+            sock.close()
+
+    def stop(self):
+        try:
+            self.sock.shutdown(socket.SHUT_RDWR)
+        except socket.error:
+            pass
+        self.sock.close()
+
+
+class GlanceServerPoolTestCase(test.TestCase):
+    def setUp(self):
+        super(GlanceServerPoolTestCase, self).setUp()
+        self.flags(glance_server_failure_threshold=2,
+                   glance_server_cooldown=30,
+                   glance_socket_timeout=5)
+        self.pool = glance_pool.GlanceServerPool()
+        self.servers = []
+
+    def tearDown(self):
+        for server in self.servers:
+            server.stop()
+        super(GlanceServerPoolTestCase, self).tearDown()
+
+    def _server(self, **kwargs):
+        server = FakeGlanceServer(**kwargs)
+        self.servers.append(server)
+        return server
+
+    def _get(self, port, method='GET'):
+        conn = self.pool.connection('127.0.0.1', port)
+        conn.request(method, '/v1/images')
+        response = conn.getresponse()
+        body = response.read()
+        return response.status, body
+
+    def test_connections_are_kept_alive(self):
+        server = self._server()
+        self.assertEqual(self._get(server.port), (200, 'ok'))
+        self.assertEqual(self._get(server.port, 'HEAD'), (200, ''))
+        self.assertEqual(self._get(server.port), (200, 'ok'))
+        self.assertEqual(server.requests, 3)
+        self.assertEqual(server.connections, 1)
+        stats = self.pool.stats()['127.0.0.1:%d' % server.port]
+        self.assertEqual(stats['requests'], 3)
+        self.assertEqual(stats['failures'], 0)
+        self.assertEqual(stats['idle_connections'], 1)
+        self.assertTrue(stats['latency'] is not None)
+
+    def test_unread_response_holds_its_connection(self):
+        server = self._server()
+        conn = self.pool.connection('127.0.0.1', server.port)
+        conn.request('GET', '/v1/images')
+        response = conn.getresponse()
+        self.assertEqual(self._get(server.port), (200, 'ok'))
+        self.assertEqual(server.connections, 2)
+        response.read()
+        self.assertEqual(self._get(server.port), (200, 'ok'))
+        self.assertEqual(server.connections, 2)
+
+    def test_connection_closed_by_server_is_retried(self):
+        server = self._server(requests_per_connection=1)
+        self.assertEqual(self._get(server.port), (200, 'ok'))
+        self.assertEqual(self._get(server.port), (200, 'ok'))
+        self.assertEqual(server.connections, 2)
+        self.assertEqual(self.pool.server('127.0.0.1',
+                                          server.port).failures, 0)
+
+    def test_server_errors_eject_the_server(self):
+        server = self._server(status=503)
+        self._get(server.port)
+        glance_server = self.pool.server('127.0.0.1', server.port)
+        self.assertTrue(glance_server.available())
+        self._get(server.port)
+        self.assertFalse(glance_server.available())
+        self.assertEqual(glance_server.ejections, 1)
+
+    def test_refused_connections_eject_the_server(self):
+        sock = socket.socket()
+        sock.bind(('127.0.0.1', 0))
+        port = sock.getsockname()[1]
+        sock.close()
+        for i in xrange(2):
+            self.assertRaises(socket.error, self._get, port)
+        glance_server = self.pool.server('127.0.0.1', port)
+        self.assertFalse(glance_server.available())
+        self.assertEqual(glance_server.connections, [])
+
+    def test_success_resets_the_failures(self):
+        glance_server = self.pool.server('glance1', 9292)
+        glance_server.failed()
+        glance_server.succeeded(0.1)
+        glance_server.failed()
+        self.assertTrue(glance_server.available())
+
+    def test_failure_after_cooldown_ejects_again(self):
+        glance_server = self.pool.server('glance1', 9292)
+        glance_server.failed()
+        glance_server.failed()
+        glance_server.ejected_until = 0
+        glance_server.failed()
+        self.assertFalse(glance_server.available())
+        self.assertEqual(glance_server.ejections, 2)
+
+    def test_pick_prefers_the_faster_server(self):
+        self.pool.server('glance1', 9292).succeeded(0.5)
+        self.pool.server('glance2', 9292).succeeded(0.1)
+        for i in xrange(10):
+            self.assertEqual(self.pool.pick(['glance1:9292',
+                                             'glance2:9292']),
+                             ('glance2', 9292))
+
+    def test_pick_skips_ejected_servers(self):
+        self.pool.server('glance1', 9292).ejected_until = 1e12
+        self.pool.server('glance3', 9292).ejected_until = 1e12
+        for i in xrange(10):
+            self.assertEqual(self.pool.pick(['glance1:9292', 'glance2:9292',
+                                             'glance3:9292']),
+                             ('glance2', 9292))
+
+    def test_pick_when_all_servers_are_ejected(self):
+        self.pool.server('glance1', 9292).ejected_until = 2e12
+        self.pool.server('glance2', 9292).ejected_until = 1e12
+        self.assertEqual(self.pool.pick(['glance1:9292', 'glance2:9292']),
+                         ('glance2', 9292))
+
+    def test_pick_uses_glance_api_servers(self):
+        self.flags(glance_api_servers=['glance1:9393'])
+        self.assertEqual(self.pool.pick(), ('glance1', 9393))
+
+    def test_attach(self):
+        server = self._server()
+
+        class Client(object):
+            use_ssl = False
+
+        client = Client()
+        self.pool.attach(client)
+        conn = client.get_connection_type()('127.0.0.1', server.port)
+        self.assertTrue(isinstance(conn, httplib.HTTPConnection))
+        self.assertTrue(conn in self.pool.server('127.0.0.1',
+                                                 server.port).connections)
@@ -15,8 +15,16 @@
 #    License for the specific language governing permissions and limitations
 #    under the License.
 
+import os
+import StringIO
+import tarfile
+
+import eventlet
+from eventlet import event
+
 from nova import context
 from nova import test
+from nova import utils
 from nova.image import s3
 
 
@@ -112,3 +120,197 @@ class TestS3ImageService(test.TestCase):
             {'device_name': '/dev/sdb0',
              'no_device': True}]
         self.assertEqual(block_device_mapping, expected_bdm)
+
+
+class FakeKey(object):
+    def __init__(self, data):
+        self.data = data
+
+    def get_contents_as_string(self):
+        if self.data is None:
+            raise IOError("part lost")
+        return self.data
+
+
+class FakeBucket(object):
+    def __init__(self, parts):
+        self.parts = parts
+        self.running = 0
+        self.peak = 0
+
+    def get_key(self, name):
+        self.running += 1
+        self.peak = max(self.peak, self.running)
+        eventlet.sleep(0.01)
+        self.running -= 1
+        return FakeKey(self.parts.get(name))
+
+
+class TestBundleImporter(test.TestCase):
+    key = '00112233445566778899aabbccddeeff'
+    iv = 'ffeeddccbbaa99887766554433221100'
+
+    def setUp(self):
+        super(TestBundleImporter, self).setUp()
+        self.image = os.urandom(300000)
+        self.bucket, self.filenames = self._bundle(self._tar_gz(self.image))
+
+    def _tar_gz(self, data):
+        output = StringIO.StringIO()
+        tar_file = tarfile.open(fileobj=output, mode='w|gz')
+        info = tarfile.TarInfo('image')
+        info.size = len(data)
+        tar_file.addfile(info, StringIO.StringIO(data))
+        tar_file.close()
+        return output.getvalue()
+
+    def _bundle(self, data, part_size=20000):
+        encrypted, err = utils.execute('openssl', 'enc', '-e',
+                                       '-aes-128-cbc', '-K', self.key,
+                                       '-iv', self.iv, process_input=data)
+        parts = {}
+        filenames = []
+        for i in xrange(0, len(encrypted), part_size):
+            filename = 'image.part.%d' % (i / part_size)
+            parts[filename] = encrypted[i:i + part_size]
+            filenames.append(filename)
+        return FakeBucket(parts), filenames
+
+    def _upload(self, image_file):
+        chunks = []
+        while True:
+            chunk = image_file.read(4096)
+            if not chunk:
+                break
+            chunks.append(chunk)
+        return ''.join(chunks)
+
+    def test_import(self):
+        states = []
+        importer = s3.BundleImporter(self.bucket, self.filenames,
+                                     self.key, self.iv, concurrency=3,
+                                     on_state=states.append)
+        self.assertEqual(importer.run(self._upload), self.image)
+        self.assertEqual(states, ['decrypting', 'untarring', 'uploading'])
+        self.assertEqual(self.bucket.peak, 3)
+        self.assertEqual(importer.stats.parts, len(self.filenames))
+        self.assertEqual(importer.stats.bytes['upload'], len(self.image))
+        self.assertTrue(importer.stats.summary(len(self.filenames)).
+                        startswith('parts %d/%d' % (len(self.filenames),
+                                                    len(self.filenames))))
+
+    def test_upload_not_reading_the_image(self):
+        importer = s3.BundleImporter(self.bucket, self.filenames,
+                                     self.key, self.iv)
+        self.assertEqual(importer.run(lambda image_file: 'done'), 'done')
+        self.assertEqual(importer.stats.bytes['upload'], len(self.image))
+
+    def _assertFails(self, stage, importer, upload=None):
+        try:
+            importer.run(upload or self._upload)
+        except s3._ImportError, e:
+            self.assertEqual(e.stage, stage)
+        else:
+            self.fail("the import did not fail")
+
+    def test_download_failure(self):
+        self.bucket.parts[self.filenames[5]] = None
+        self._assertFails('download', s3.BundleImporter(
+                                self.bucket, self.filenames,
+                                self.key, self.iv))
+
+    def test_decrypt_failure(self):
+        self._assertFails('decrypt', s3.BundleImporter(
+                                self.bucket, self.filenames,
+                                self.iv, self.key))
+
+    def test_untar_failure(self):
+        bucket, filenames = self._bundle('not a tar file' * 100)
+        self._assertFails('untar', s3.BundleImporter(
+                                bucket, filenames, self.key, self.iv))
+
+    def test_upload_failure(self):
+        def _upload(image_file):
+            image_file.read(100)
+            raise IOError("image service down")
+
+        self._assertFails('upload', s3.BundleImporter(
+                                self.bucket, self.filenames,
+                                self.key, self.iv), _upload)
+
+    def test_s3_create_imports_parts(self):
+        manifest = ('<manifest><image>'
+                    '<ec2_encrypted_key>00</ec2_encrypted_key>'
+                    '<ec2_encrypted_iv>00</ec2_encrypted_iv>'
+                    '<parts>%s</parts>'
+                    '</image></manifest>' %
+                    ''.join('<part><filename>%s</filename></part>' % name
+                            for name in self.filenames))
+        self.bucket.parts['bucket.manifest.xml'] = manifest
+
+        class FakeConnection(object):
+            def get_bucket(conn, name):
+                return self.bucket
+
+        self.flags(image_service='nova.image.fake.FakeImageService')
+        service = s3.S3ImageService()
+        uploads = []
+        states = []
+        orig_update = service.service.update
+
+        def fake_update(context, image_id, metadata, data=None):
+            state = metadata['properties']['image_state']
+            if not states or states[-1] != state:
+                states.append(state)
+            if data is not None:
+                uploads.append(self._upload(data))
+            return orig_update(context, image_id, metadata, data)
+
+        self.stubs.Set(service.service, 'update', fake_update)
+        self.stubs.Set(service, '_conn', lambda context: FakeConnection())
+        self.stubs.Set(service, '_decrypt_key',
+                       lambda key, iv, pk: (self.key, self.iv))
+
+        ctxt = context.RequestContext('fake', 'fake')
+        image = service.create(ctxt, {'properties': {
+                'image_location': 'bucket/bucket.manifest.xml'}})
+        for i in xrange(100):
+            properties = service.show(ctxt, image['id'])['properties']
+            state = properties['image_state']
+            if state == 'available' or state.startswith('failed_'):
+                break
+            eventlet.sleep(0.05)
+        self.assertEqual(properties['image_state'], 'available')
+        self.assertEqual(uploads, [self.image])
+        self.assertEqual(states, ['downloading', 'decrypting', 'untarring',
+                                  'uploading', 'available'])
+        self.assertTrue(properties['image_progress'].startswith(
+                'parts %d/%d' % (len(self.filenames), len(self.filenames))))
+
+    def test_progress_is_reported_from_a_copy(self):
+        self.flags(image_service='nova.image.fake.FakeImageService',
+                   s3_import_progress_interval=0.01)
+        service = s3.S3ImageService()
+        sent = []
+        self.stubs.Set(service.service, 'update',
+                       lambda context, image_id, metadata: sent.append(
+                                metadata))
+        importer = s3.BundleImporter(self.bucket, self.filenames,
+                                     self.key, self.iv)
+        metadata = {'properties': {'image_state': 'uploading'}}
+        stop = event.Event()
+        reporter = eventlet.spawn(service._report_progress, None, 1,
+                                  metadata, importer, len(self.filenames),
+                                  stop)
+        eventlet.sleep(0.05)
+        stop.send()
+        reporter.wait()
+        count = len(sent)
+        eventlet.sleep(0.05)
+
+        self.assertTrue(count > 0)
+        self.assertEqual(len(sent), count)
+        self.assertEqual(metadata, {'properties': {'image_state':
+                                                   'uploading'}})
+        self.assertTrue('image_progress' in sent[0]['properties'])
+        self.assertFalse(sent[0] is metadata)
@@ -140,6 +140,26 @@ class HostFilterTestCase(test.TestCase):
         just_hosts = [host for host, caps in hosts]
         self.assertEquals('host07', just_hosts[0])
 
+    def test_dodai_machine_filter(self):
+        hf = filters.DodaiMachineFilter()
+        name, cooked = hf.instance_type_to_filter(self.instance_type)
+        self.assertEquals(name.split(".")[-1], 'DodaiMachineFilter')
+        # no dodai capabilities at all
+        self.assertEquals([], hf.filter_hosts(self.zone_manager, cooked))
+
+        states = self.zone_manager.service_states
+        states['host01']['compute']['dodai_machines'] = {
+                'tiny': {'inactive': 0, 'active': 0, 'processing': 2,
+                         'used': 5, 'free': 0}}
+        states['host02']['compute']['dodai_machines'] = {
+                'tiny': {'inactive': 1, 'active': 2, 'processing': 0,
+                         'used': 0, 'free': 3}}
+        states['host03']['compute']['dodai_machines'] = {
+                'tiny.gpu': {'inactive': 4, 'active': 0, 'processing': 0,
+                             'used': 0, 'free': 4}}
+        hosts = hf.filter_hosts(self.zone_manager, cooked)
+        self.assertEquals(['host02'], [host for host, caps in hosts])
+
     def test_json_filter(self):
         hf = filters.JsonFilter()
         # filter all hosts that can support 50 ram and 500 disk
@@ -144,3 +144,16 @@ class LeastCostSchedulerTestCase(test.TestCase):
             expected.append(wtd_dict)
 
         self.assertWeights(expected, num, request_spec, hosts)
+
+    def test_compute_dodai_provisioning_cost_fn(self):
+        def _host(provisioning, free):
+            return ('host', {'compute': {
+                    'dodai_provisioning': provisioning,
+                    'dodai_machines': {'m1.small': {'free': free}}}})
+
+        fn = least_cost.compute_dodai_provisioning_cost_fn
+        # fewer instances being provisioned first
+        self.assertTrue(fn(_host(0, 1)) < fn(_host(1, 10)))
+        # then more free machines
+        self.assertTrue(fn(_host(2, 10)) < fn(_host(2, 1)))
+        self.assertEqual(fn(('host', {})), 1.0)
@@ -33,6 +33,8 @@ from nova.db.sqlalchemy import api as sqlalchemy_api
 from nova import exception
 from nova import flags
 import nova.image.fake
+from nova.image import cache
+from nova.image import glance_pool
 from nova import log as logging
 from nova import rpc
 from nova import test
@@ -299,6 +301,32 @@ class ComputeTestCase(test.TestCase):
         self.compute.start_instance(self.context, instance_id)
         self.compute.terminate_instance(self.context, instance_id)
 
+    def test_report_driver_status_includes_glance_servers(self):
+        """Ensure the glance API server counters reach the schedulers"""
+        pool = glance_pool.GlanceServerPool()
+        pool.server('glance1', 9292).succeeded(0.5)
+        self.stubs.Set(glance_pool, 'get_pool', lambda: pool)
+        reports = []
+        self.stubs.Set(self.compute, 'update_service_capabilities',
+                       reports.append)
+        self.flags(host_state_interval=-1)
+        self.compute._report_driver_status()
+        servers = reports[0]['glance_servers']
+        self.assertEqual(servers['glance1:9292']['requests'], 1)
+        self.assertEqual(servers['glance1:9292']['latency'], 0.5)
+
+    def test_report_driver_status_includes_image_meta_cache(self):
+        """Ensure the image metadata cache counters reach the schedulers"""
+        image_cache = cache.ImageMetaCache()
+        image_cache.get(cache.id_key(1))
+        self.stubs.Set(cache, 'get_cache', lambda: image_cache)
+        reports = []
+        self.stubs.Set(self.compute, 'update_service_capabilities',
+                       reports.append)
+        self.flags(host_state_interval=-1)
+        self.compute._report_driver_status()
+        self.assertEqual(reports[0]['image_meta_cache']['misses'], 1)
+
     def test_pause(self):
         """Ensure instance can be paused"""
         instance_id = self._create_instance()
@@ -21,7 +21,10 @@
 from nova import test
 from nova import context
 from nova import db
+from nova import exception
 from nova import flags
+from nova.db.sqlalchemy import models
+from nova.db.sqlalchemy.session import get_session_dodai
 
 FLAGS = flags.FLAGS
 
@@ -95,3 +98,146 @@ class DbApiTestCase(test.TestCase):
         self.assertEqual(result[0].id, inst2.id)
         self.assertEqual(result[1].id, inst1.id)
         self.assertTrue(result[1].deleted)
+
+    def test_instance_get_all_by_ids(self):
+        args = {'reservation_id': 'a', 'image_ref': 1, 'host': 'host1'}
+        inst1 = db.instance_create(self.context, args)
+        inst2 = db.instance_create(self.context, args)
+        inst3 = db.instance_create(self.context, args)
+        result = db.instance_get_all_by_ids(self.context.elevated(),
+                                            [inst1.id, inst3.id])
+        self.assertEqual(sorted([inst1.id, inst3.id]),
+                         sorted([instance.id for instance in result]))
+        self.assertEqual([],
+                         db.instance_get_all_by_ids(self.context.elevated(),
+                                                    []))
+
+    def test_instance_update_all(self):
+        args = {'reservation_id': 'a', 'image_ref': 1, 'host': 'host1',
+                'vm_state': 'active'}
+        inst1 = db.instance_create(self.context, args)
+        inst2 = db.instance_create(self.context, args)
+        db.instance_update_all(self.context.elevated(), [inst1.id],
+                               {'vm_state': 'stopped'})
+        ctxt = self.context.elevated()
+        self.assertEqual('stopped', db.instance_get(ctxt, inst1.id).vm_state)
+        self.assertEqual('active', db.instance_get(ctxt, inst2.id).vm_state)
+        self.assertNotEqual(None, db.instance_get(ctxt, inst1.id).updated_at)
+        self.assertEqual(None, db.instance_get(ctxt, inst2.id).updated_at)
+
+    def test_bmm_destroy_releases_instance_id(self):
+        bmm = db.bmm_create(self.context, {'name': 'node1', 'instance_id': 1})
+        db.bmm_destroy(self.context, bmm.id)
+        # the instance id can be given to another machine
+        db.bmm_create(self.context, {'name': 'node2', 'instance_id': 1})
+        self.assertEqual('node2',
+                         db.bmm_get_by_instance_id(self.context, 1).name)
+
+    def test_bmm_instance_id_is_unique(self):
+        db.bmm_create(self.context, {'name': 'node1', 'instance_id': 1})
+        self.assertRaises(exception.DBError, db.bmm_create, self.context,
+                          {'name': 'node2', 'instance_id': 1})
+
+    def test_bmm_update_is_committed(self):
+        bmm = db.bmm_create(self.context, {'name': 'node1',
+                                           'status': 'inactive'})
+        db.bmm_update(self.context, bmm.id, {'status': 'active'})
+        self.assertEqual('active', db.bmm_get(self.context, bmm.id).status)
+
+    def test_bmm_count_by_status(self):
+        for name, instance_type, zone, status in [
+                ('node1', 'm1.small', 'resource_pool', 'inactive'),
+                ('node2', 'm1.small', 'resource_pool', 'inactive'),
+                ('node3', 'm1.small', 'zone1', 'used'),
+                ('node4', 'm1.large', 'resource_pool', 'active')]:
+            db.bmm_create(self.context, {'name': name,
+                                         'instance_type': instance_type,
+                                         'availability_zone': zone,
+                                         'status': status})
+        deleted = db.bmm_create(self.context, {'name': 'node5',
+                                               'instance_type': 'm1.large',
+                                               'availability_zone': 'zone1',
+                                               'status': 'used'})
+        db.bmm_destroy(self.context, deleted.id)
+        self.assertEqual(sorted(tuple(row) for row in
+                                db.bmm_count_by_status(self.context)),
+                         [('m1.large', 'resource_pool', 'active', 1),
+                          ('m1.small', 'resource_pool', 'inactive', 2),
+                          ('m1.small', 'zone1', 'used', 1)])
+
+    def _capacity(self):
+        return sorted(tuple(row) for row in
+                      db.bmm_capacity_get_all(self.context))
+
+    def test_bmm_capacity_follows_writes(self):
+        bmm1 = db.bmm_create(self.context, {'name': 'node1',
+                                            'instance_type': 'm1.small',
+                                            'availability_zone': 'pool',
+                                            'status': 'inactive'})
+        bmm2 = db.bmm_create(self.context, {'name': 'node2',
+                                            'instance_type': 'm1.small',
+                                            'availability_zone': 'pool',
+                                            'status': 'inactive'})
+        self.assertEqual(self._capacity(),
+                         [('m1.small', 'pool', 'inactive', 2)])
+
+        self.assertTrue(db.bmm_compare_and_set_status(
+                                self.context, bmm1.id, 'inactive',
+                                'processing'))
+        self.assertFalse(db.bmm_compare_and_set_status(
+                                self.context, bmm1.id, 'inactive',
+                                'processing'))
+        db.bmm_update(self.context, bmm1.id, {'status': 'used',
+                                              'availability_zone': 'zone1'})
+        # updates leaving the key alone do not touch the counters
+        db.bmm_update(self.context, bmm2.id, {'vlan_id': 10})
+        self.assertEqual(self._capacity(),
+                         [('m1.small', 'pool', 'inactive', 1),
+                          ('m1.small', 'zone1', 'used', 1)])
+
+        db.bmm_destroy(self.context, bmm2.id)
+        db.bmm_destroy(self.context, bmm2.id)
+        self.assertEqual(self._capacity(),
+                         [('m1.small', 'zone1', 'used', 1)])
+        self.assertEqual(self._capacity(),
+                         sorted(tuple(row) for row in
+                                db.bmm_count_by_status(self.context)))
+
+    def test_bmm_capacity_count(self):
+        for zone, status in [('pool', 'inactive'), ('pool', 'active'),
+                             ('pool', 'active'), ('zone1', 'used')]:
+            db.bmm_create(self.context, {'instance_type': 'm1.small',
+                                         'availability_zone': zone,
+                                         'status': status})
+        count = db.bmm_capacity_count
+        self.assertEqual(count(self.context, 'm1.small', ['inactive']), 1)
+        self.assertEqual(count(self.context, 'm1.small',
+                               ['inactive', 'active']), 3)
+        self.assertEqual(count(self.context, 'm1.small', ['used'],
+                               'pool'), 0)
+        self.assertEqual(count(self.context, 'm1.large', ['inactive']), 0)
+
+    def test_bmm_capacity_rebuild(self):
+        bmm = db.bmm_create(self.context, {'instance_type': 'm1.small',
+                                           'availability_zone': 'pool',
+                                           'status': 'inactive'})
+        # a write behind the back of the counters
+        session = get_session_dodai()
+        session.query(models.BareMetalMachine).\
+                filter_by(id=bmm.id).\
+                update({'status': 'active'})
+        db.bmm_capacity_rebuild(self.context)
+        self.assertEqual(self._capacity(),
+                         [('m1.small', 'pool', 'active', 1)])
+
+    def test_dodai_indexes_match_migrations(self):
+        cursor = get_session_dodai().bind.raw_connection().cursor()
+        for model in (models.BareMetalMachine,
+                      models.BareMetalMachineCapacity, models.Switch):
+            table = model.__table__
+            cursor.execute("PRAGMA index_list(%s)" % table.name)
+            rows = cursor.fetchall()
+            migrated = set(row[1] for row in rows
+                           if not row[1].startswith('sqlite_autoindex'))
+            declared = set(index.name for index in table.indexes)
+            self.assertEqual(migrated, declared)
@@ -20,10 +20,14 @@
 Unittets for S3 objectstore clone.
 """
 
+import base64
 import boto
+import hashlib
 import os
+import re
 import shutil
 import tempfile
+import webob
 
 from boto import exception as boto_exception
 from boto.s3 import connection as s3
@@ -138,3 +142,139 @@ class S3APITestCase(test.TestCase):
         """Tear down test server."""
         self.server.stop()
         super(S3APITestCase, self).tearDown()
+
+
+class S3ServerTestCase(test.TestCase):
+    """Test the objectstore handlers without going through the network."""
+
+    def setUp(self):
+        super(S3ServerTestCase, self).setUp()
+        self.flags(s3_chunk_size=4)
+        self.directory = tempfile.mkdtemp(prefix='test_oss-')
+        self.app = s3server.S3Application(self.directory)
+        self._request('/bucket/', method='PUT')
+
+    def tearDown(self):
+        shutil.rmtree(self.directory)
+        super(S3ServerTestCase, self).tearDown()
+
+    def _request(self, path, **kwargs):
+        return webob.Request.blank(path, **kwargs).get_response(self.app)
+
+    def _put(self, name, body, **headers):
+        return self._request('/bucket/' + name, method='PUT', body=body,
+                             headers=headers)
+
+    def test_put_streams_to_file(self):
+        body = 'x' * 10 + 'y' * 7
+        response = self._put('object', body)
+        self.assertEqual(response.status_int, 200)
+        self.assertEqual(response.headers['ETag'],
+                         '"%s"' % hashlib.md5(body).hexdigest())
+        # the partial file was renamed
+        self.assertEqual(os.listdir(os.path.join(self.directory, 'bucket')),
+                         ['object'])
+        self.assertEqual(self._request('/bucket/object').body, body)
+
+    def test_put_checks_content_md5(self):
+        self._put('object', 'old')
+        bad_md5 = base64.b64encode(hashlib.md5('other').digest())
+        response = self._put('object', 'new contents',
+                             **{'Content-MD5': bad_md5})
+        self.assertEqual(response.status_int, 400)
+        self.assertEqual(os.listdir(os.path.join(self.directory, 'bucket')),
+                         ['object'])
+        self.assertEqual(self._request('/bucket/object').body, 'old')
+
+    def test_get_range(self):
+        self._put('object', '0123456789')
+        response = self._request('/bucket/object',
+                                 headers={'Range': 'bytes=3-8'})
+        self.assertEqual(response.status_int, 206)
+        self.assertEqual(response.body, '345678')
+        self.assertEqual(response.headers['Content-Range'], 'bytes 3-8/10')
+
+        response = self._request('/bucket/object',
+                                 headers={'Range': 'bytes=-3'})
+        self.assertEqual(response.body, '789')
+
+        response = self._request('/bucket/object',
+                                 headers={'Range': 'bytes=20-30'})
+        self.assertEqual(response.status_int, 416)
+
+    def test_get_conditional(self):
+        self._put('object', 'contents')
+        response = self._request('/bucket/object')
+        self.assertEqual(response.status_int, 200)
+        self.assertEqual(response.content_length, 8)
+        last_modified = response.headers['Last-Modified']
+
+        response = self._request('/bucket/object',
+                headers={'If-Modified-Since': last_modified})
+        self.assertEqual(response.status_int, 304)
+        self.assertEqual(response.body, '')
+
+        response = self._request('/bucket/object',
+                headers={'If-Unmodified-Since':
+                         'Sat, 29 Oct 1994 19:43:31 GMT'})
+        self.assertEqual(response.status_int, 412)
+
+    def test_head(self):
+        self._put('object', 'contents')
+        response = self._request('/bucket/object', method='HEAD')
+        self.assertEqual(response.status_int, 200)
+        self.assertEqual(response.content_length, 8)
+        self.assertEqual(response.body, '')
+
+    def _keys(self, query=''):
+        response = self._request('/bucket/' + query)
+        self.assertEqual(response.status_int, 200)
+        return re.findall('<Key>(.*?)</Key>', response.body), \
+               '<IsTruncated>True</IsTruncated>' in response.body
+
+    def test_listing_pages(self):
+        for name in ['a1', 'a2', 'a3', 'b1', 'c1']:
+            self._put(name, name)
+        self.assertEqual(self._keys(),
+                         (['a1', 'a2', 'a3', 'b1', 'c1'], False))
+        self.assertEqual(self._keys('?prefix=a&max-keys=2'),
+                         (['a1', 'a2'], True))
+        self.assertEqual(self._keys('?prefix=a&marker=a2&max-keys=2'),
+                         (['a3'], False))
+        self.assertEqual(self._keys('?marker=a3'), (['b1', 'c1'], False))
+        self.assertEqual(self._keys('?prefix=c&marker=a1'), (['c1'], False))
+
+        self._request('/bucket/a2', method='DELETE')
+        self._put('b1', 'longer contents')
+        self.assertEqual(self._keys('?prefix=a'), (['a1', 'a3'], False))
+        response = self._request('/bucket/?prefix=b1')
+        self.assertTrue('<Size>15</Size>' in response.body)
+
+    def test_marker_equal_to_prefix(self):
+        for name in ['a', 'a1', 'a2', 'b']:
+            self._put(name, name)
+        self.assertEqual(self._keys('?prefix=a&max-keys=1'), (['a'], True))
+        self.assertEqual(self._keys('?prefix=a&marker=a&max-keys=1'),
+                         (['a1'], True))
+        self.assertEqual(self._keys('?prefix=a&marker=a1'), (['a2'], False))
+
+    def test_index_is_rebuilt_on_start(self):
+        self._put('object', 'contents')
+        bucket_dir = os.path.join(self.directory, 'bucket')
+        open(os.path.join(bucket_dir, 'copied'), 'w').close()
+        open(os.path.join(bucket_dir,
+                          s3server._PARTIAL_PREFIX + 'upload'), 'w').close()
+        self.assertEqual(self._keys(), (['object'], False))
+
+        self.app = s3server.S3Application(self.directory)
+        self.assertEqual(self._keys(), (['copied', 'object'], False))
+        # the index is not a bucket
+        response = self._request('/')
+        self.assertEqual(re.findall('<Name>(.*?)</Name>', response.body),
+                         ['bucket'])
+
+    def test_index_with_bucket_depth(self):
+        self.app = s3server.S3Application(self.directory, bucket_depth=2)
+        self._put('object', 'contents')
+        self.app = s3server.S3Application(self.directory, bucket_depth=2)
+        self.assertEqual(self._keys(), (['object'], False))
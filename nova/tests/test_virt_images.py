@@ -0,0 +1,165 @@
+# vim: tabstop=4 shiftwidth=4 softtabstop=4
+
+#    Licensed under the Apache License, Version 2.0 (the "License"); you may
+#    not use this file except in compliance with the License. You may obtain
+#    a copy of the License at
+#
+#         http://www.apache.org/licenses/LICENSE-2.0
+#
+#    Unless required by applicable law or agreed to in writing, software
+#    distributed under the License is distributed on an "AS IS" BASIS, WITHOUT
+#    WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied. See the
+#    License for the specific language governing permissions and limitations
+#    under the License.
+
+"""Tests for fetching images in nova.virt.images."""
+
+import hashlib
+import os
+import socket
+import tempfile
+
+from nova import exception
+from nova import test
+import nova.image
+from nova.virt import images
+
+
+class FakeResponse(object):
+    def __init__(self, data, fail_after=None):
+        self.data = data
+        self.fail_after = fail_after
+        self.pos = 0
+
+    def read(self, size):
+        if self.fail_after is not None and self.pos >= self.fail_after:
+            raise socket.error("connection reset")
+        chunk = self.data[self.pos:self.pos + size]
+        self.pos += len(chunk)
+        return chunk
+
+
+class FakeRangeImageService(object):
+    def __init__(self, data, honour_ranges=True):
+        self.data = data
+        self.honour_ranges = honour_ranges
+        self.requests = []
+        # offsets at which the next responses break
+        self.failures = []
+        # offsets at which the next responses end without an error
+        self.early_ends = []
+
+    def show(self, context, image_id):
+        return {'id': image_id, 'size': len(self.data)}
+
+    def get_range(self, context, image_id, offset=0, length=None):
+        self.requests.append((offset, length))
+        if not self.honour_ranges:
+            offset, length = 0, None
+        end = len(self.data)
+        if length is not None:
+            end = offset + length
+        if self.early_ends:
+            end = self.early_ends.pop(0)
+        fail_after = None
+        if self.failures:
+            fail_after = self.failures.pop(0)
+        return (FakeResponse(self.data[offset:end], fail_after),
+                self.honour_ranges)
+
+
+class FetchTestCase(test.TestCase):
+    def setUp(self):
+        super(FetchTestCase, self).setUp()
+        self.flags(image_fetch_chunk_size=10, image_fetch_retries=3)
+        self.stubs.Set(images.greenthread, 'sleep', lambda seconds: None)
+        self.data = "".join(chr(i % 256) for i in xrange(1000))
+        self.service = FakeRangeImageService(self.data)
+        self.stubs.Set(nova.image, 'get_image_service',
+                       lambda context, image_href: (self.service, 1))
+        fd, self.path = tempfile.mkstemp()
+        os.close(fd)
+
+    def tearDown(self):
+        os.unlink(self.path)
+        super(FetchTestCase, self).tearDown()
+
+    def _fetch(self):
+        stats = {}
+        images.fetch(None, 1, self.path, 'user', 'project', stats)
+        self.assertEqual(open(self.path, 'rb').read(), self.data)
+        self.assertEqual(stats['checksum'],
+                         hashlib.md5(self.data).hexdigest())
+        return stats
+
+    def test_fetch(self):
+        stats = self._fetch()
+        self.assertEqual(stats['bytes'], 1000)
+        self.assertEqual(stats['retries'], 0)
+        self.assertEqual(self.service.requests, [(0, None)])
+
+    def test_resume(self):
+        self.service.failures = [300, 200]
+        stats = self._fetch()
+        self.assertEqual(stats['retries'], 2)
+        self.assertEqual(stats['bytes'], 1000)
+        self.assertEqual(self.service.requests,
+                         [(0, None), (300, None), (500, None)])
+
+    def test_restart_without_ranges(self):
+        self.service.honour_ranges = False
+        self.service.failures = [300]
+        stats = self._fetch()
+        self.assertEqual(stats['retries'], 1)
+        self.assertEqual(stats['bytes'], 1000)
+
+    def test_resume_after_early_end(self):
+        self.service.early_ends = [400]
+        stats = self._fetch()
+        self.assertEqual(stats['retries'], 1)
+        self.assertEqual(self.service.requests, [(0, None), (400, None)])
+
+    def test_give_up_after_early_ends(self):
+        self.service.early_ends = [100, 200, 300, 400]
+        self.assertRaises(IOError, images.fetch, None, 1, self.path,
+                          'user', 'project')
+
+    def test_short_image_without_ranges(self):
+        class ImageService(object):
+            def get(self, context, image_id, data):
+                data.write("x" * 10)
+                return {'id': image_id, 'size': 20}
+
+        self.service = ImageService()
+        self.assertRaises(exception.Error, images.fetch, None, 1, self.path,
+                          'user', 'project')
+
+    def test_give_up(self):
+        self.service.failures = [10, 10, 10, 10]
+        self.assertRaises(socket.error, images.fetch, None, 1, self.path,
+                          'user', 'project')
+
+    def test_segments(self):
+        self.flags(image_fetch_segments=4, image_fetch_segment_min_mb=0)
+        self.service.failures = [None, 100]
+        stats = self._fetch()
+        self.assertEqual(stats['segments'], 4)
+        self.assertEqual(stats['retries'], 1)
+        self.assertEqual(sorted(self.service.requests),
+                         [(0, 250), (250, 250), (350, 150), (500, 250),
+                          (750, 250)])
+
+    def test_segments_without_ranges(self):
+        self.flags(image_fetch_segments=4, image_fetch_segment_min_mb=0)
+        self.service.honour_ranges = False
+        stats = self._fetch()
+        self.assertEqual(stats['segments'], 1)
+        self.assertEqual(stats['bytes'], 1000)
+        self.assertEqual(self.service.requests[-1], (0, None))
+
+    def test_fetch_stats(self):
+        before = images.get_fetch_stats()
+        self._fetch()
+        after = images.get_fetch_stats()
+        self.assertEqual(after['fetches'], before['fetches'] + 1)
+        self.assertEqual(after['bytes'], before['bytes'] + 1000)
@@ -0,0 +1,181 @@
+# vim: tabstop=4 shiftwidth=4 softtabstop=4
+
+#    Licensed under the Apache License, Version 2.0 (the "License"); you may
+#    not use this file except in compliance with the License. You may obtain
+#    a copy of the License at
+#
+#         http://www.apache.org/licenses/LICENSE-2.0
+#
+#    Unless required by applicable law or agreed to in writing, software
+#    distributed under the License is distributed on an "AS IS" BASIS, WITHOUT
+#    WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied. See the
+#    License for the specific language governing permissions and limitations
+#    under the License.
+
+"""
+Client of the agent running on dodai instances.
+
+The agent listens on dodai_agent_port of the pxe ip of a machine and
+configures the installed OS, e.g. the ssh key or the service network.
+Connections are kept open per node and reused.  A request which cannot
+reach the agent within dodai_agent_timeout seconds is retried
+dodai_agent_retries times, waiting dodai_agent_retry_backoff seconds
+doubled at each try, before DodaiAgentUnreachable is raised.  batch()
+sends requests to many nodes at once, so one dead agent delays only its
+own node.
+
+"""
+
+import socket
+import time
+import urllib
+
+import eventlet
+from eventlet.green import httplib
+
+from nova import exception
+from nova import flags
+from nova import log as logging
+
+
+LOG = logging.getLogger('nova.virt.dodai.agent')
+FLAGS = flags.FLAGS
+
+_HEADERS = {"Content-type": "application/x-www-form-urlencoded",
+            "Accept": "text/plain"}
+
+
+class AgentClient(object):
+    """Sends requests to the agents of many nodes."""
+
+    def __init__(self, port=None, timeout=None, retries=None, backoff=None,
+                 concurrency=None):
+        self.port = port or FLAGS.dodai_agent_port
+        self.timeout = timeout or FLAGS.dodai_agent_timeout
+        self.retries = retries
+        if self.retries is None:
+            self.retries = FLAGS.dodai_agent_retries
+        self.backoff = backoff
+        if self.backoff is None:
+            self.backoff = FLAGS.dodai_agent_retry_backoff
+        self.concurrency = concurrency or FLAGS.dodai_agent_concurrency
+        # host -> idle connections
+        self._connections = {}
+        # path -> {"requests", "failures", "retries", "total_time",
+        #          "max_time"}
+        self.metrics = {}
+
+    def put_key(self, host, key_data):
+        """Install key_data as the ssh key of the node."""
+        return self.request(host, "PUT", "/services/dodai-instance/key.json",
+                            {"key_data": key_data.strip()})
+
+    def put_networks(self, host, ip, netmask, gateway, dns, macs):
+        """Configure the service network of the node on macs."""
+        params = {"ip_address": ip,
+                  "subnet_mask": netmask,
+                  "default_gateway": gateway,
+                  "dns": dns}
+        for index, mac in enumerate(macs):
+            params["mac_address[%d]" % index] = mac
+        return self.request(host, "PUT",
+                            "/services/dodai-instance/networks.json", params)
+
+    def batch(self, func, arg_lists):
+        """Call func with each list of arguments concurrently.
+
+        Returns the results in the order of arg_lists, with the exception
+        raised by a call in place of its result.
+        """
+        def _call(args):
+            try:
+                return func(*args)
+            except Exception as ex:
+                return ex
+
+        pool = eventlet.GreenPool(self.concurrency)
+        return list(pool.imap(_call, arg_lists))
+
+    def request(self, host, method, path, params):
+        """Send a request to the agent of host and return (status, body)."""
+        body = urllib.urlencode(params)
+        start = time.time()
+        tries = 0
+        while True:
+            try:
+                status, data = self._send(host, method, path, body)
+                break
+            except (socket.error, httplib.HTTPException) as ex:
+                if tries >= self.retries:
+                    self._record(path, start, tries, failed=True)
+                    raise exception.DodaiAgentUnreachable(host=host,
+                                                          reason=ex)
+                delay = self.backoff * (2 ** tries)
+                tries += 1
+                LOG.warn(_("Agent of %(host)s failed %(method)s %(path)s: "
+                           "%(ex)s, retrying in %(delay)s seconds")
+                         % locals())
+                eventlet.sleep(delay)
+
+        self._record(path, start, tries)
+        LOG.debug(_("Agent of %(host)s answered %(method)s %(path)s: "
+                    "%(status)s %(data)s") % locals())
+        return status, data
+
+    def _send(self, host, method, path, body):
+        idle = self._connections.setdefault(host, [])
+        while idle:
+            conn = idle.pop()
+            try:
+                return self._exchange(host, conn, method, path, body)
+            except (socket.error, httplib.HTTPException):
+                # the agent closed the kept connection, try another one
+                conn.close()
+
+        conn = httplib.HTTPConnection(host, self.port, timeout=self.timeout)
+        try:
+            return self._exchange(host, conn, method, path, body)
+        except Exception:
+            conn.close()
+            raise
+
+    def _exchange(self, host, conn, method, path, body):
+        conn.request(method, path, body, _HEADERS)
+        response = conn.getresponse()
+        data = response.read()
+        if response.will_close:
+            conn.close()
+        else:
+            self._connections[host].append(conn)
+        return response.status, data
+
+    def _record(self, path, start, retries, failed=False):
+        elapsed = time.time() - start
+        metrics = self.metrics.setdefault(path, {"requests": 0,
+                                                 "failures": 0,
+                                                 "retries": 0,
+                                                 "total_time": 0.0,
+                                                 "max_time": 0.0})
+        metrics["requests"] += 1
+        metrics["retries"] += retries
+        if failed:
+            metrics["failures"] += 1
+        metrics["total_time"] += elapsed
+        metrics["max_time"] = max(metrics["max_time"], elapsed)
+
+    def close(self):
+        for idle in self._connections.values():
+            for conn in idle:
+                conn.close()
+        self._connections.clear()
+
+
+_CLIENT = None
+
+
+def get_client():
+    """Return the AgentClient shared by the process."""
+    global _CLIENT
+    if _CLIENT is None:
+        _CLIENT = AgentClient()
+    return _CLIENT
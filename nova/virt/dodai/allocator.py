@@ -0,0 +1,136 @@
+# vim: tabstop=4 shiftwidth=4 softtabstop=4
+
+#    Licensed under the Apache License, Version 2.0 (the "License"); you may
+#    not use this file except in compliance with the License. You may obtain
+#    a copy of the License at
+#
+#         http://www.apache.org/licenses/LICENSE-2.0
+#
+#    Unless required by applicable law or agreed to in writing, software
+#    distributed under the License is distributed on an "AS IS" BASIS, WITHOUT
+#    WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied. See the
+#    License for the specific language governing permissions and limitations
+#    under the License.
+
+"""
+Allocation of dodai bare metal machines to instances.
+
+A machine is claimed by switching its status to "processing" with a
+compare-and-set update, so two compute workers can never take the same
+machine; a worker which loses the race simply moves on to the next
+candidate.
+
+Machine statuses:
+
+:inactive:    in the resource pool, no OS installed.
+:active:      in the resource pool, an OS is installed and can be reused by
+              instances of the same image.
+:processing:  claimed, being installed or deleted.
+:used:        running an instance of a cluster.
+:error:       its wipe failed, out of the pool until an operator resets it.
+
+"""
+
+from nova import db
+from nova import exception
+from nova import log as logging
+
+
+LOG = logging.getLogger('nova.virt.dodai.allocator')
+
+RESOURCE_POOL = "resource_pool"
+
+# How many times candidates are re-read after losing races.
+_MAX_ATTEMPTS = 3
+
+
+class MachineAllocator(object):
+    """Claims bare metal machines for new instances."""
+
+    def allocate(self, context, instance_type, image_ref, count=1,
+                 for_resource_pool=False):
+        """Claim count machines of instance_type.
+
+        Machines already installed with image_ref are preferred, then
+        machines without OS, then machines installed with another image.
+        Adding a machine to the resource pool only takes machines without OS.
+
+        :returns: a list of (bmm, reuse) tuples; reuse is True when the
+                  installed OS can be used as it is.
+        :raises: BareMetalMachineUnavailable if less than count machines
+                 could be claimed; nothing is claimed in that case.
+        """
+        # (bmm, reuse, status before the claim)
+        claimed = []
+        for attempt in xrange(_MAX_ATTEMPTS):
+            lost_race = False
+            claimed_ids = set(bmm["id"] for bmm, reuse, status in claimed)
+            for bmm, reuse, status in self._candidates(context,
+                                                       instance_type,
+                                                       image_ref,
+                                                       for_resource_pool):
+                if len(claimed) == count:
+                    break
+                if bmm["id"] in claimed_ids:
+                    continue
+
+                if db.bmm_compare_and_set_status(context, bmm["id"],
+                                                 status, "processing"):
+                    claimed.append((bmm, reuse, status))
+                else:
+                    LOG.debug(_("Machine %s was claimed by another worker.")
+                              % bmm["id"])
+                    lost_race = True
+
+            if len(claimed) == count or not lost_race:
+                break
+
+        if len(claimed) < count:
+            for bmm, reuse, status in claimed:
+                self.release(context, bmm, status)
+            raise exception.BareMetalMachineUnavailable()
+
+        return [(bmm, reuse) for bmm, reuse, status in claimed]
+
+    def release(self, context, bmm, status):
+        """Give back a machine claimed by allocate() but not used."""
+        db.bmm_compare_and_set_status(context, bmm["id"], "processing",
+                                      status)
+
+    def _candidates(self, context, instance_type, image_ref,
+                    for_resource_pool):
+        """Yield (bmm, reuse, status) in order of preference."""
+        if for_resource_pool:
+            for bmm in db.bmm_get_all_by_instance_type_and_status(
+                                context, instance_type, ["inactive"],
+                                RESOURCE_POOL):
+                yield bmm, False, "inactive"
+            return
+
+        bmms = db.bmm_get_all_by_instance_type_and_status(
+                                context, instance_type,
+                                ["inactive", "active"])
+        active = [bmm for bmm in bmms if bmm["status"] == "active"]
+        inactive = [bmm for bmm in bmms if bmm["status"] == "inactive"]
+
+        # one query for the images of every installed machine
+        image_refs = {}
+        instance_ids = [bmm["instance_id"] for bmm in active
+                        if bmm["instance_id"]]
+        for instance in db.instance_get_all_by_ids(context.elevated(),
+                                                   instance_ids):
+            image_refs[instance["id"]] = str(instance["image_ref"])
+
+        others = []
+        for bmm in active:
+            if bmm["availability_zone"] == RESOURCE_POOL and \
+               image_refs.get(bmm["instance_id"]) == str(image_ref):
+                yield bmm, True, "active"
+            else:
+                others.append(bmm)
+
+        for bmm in inactive:
+            yield bmm, False, "inactive"
+
+        for bmm in others:
+            yield bmm, False, "active"
@@ -0,0 +1,69 @@
+# vim: tabstop=4 shiftwidth=4 softtabstop=4
+
+#    Licensed under the Apache License, Version 2.0 (the "License"); you may
+#    not use this file except in compliance with the License. You may obtain
+#    a copy of the License at
+#
+#         http://www.apache.org/licenses/LICENSE-2.0
+#
+#    Unless required by applicable law or agreed to in writing, software
+#    distributed under the License is distributed on an "AS IS" BASIS, WITHOUT
+#    WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied. See the
+#    License for the specific language governing permissions and limitations
+#    under the License.
+
+"""
+Capacity of the dodai machine inventory, as reported to the schedulers.
+
+The capabilities of a dodai compute host carry:
+
+:dodai_machines:      {instance_type: {status: count, "free": count}}
+:dodai_zones:         {availability_zone: {status: count}}
+:dodai_provisioning:  number of instances in the provisioning pipeline.
+:dodai_image_cache:   counters of the image cache served to nodes.
+:dodai_agent:         {request path: counters} of the instance agent client.
+
+A machine is free when an instance can be launched on it, that is when it
+is inactive or active in the resource pool (see allocator).
+
+The counts are read from the bmm_capacity counters, which every write of a
+machine record updates in the same transaction, so reporting them costs
+the same whatever the size of the inventory.
+
+"""
+
+from nova import db
+from nova.virt.dodai import allocator
+
+
+STATUSES = ("inactive", "active", "processing", "used", "error")
+FREE_STATUSES = ("inactive", "active")
+
+
+def _empty():
+    return dict((status, 0) for status in STATUSES)
+
+
+def summarize(rows):
+    """Build dodai_machines and dodai_zones from bmm_capacity_get_all rows.
+
+    :returns: a (machines, zones) tuple.
+    """
+    machines = {}
+    zones = {}
+    for instance_type, zone, status, count in rows:
+        by_type = machines.setdefault(instance_type, _empty())
+        by_type.setdefault("free", 0)
+        by_type[status] = by_type.get(status, 0) + count
+        if zone == allocator.RESOURCE_POOL and status in FREE_STATUSES:
+            by_type["free"] += count
+        by_zone = zones.setdefault(zone, _empty())
+        by_zone[status] = by_zone.get(status, 0) + count
+    return machines, zones
+
+
+def get_capabilities(context):
+    """Return the dodai_machines and dodai_zones capabilities."""
+    machines, zones = summarize(db.bmm_capacity_get_all(context))
+    return {"dodai_machines": machines, "dodai_zones": zones}
+
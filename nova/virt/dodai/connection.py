@@ -21,23 +21,35 @@
 A dodai hypervisor.
 
 """
+import copy
 import os
 import os.path
 import tempfile
-import httplib, urllib
 
+from nova import context as nova_context
 from nova import exception
 from nova import log as logging
 from nova import utils
+from nova import wsgi
 from nova.compute import power_state
 from nova.compute import instance_types
 from nova.virt import driver
 from nova import db
-from nova.virt import images
 from nova import flags
+from nova.virt.dodai import agent
+from nova.virt.dodai import allocator
+from nova.virt.dodai import capacity
+from nova.virt.dodai import image_cache
+from nova.virt.dodai import multicast
 from nova.virt.dodai import ofc_utils
+from nova.virt.dodai import pipeline
+from nova.virt.dodai import power
+from nova.virt.dodai import state
+from nova.virt.dodai import template
+from nova.virt.dodai import timing
+from nova.virt.dodai import warm_pool
+from nova.virt.dodai import wipe
 from nova.compute import vm_states
-from nova.db.sqlalchemy.session import get_session_dodai
 
 from eventlet import greenthread
 
@@ -68,6 +80,22 @@ class DodaiConnection(driver.ComputeDriver):
           'disk_used': 100000000000,
           'host_uuid': 'cedb9b39-9388-41df-8891-c5c9a0c0fe5f',
           'host_name_label': 'dodai-compute'}
+        self.state_tracker = state.StateTracker(
+                                os.path.join(FLAGS.cobbler_path, "instances"))
+        self.state_monitor = None
+        self.ofc_reconciler = None
+        self.allocator = allocator.MachineAllocator()
+        # instance_id -> (bmm, reuse) claimed by another instance of its
+        # reservation
+        self._claims = {}
+        self.timer = timing.PhaseTimer()
+        self.pipeline = pipeline.ProvisioningPipeline(timer=self.timer)
+        self.image_cache = image_cache.ImageCache()
+        self.multicast = multicast.MulticastDistributor()
+        self.templates = template.TemplateSet()
+        self.warm_pool = warm_pool.WarmPoolManager(self)
+        self.warm_pool_timer = None
+        self.wipe_queue = wipe.WipeQueue(self._wipe)
 
     @classmethod
     def instance(cls):
@@ -80,8 +108,53 @@ class DodaiConnection(driver.ComputeDriver):
         including catching up with currently running VM's on the given host."""
         LOG.debug("init_host")
 
+        if FLAGS.dodai_state_monitor_in_process:
+            app = state.StateMonitorApp(self.state_tracker)
+            self.state_monitor = wsgi.Server(
+                    "Dodai machine state monitor",
+                    app,
+                    port=FLAGS.dodai_monitor_port,
+                    pool_size=FLAGS.dodai_monitor_pool_size)
+            self.state_monitor.start()
+
+        if FLAGS.ofc_service_url and FLAGS.dodai_ofc_reconcile_interval > 0:
+            self.ofc_reconciler = utils.LoopingCall(self._reconcile_ofc)
+            self.ofc_reconciler.start(FLAGS.dodai_ofc_reconcile_interval,
+                                      now=False)
+
+        if FLAGS.dodai_warm_pool_interval > 0:
+            self.warm_pool_timer = utils.LoopingCall(
+                                        self._replenish_warm_pool)
+            self.warm_pool_timer.start(FLAGS.dodai_warm_pool_interval,
+                                       now=False)
+
+    def _replenish_warm_pool(self):
+        try:
+            self.warm_pool.replenish()
+        except Exception:
+            LOG.exception(_("Replenishing the warm pool failed"))
+
+    def _reconcile_ofc(self):
+        try:
+            ofc_utils.reconcile_regions(FLAGS.ofc_service_url)
+        except Exception as ex:
+            LOG.exception(_("OFC exception %s"), unicode(ex))
+
     def get_host_stats(self, refresh=False):
-        """Return Host Status of ram, disk, network."""
+        """Return Host Status of ram, disk, network and dodai machines."""
+        if refresh or "dodai_machines" not in self.host_status:
+            context = nova_context.get_admin_context()
+            try:
+                # machines claimed for nothing are counted as free again
+                self._release_stale_claims(context)
+                self.host_status.update(capacity.get_capabilities(context))
+            except Exception:
+                LOG.exception(_("Counting dodai machines failed"))
+        self.host_status["dodai_provisioning"] = \
+                self.pipeline.in_progress()
+        self.host_status["dodai_image_cache"] = self.image_cache.stats()
+        self.host_status["dodai_agent"] = copy.deepcopy(
+                                        agent.get_client().metrics)
         return self.host_status
 
     def get_info(self, instance_name):
@@ -99,7 +172,7 @@ class DodaiConnection(driver.ComputeDriver):
 
         instance_id = self._instance_name_to_id(instance_name)
         bmm = db.bmm_get_by_instance_id(None, instance_id)
-        status = PowerManager(bmm["ipmi_ip"]).status()
+        status = power.PowerManager(bmm["ipmi_ip"]).status()
         if status == "on":
             inst_power_state = power_state.RUNNING
         else:
@@ -133,22 +206,38 @@ class DodaiConnection(driver.ComputeDriver):
 
         info_list = []
         bmms = db.bmm_get_all_by_instance_id_not_null(context)
+        statuses = power.get_bmc_pool().status_all(
+                                    [bmm["ipmi_ip"] for bmm in bmms])
+        instances = db.instance_get_all_by_ids(
+                                    context,
+                                    [bmm["instance_id"] for bmm in bmms])
+        vm_states_by_id = dict((instance["id"], instance["vm_state"])
+                               for instance in instances)
+
+        # instance ids to update, keyed by their new vm_state
+        vm_state_changes = {vm_states.ACTIVE: [], vm_states.STOPPED: []}
         for bmm in bmms:
-            instance = db.instance_get(context, bmm["instance_id"])
-            status = PowerManager(bmm["ipmi_ip"]).status()
-            if status == "off":
+            instance_id = bmm["instance_id"]
+            status = statuses[bmm["ipmi_ip"]]
+            vm_state = vm_states_by_id.get(instance_id)
+            if status is None:
+                inst_power_state = power_state.NOSTATE
+            elif status == "off":
                 inst_power_state = power_state.SHUTOFF
-
-                if instance["vm_state"] == vm_states.ACTIVE:
-                    db.instance_update(context, instance["id"], {"vm_state": vm_states.STOPPED})
+                if vm_state == vm_states.ACTIVE:
+                    vm_state_changes[vm_states.STOPPED].append(instance_id)
             else:
                 inst_power_state = power_state.RUNNING
+                if vm_state == vm_states.STOPPED:
+                    vm_state_changes[vm_states.ACTIVE].append(instance_id)
 
-                if instance["vm_state"] == vm_states.STOPPED:
-                    db.instance_update(context, instance["id"], {"vm_state": vm_states.ACTIVE})
+            info_list.append(driver.InstanceInfo(
+                                self._instance_id_to_name(instance_id),
+                                inst_power_state))
 
-            info_list.append(driver.InstanceInfo(self._instance_id_to_name(bmm["instance_id"]), 
-                                                 inst_power_state))
+        for vm_state, instance_ids in vm_state_changes.iteritems():
+            db.instance_update_all(context, instance_ids,
+                                   {"vm_state": vm_state})
 
         return info_list
 
@@ -180,10 +269,26 @@ class DodaiConnection(driver.ComputeDriver):
         """
         LOG.debug("spawn")
 
+        inst_type = instance_types.get_instance_type(
+                                        instance["instance_type_id"])
+        self.warm_pool.record_launch(instance["id"], inst_type["name"],
+                                     instance["image_ref"])
+        self.timer.start(instance["id"], "spawn",
+                         instance_type=inst_type["name"],
+                         image_ref=instance["image_ref"])
+        result = "error"
+        try:
+            self._spawn(context, instance)
+            result = "success"
+        finally:
+            self.timer.finish(instance["id"], "spawn", result)
+
+    def _spawn(self, context, instance):
         instance_zone, cluster_name, vlan_id, create_cluster = self._parse_zone(instance["availability_zone"])
 
         # update instances table
-        bmm, reuse = self._select_machine(context, instance)
+        with self.pipeline.phase(instance["id"], "select"):
+            bmm, reuse = self._select_machine(context, instance)
         instance["display_name"] = bmm["name"]
         instance["availability_zone"] = instance_zone
         db.instance_update(context, 
@@ -212,15 +317,10 @@ class DodaiConnection(driver.ComputeDriver):
                 self._inject_key(bmm["pxe_ip"], str(instance["key_data"]))
 
     def _inject_key(self, pxe_ip, key_data):
-        conn = httplib.HTTPConnection(pxe_ip, "4567")
-        params = urllib.urlencode({"key_data": key_data.strip()})
-        headers = {'Content-type': 'application/x-www-form-urlencoded', 'Accept': 'text/plain'}
-        conn.request("PUT", "/services/dodai-instance/key.json", params, headers)
-        response = conn.getresponse()
-        data = response.read()
-        LOG.debug(response.status)
-        LOG.debug(response.reason)
-        LOG.debug(data)
+        status, data = agent.get_client().put_key(pxe_ip, key_data)
+        if status != 200:
+            LOG.warn(_("Injecting the key into %(pxe_ip)s failed: "
+                       "%(status)s %(data)s") % locals())
 
     def _parse_zone(self, zone):
         create_cluster = False
@@ -244,32 +344,101 @@ class DodaiConnection(driver.ComputeDriver):
         mac = self._get_pxe_mac(bmm)
 
         # fetch image
-        image_base_path = self._get_cobbler_image_path()
-        if not os.path.exists(image_base_path):
-            utils.execute('mkdir', '-p', image_base_path)
-
-        image_path = self._get_cobbler_image_path(instance)
-        if not os.path.exists(image_path):
-            image_meta = images.fetch(context, 
-                                      instance["image_ref"], 
-                                      image_path, 
-                                      instance["user_id"], 
-                                      instance["project_id"])
+        with self.pipeline.phase(instance["id"], "image"):
+            image_meta = self.image_cache.fetch(context,
+                                                instance["image_ref"],
+                                                instance["user_id"],
+                                                instance["project_id"])
+        try:
+            self._install_os(context, instance, bmm, mac, image_meta)
+        finally:
+            self.image_cache.release(instance["image_ref"])
+
+        # wait until installation of os finished
+        with self.pipeline.phase(instance["id"], "installed"):
+            self._wait_for_state(context, instance, "installed")
+ 
+        if cluster_name == "resource_pool":
+            status = "active"
         else:
-            image_meta = images.show(context, instance["image_ref"])
+            status = "used"
+
+        db.bmm_update(context, bmm["id"], {"status": status})
+
+        if update_instance:
+            db.instance_update(context, instance["id"], {"vm_state": vm_states.ACTIVE})
 
+    def _install_os(self, context, instance, bmm, mac, image_meta):
         image_type = "server"
         image_name = image_meta["name"] or image_meta["properties"]["image_location"]
         if image_name.find("dodai-deploy") == -1:
             image_type = "node"
 
         # begin to install os
+        deploy_mode, compression = self._get_deploy_mode(image_meta)
+        portbase = None
+        if FLAGS.dodai_image_distribution == "multicast":
+            portbase = self.multicast.join(
+                            instance["image_ref"],
+                            self.image_cache.path(instance["image_ref"]))
+        with self.pipeline.phase(instance["id"], "pxe"):
+            self._write_install_files(instance, bmm, mac, image_type,
+                                      deploy_mode, compression, portbase)
+
+        with self.pipeline.phase(instance["id"], "install"):
+            LOG.debug("Reboot or power on.")
+            with self.pipeline.phase(instance["id"], "power"):
+                self._reboot_or_power_on(bmm["ipmi_ip"])
+
+            # wait until starting to install os
+            with self.pipeline.phase(instance["id"], "boot"):
+                self._wait_for_state(context, instance, "install")
+            self._cp_template("pxeboot_start", self._get_pxe_boot_file(mac), {})
+
+            # wait until starting to reboot 
+            with self.pipeline.phase(instance["id"], "write"):
+                self._wait_for_state(context, instance, "install_reboot")
+
+        with self.pipeline.phase(instance["id"], "reboot"):
+            power_manager = power.PowerManager(bmm["ipmi_ip"])
+            with self.pipeline.phase(instance["id"], "power"):
+                power_manager.soft_off()
+            while power_manager.status(refresh=True) == "on":
+                greenthread.sleep(20)
+                LOG.debug("Wait unit the instance %s shuts down." % instance["id"])
+            with self.pipeline.phase(instance["id"], "power"):
+                power_manager.on()
+
+    def _get_deploy_mode(self, image_meta):
+        """Choose how create.sh writes the image onto the root partition.
+
+        "copy" loop-mounts the image and copies its files, "stream" writes
+        the image onto the partition as it is downloaded and grows the
+        filesystem.  Images choose with their dodai_deploy_mode and
+        dodai_image_compression (gzip, bzip2 or xz) properties.
+        """
+        properties = image_meta.get("properties", {})
+        mode = properties.get("dodai_deploy_mode",
+                              FLAGS.dodai_default_deploy_mode)
+        compression = properties.get("dodai_image_compression", "none")
+        if mode != "stream":
+            return "copy", "none"
+
+        size = image_meta.get("size") or properties.get("size")
+        root_size = FLAGS.dodai_partition_root_gb * 1000 * 1000 * 1000
+        if compression == "none" and size and int(size) > root_size:
+            LOG.warn(_("Image %(id)s is larger than the root partition, "
+                       "deploying it by copy.") % image_meta)
+            return "copy", "none"
+
+        return "stream", compression
+
+    def _write_install_files(self, instance, bmm, mac, image_type,
+                             deploy_mode, compression, portbase=None):
         pxe_ip = bmm["pxe_ip"] or "None"
         pxe_mac = bmm["pxe_mac"] or "None"
         storage_ip = bmm["storage_ip"] or "None"
         storage_mac = bmm["storage_mac"] or "None"
-        service_mac1 = bmm["service_mac1"] or "None"
-        service_mac2 = bmm["service_mac2"] or "None"
 
         instance_path = self._get_cobbler_instance_path(instance) 
         if not os.path.exists(instance_path):
@@ -288,6 +457,12 @@ class DodaiConnection(driver.ComputeDriver):
                            "SERVICE_MAC1": bmm["service_mac1"],
                            "SERVICE_MAC2": bmm["service_mac2"],
                            "IMAGE_TYPE": image_type,
+                           "DEPLOY_MODE": deploy_mode,
+                           "IMAGE_COMPRESSION": compression,
+                           "DISTRIBUTION": portbase and "multicast" or "http",
+                           "MULTICAST_PORTBASE": portbase,
+                           "MULTICAST_TIMEOUT":
+                               FLAGS.dodai_multicast_receiver_timeout,
                            "MONITOR_PORT": FLAGS.dodai_monitor_port,
                            "ROOT_SIZE": FLAGS.dodai_partition_root_gb,
                            "SWAP_SIZE": FLAGS.dodai_partition_swap_gb,
@@ -301,41 +476,6 @@ class DodaiConnection(driver.ComputeDriver):
                            "PXE_MAC": pxe_mac,
                            "ACTION": "create"})
 
-        LOG.debug("Reboot or power on.")
-        self._reboot_or_power_on(bmm["ipmi_ip"])
-
-        # wait until starting to install os
-        while self._get_state(context, instance) != "install":
-            greenthread.sleep(20)
-            LOG.debug("Wait until begin to install instance %s." % instance["id"])
-        self._cp_template("pxeboot_start", self._get_pxe_boot_file(mac), {})
-
-        # wait until starting to reboot 
-        while self._get_state(context, instance) != "install_reboot":
-            greenthread.sleep(20)
-            LOG.debug("Wait until begin to reboot instance %s after os has been installed." % instance["id"])
-        power_manager = PowerManager(bmm["ipmi_ip"])
-        power_manager.soft_off()
-        while power_manager.status() == "on":
-            greenthread.sleep(20)
-            LOG.debug("Wait unit the instance %s shuts down." % instance["id"])
-        power_manager.on()
-
-        # wait until installation of os finished
-        while self._get_state(context, instance) != "installed":
-            greenthread.sleep(20)
-            LOG.debug("Wait until instance %s installation finished." % instance["id"])
- 
-        if cluster_name == "resource_pool":
-            status = "active"
-        else:
-            status = "used"
-
-        db.bmm_update(context, bmm["id"], {"status": status})
-
-        if update_instance:
-            db.instance_update(context, instance["id"], {"vm_state": vm_states.ACTIVE})
-    
     def _update_ofc(self, bmm, cluster_name):
         try:
             ofc_utils.update_for_run_instance(FLAGS.ofc_service_url, 
@@ -347,88 +487,101 @@ class DodaiConnection(driver.ComputeDriver):
         except Exception as ex:
             LOG.exception(_("OFC exception %s"), unicode(ex))
 
-    def _get_state(self, context, instance):
-        # check if instance exists
-        instance_ref = db.instance_get(context, instance["id"])
-        if instance_ref["deleted"]:
-            raise exception.InstanceNotFound(instance_id=instance["id"]) 
+    def _wait_for_state(self, context, instance, state_name):
+        def _check_instance_exists():
+            instance_ref = db.instance_get(context, instance["id"])
+            if instance_ref["deleted"]:
+                raise exception.InstanceNotFound(instance_id=instance["id"])
 
-        path = self._get_cobbler_instance_path(instance, "state")
-        if not os.path.exists(path):
-            return ""
-
-        if not os.path.isfile(path):
-            return ""
-
-        f = open(path)
-        state = f.read().strip()
-        f.close()
-       
-        LOG.debug("State of instance %d: %s" % (instance["id"], state))
-        return state 
+        self.state_tracker.wait_for_state(instance["id"],
+                                          state_name,
+                                          check=_check_instance_exists)
 
     def _get_pxe_mac(self, bmm):
         return "01-%s" % bmm["pxe_mac"].replace(":", "-").lower()
 
     def _select_machine(self, context, instance):
-        inst_type = instance_types.get_instance_type(instance['instance_type_id'])
+        """Return the (bmm, reuse) claimed for instance.
 
-        bmm_found = None
-        reuse = False
+        The first instance of a max_count launch claims the machines of
+        every instance of its reservation still to be built here at once;
+        the other instances take the machines claimed for them.
+        """
+        self._release_stale_claims(context)
+        claim = self._claims.pop(instance["id"], None)
+        if claim is not None:
+            return claim
 
-        # create a non autocommit session
-        session = get_session_dodai(False)
-        session.begin()
+        inst_type = instance_types.get_instance_type(instance['instance_type_id'])
+        for_resource_pool = instance["availability_zone"] == "resource_pool"
+        instance_ids = self._reservation_peers(context, instance)
         try:
-            bmms = db.bmm_get_all_by_instance_type(context, inst_type["name"], session)
-            if instance["availability_zone"] == "resource_pool": #Add a machine to resource pool.
-                for bmm in bmms:
-                    if bmm["availability_zone"] != "resource_pool":
-                        continue
-
-                    if bmm["status"] != "inactive":
-                        continue
-
-                    bmm_found = bmm
-                    break
-            else:
-                for bmm in bmms:
-                    if bmm["availability_zone"] != "resource_pool":
-                        continue
-    
-                    if bmm["status"] != "active":
-                        continue 
-        
-                    instance_ref = db.instance_get(context, bmm["instance_id"])
-                    if instance_ref["image_ref"] != instance["image_ref"]:
-                        continue
-    
-                    bmm_found = bmm
-                    reuse = True
-                    break
-   
-                if not bmm_found:
-                    for bmm in bmms:
-                        if bmm["status"] == "used" or bmm["status"] == "processing":
-                            continue
-    
-                        bmm_found = bmm
-                        reuse = False
-                        break
-
-            if bmm_found:
-                db.bmm_update(context, bmm_found["id"], {"status": "processing"}, session)
-        except Exception as ex:
-            LOG.exception(ex)
-            session.rollback()
-            raise exception.BareMetalMachineUnavailable() 
-
-        session.commit()
-
-        if bmm_found:
-            return bmm_found, reuse
+            claims = self.allocator.allocate(context,
+                                             inst_type["name"],
+                                             instance["image_ref"],
+                                             len(instance_ids),
+                                             for_resource_pool)
+        except exception.BareMetalMachineUnavailable:
+            if len(instance_ids) == 1:
+                raise
+            LOG.warn(_("Not enough machines for the %(count)s instances of "
+                       "reservation %(reservation_id)s, claiming one by one")
+                     % {"count": len(instance_ids),
+                        "reservation_id": instance["reservation_id"]})
+            instance_ids = [instance["id"]]
+            claims = self.allocator.allocate(context,
+                                             inst_type["name"],
+                                             instance["image_ref"],
+                                             1,
+                                             for_resource_pool)
+
+        self._claims.update(zip(instance_ids[1:], claims[1:]))
+        return claims[0]
+
+    def _reservation_peers(self, context, instance):
+        """Return the id of instance, then the ids of the other instances
+        of its reservation waiting to be built on this host."""
+        instance_ids = [instance["id"]]
+        if not instance.get("reservation_id"):
+            return instance_ids
+
+        for peer in db.instance_get_all_by_reservation(
+                                context.elevated(),
+                                instance["reservation_id"]):
+            if peer["id"] == instance["id"] or peer["id"] in self._claims:
+                continue
+            if peer["vm_state"] != vm_states.BUILDING or \
+               peer["host"] not in (None, instance["host"]) or \
+               peer["instance_type_id"] != instance["instance_type_id"] or \
+               peer["availability_zone"] != instance["availability_zone"]:
+                continue
+            instance_ids.append(peer["id"])
+        return instance_ids
 
-        raise exception.BareMetalMachineUnavailable()
+    def _release_stale_claims(self, context):
+        """Give back the machines claimed for instances which were
+        deleted, failed or scheduled to another host before their
+        spawn."""
+        if not self._claims:
+            return
+
+        instances = db.instance_get_all_by_ids(context.elevated(),
+                                               self._claims.keys())
+        waiting = set(instance["id"] for instance in instances
+                      if instance["vm_state"] == vm_states.BUILDING and
+                         instance["host"] in (None, FLAGS.host))
+        for instance_id in self._claims.keys():
+            if instance_id not in waiting:
+                self._release_claim(context, instance_id)
+
+    def _release_claim(self, context, instance_id):
+        claim = self._claims.pop(instance_id, None)
+        if claim is not None:
+            bmm, reuse = claim
+            LOG.info(_("Releasing machine %(name)s claimed for instance "
+                       "%(instance_id)s") % {"name": bmm["name"],
+                                             "instance_id": instance_id})
+            self.allocator.release(context, bmm, bmm["status"])
 
     def _get_cobbler_instance_path(self, instance, file_name = ""):
         return os.path.join(FLAGS.cobbler_path,
@@ -436,15 +589,6 @@ class DodaiConnection(driver.ComputeDriver):
                      str(instance["id"]),
                      file_name)
 
-    def _get_cobbler_image_path(self, instance = None):
-        if instance:
-            return os.path.join(FLAGS.cobbler_path,
-                                "images",
-                                str(instance["image_ref"]))
-        else:
-            return os.path.join(FLAGS.cobbler_path,
-                                "images")
-
     def _get_pxe_boot_file(self, mac):
         return os.path.join(FLAGS.pxe_boot_path, mac)
 
@@ -457,7 +601,7 @@ class DodaiConnection(driver.ComputeDriver):
         return inst_type["local_gb"] * 1024
 
     def _reboot_or_power_on(self, ip):
-        power_manager = PowerManager(ip)
+        power_manager = power.PowerManager(ip)
         status = power_manager.status()
         LOG.debug("The power is " + status)
         if status == "off":
@@ -466,20 +610,7 @@ class DodaiConnection(driver.ComputeDriver):
             power_manager.reboot()
 
     def _cp_template(self, template_name, dest_path, params):
-        f = open(utils.abspath("virt/dodai/" + template_name + ".template"), "r")
-        content = f.read()
-        f.close()
-
-        path = os.path.dirname(dest_path)
-        if not os.path.exists(path):
-           os.makedirs(path) 
-
-        for key, value in params.iteritems():
-            content = content.replace(key, str(value))
-
-        f = open(dest_path, "w")
-        f.write(content) 
-        f.close 
+        self.templates.write(template_name, dest_path, params)
 
 
     def destroy(self, context, instance, network_info, cleanup=True):
@@ -497,41 +628,75 @@ class DodaiConnection(driver.ComputeDriver):
         """
         LOG.debug("destroy")
 
+        self._release_claim(context, instance["id"])
         bmm = db.bmm_get_by_instance_id(context, instance["id"])
-        db.bmm_update(context, bmm["id"], {"status": "processing"})
-        mac = self._get_pxe_mac(bmm)
-
-        # update ofc
+        self.timer.start(instance["id"], "destroy",
+                         instance_type=bmm["instance_type"],
+                         image_ref=instance["image_ref"])
+        result = "error"
+        try:
+            bmm = self._destroy(context, instance, bmm)
+            result = "success"
+        finally:
+            self.timer.finish(instance["id"], "destroy", result)
+        return bmm
+
+    def _destroy(self, context, instance, bmm):
+        # release the machine at once; it stays "processing" until the
+        # wipe queued below is done
+        db.bmm_update(context, bmm["id"],
+                      {"status": "processing",
+                       "vlan_id": None,
+                       "availability_zone": "resource_pool",
+                       "instance_id": None,
+                       "service_ip": None})
+
+        # update ofc, once the machine has left the region in the db
         self._update_ofc_for_destroy(context, bmm)
-        db.bmm_update(context, bmm["id"], {"vlan_id": None,
-                                           "availability_zone": "resource_pool"})
 
-        # begin to delete os
+        self.wipe_queue.submit(bmm["id"], context, instance["id"], bmm)
+        return db.bmm_get(context, bmm["id"])
+
+    def _wipe(self, context, instance_id, bmm):
+        """Wipe the disk of the machine of a destroyed instance."""
+        strategy = wipe.get_strategy()
+        # the instance is gone, only its id names the cobbler files
+        instance = {"id": instance_id}
+        self.timer.start(instance_id, "wipe",
+                         instance_type=bmm["instance_type"],
+                         strategy=strategy)
+        result = "error"
+        try:
+            if strategy != "none":
+                self._delete_os(instance, bmm, strategy)
+            utils.execute("rm", "-rf",
+                          self._get_cobbler_instance_path(instance))
+            result = "success"
+        finally:
+            self.timer.finish(instance_id, "wipe", result)
+
+    def _delete_os(self, instance, bmm, strategy):
+        mac = self._get_pxe_mac(bmm)
         self._cp_template("delete.sh",
                           self._get_cobbler_instance_path(instance, "delete.sh"), 
                           {"INSTANCE_ID": instance["id"],
                            "COBBLER": FLAGS.cobbler,
-                           "MONITOR_PORT": FLAGS.dodai_monitor_port})
+                           "MONITOR_PORT": FLAGS.dodai_monitor_port,
+                           "WIPE": strategy})
         self._cp_template("pxeboot_action",
                           self._get_pxe_boot_file(mac),
                           {"INSTANCE_ID": instance["id"], 
                            "COBBLER": FLAGS.cobbler,
                            "PXE_MAC": bmm["pxe_mac"],
                            "ACTION": "delete"})
-        self._reboot_or_power_on(bmm["ipmi_ip"])
+        with self.pipeline.phase(instance["id"], "delete", "wipe"):
+            with self.pipeline.phase(instance["id"], "power", "wipe"):
+                self._reboot_or_power_on(bmm["ipmi_ip"])
 
-        # wait until starting to delete os
-        while self._get_state(context, instance) != "deleted":
-            greenthread.sleep(20)
-            LOG.debug("Wait until data of instance %s was deleted." % instance["id"])
-
-        utils.execute("rm", "-rf", self._get_cobbler_instance_path(instance));
-
-        # update db
-        db.bmm_update(context, bmm["id"], {"instance_id": None, 
-                                           "service_ip": None})
-
-        return db.bmm_get(context, bmm["id"])
+            # wait until the node has deleted the os
+            self.state_tracker.wait_for_state(
+                                    instance["id"], "deleted",
+                                    deadline=FLAGS.dodai_wipe_report_timeout)
 
     def _update_ofc_for_destroy(self, context, bmm):
         # update ofc
@@ -548,18 +713,40 @@ class DodaiConnection(driver.ComputeDriver):
             LOG.exception(_("OFC exception %s"), unicode(ex))
 
     def add_to_resource_pool(self, context, instance, bmm):
-        # begin to install default os
-        self._install_machine(context, instance, bmm, "resource_pool", None, True)
+        try:
+            self.wipe_queue.wait(bmm["id"])
+        except exception.Error:
+            # the disk may still hold the data of the destroyed instance,
+            # the machine is kept out of the pool until an operator has
+            # looked at it
+            LOG.error(_("Machine %s is not wiped, setting it to error")
+                      % bmm["name"])
+            db.bmm_update(context, bmm["id"], {"status": "error",
+                                               "instance_id": None})
+            db.instance_destroy(context, instance["id"])
+            raise
+
+        # begin to install the image the warm pool misses most, or the
+        # default os
+        image_ref = self.warm_pool.image_for(context, bmm["instance_type"])
+        if image_ref != str(instance["image_ref"]):
+            db.instance_update(context, instance["id"],
+                               {"image_ref": image_ref})
+            instance["image_ref"] = image_ref
+        self.warm_pool.reinstall(context, instance, bmm,
+                                 bmm["instance_type"])
 
     def stop(self, context, instance):
         LOG.debug("stop")
         bmm = db.bmm_get_by_instance_id(context, instance["id"])
-        PowerManager(bmm["ipmi_ip"]).off() 
+        with self.pipeline.phase(instance["id"], "power", "stop"):
+            power.PowerManager(bmm["ipmi_ip"]).off()
 
     def start(self, context, instance):
         LOG.debug("start")
         bmm = db.bmm_get_by_instance_id(context, instance["id"])
-        PowerManager(bmm["ipmi_ip"]).on() 
+        with self.pipeline.phase(instance["id"], "power", "start"):
+            power.PowerManager(bmm["ipmi_ip"]).on()
 
     def reboot(self, instance, network_info):
         """Reboot the specified instance.
@@ -571,7 +758,8 @@ class DodaiConnection(driver.ComputeDriver):
         LOG.debug("reboot")
 
         bmm = db.bmm_get_by_instance_id(None, instance["id"])
-        PowerManager(bmm["ipmi_ip"]).reboot()
+        with self.pipeline.phase(instance["id"], "power", "reboot"):
+            power.PowerManager(bmm["ipmi_ip"]).reboot()
 
     def update_available_resource(self, ctxt, host):
         """Updates compute manager resource info on ComputeNode table.
@@ -584,34 +772,9 @@ class DodaiConnection(driver.ComputeDriver):
 
         """
         LOG.debug("update_available_resource")
-        return
+        self.get_host_stats(refresh=True)
 
     def reset_network(self, instance):
         """reset networking for specified instance"""
         LOG.debug("reset_network")
         return
-
-class PowerManager(object):
-
-    def __init__(self, ip):
-        self.ip = ip
-
-    def on(self):
-        return self._execute("on")
-
-    def off(self):
-        return self._execute("off")
-
-    def soft_off(self):
-        return self._execute("soft")
-
-    def reboot(self):
-        return self._execute("reset")
-
-    def status(self):
-        parts = self._execute("status").split(" ")
-        return parts[3].strip()
-
-    def _execute(self, subcommand):
-        out, err = utils.execute("/usr/bin/ipmitool", "-I", "lan", "-H", self.ip, "-U", FLAGS.ipmi_username, "-P", FLAGS.ipmi_password, "chassis", "power", subcommand)
-        return out
@@ -0,0 +1,188 @@
+# vim: tabstop=4 shiftwidth=4 softtabstop=4
+
+#    Licensed under the Apache License, Version 2.0 (the "License"); you may
+#    not use this file except in compliance with the License. You may obtain
+#    a copy of the License at
+#
+#         http://www.apache.org/licenses/LICENSE-2.0
+#
+#    Unless required by applicable law or agreed to in writing, software
+#    distributed under the License is distributed on an "AS IS" BASIS, WITHOUT
+#    WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied. See the
+#    License for the specific language governing permissions and limitations
+#    under the License.
+
+"""
+Cache of the images served by cobbler to installing nodes.
+
+Nodes download cobbler_path/images/<image_ref>.  Glance images are
+immutable, so the image_ref names the content and a cached file never has
+to be refreshed.  An image is downloaded once however many instances are
+launched from it at the same time: the first request downloads it into a
+temporary file, verifies it against the checksum known by Glance and
+renames it into place, the other requests wait for that download.
+
+Images in use by an installation are never evicted.  When the cache grows
+over dodai_image_cache_max_gb, the least recently used of the other images
+are removed.
+
+"""
+
+import os
+import tempfile
+import time
+
+import eventlet
+
+from nova import exception
+from nova import flags
+from nova import log as logging
+from nova import utils
+from nova.virt import images
+
+
+LOG = logging.getLogger('nova.virt.dodai.image_cache')
+FLAGS = flags.FLAGS
+
+
+class ImageCache(object):
+    """Downloads images into cobbler_path/images once and evicts them."""
+
+    def __init__(self, base_path=None, max_size_gb=None):
+        self.base_path = base_path or \
+                         os.path.join(FLAGS.cobbler_path, "images")
+        if max_size_gb is None:
+            max_size_gb = FLAGS.dodai_image_cache_max_gb
+        self.max_size = max_size_gb * 1024 * 1024 * 1024
+        self._in_flight = {}
+        # image_ref -> number of installations using the image
+        self._users = {}
+        self.metrics = {"hits": 0,
+                        "misses": 0,
+                        "coalesced": 0,
+                        "bytes_downloaded": 0,
+                        "checksum_failures": 0,
+                        "evictions": 0}
+
+    def path(self, image_ref):
+        return os.path.join(self.base_path, str(image_ref))
+
+    def fetch(self, context, image_ref, user_id, project_id):
+        """Make image_ref available to nodes and return its metadata.
+
+        The image is kept until release() is called as many times as
+        fetch() returned.
+        """
+        image_ref = str(image_ref)
+        self._users[image_ref] = self._users.get(image_ref, 0) + 1
+        try:
+            return self._fetch(context, image_ref, user_id, project_id)
+        except Exception:
+            self.release(image_ref)
+            raise
+
+    def release(self, image_ref):
+        """Tell that an installation does not need image_ref any more."""
+        image_ref = str(image_ref)
+        count = self._users.get(image_ref, 0) - 1
+        if count > 0:
+            self._users[image_ref] = count
+        else:
+            self._users.pop(image_ref, None)
+
+    def _fetch(self, context, image_ref, user_id, project_id):
+        thread = self._in_flight.get(image_ref)
+        if thread is not None:
+            self.metrics["coalesced"] += 1
+            return thread.wait()
+
+        path = self.path(image_ref)
+        if os.path.exists(path):
+            self.metrics["hits"] += 1
+            # the modification time orders the images for eviction
+            os.utime(path, None)
+            return images.show(context, image_ref)
+
+        self.metrics["misses"] += 1
+        thread = eventlet.spawn(self._download, context, image_ref,
+                                user_id, project_id)
+        self._in_flight[image_ref] = thread
+        thread.link(self._clear_in_flight, image_ref)
+        return thread.wait()
+
+    def _clear_in_flight(self, thread, image_ref):
+        if self._in_flight.get(image_ref) is thread:
+            del self._in_flight[image_ref]
+
+    def _download(self, context, image_ref, user_id, project_id):
+        if not os.path.exists(self.base_path):
+            utils.execute('mkdir', '-p', self.base_path)
+
+        path = self.path(image_ref)
+        fd, tmp_path = tempfile.mkstemp(prefix=".%s." % image_ref,
+                                        dir=self.base_path)
+        os.close(fd)
+        stats = {}
+        try:
+            try:
+                metadata = images.fetch(context, image_ref, tmp_path,
+                                        user_id, project_id, stats)
+            finally:
+                self.metrics["bytes_downloaded"] += stats.get("bytes", 0)
+
+            self._verify(image_ref, metadata, stats["checksum"])
+            # cobbler serves the file over http
+            os.chmod(tmp_path, 0644)
+            os.rename(tmp_path, path)
+        except Exception:
+            if os.path.exists(tmp_path):
+                os.unlink(tmp_path)
+            raise
+
+        LOG.info(_("Image %(image_ref)s downloaded to %(path)s") % locals())
+        self.evict()
+        return metadata
+
+    def _verify(self, image_ref, metadata, checksum):
+        expected = metadata.get("checksum") or \
+                   metadata.get("properties", {}).get("checksum")
+        if expected and expected != checksum:
+            self.metrics["checksum_failures"] += 1
+            reason = _("checksum %(checksum)s does not match "
+                       "%(expected)s") % locals()
+            raise exception.ImageUnacceptable(image_id=image_ref,
+                                              reason=reason)
+
+    def evict(self):
+        """Remove unused images, oldest first, while over the size limit."""
+        if self.max_size <= 0 or not os.path.exists(self.base_path):
+            return
+
+        entries = []
+        total = 0
+        for name in os.listdir(self.base_path):
+            if name.startswith("."):
+                # download in progress
+                continue
+            stat = os.stat(os.path.join(self.base_path, name))
+            total += stat.st_size
+            entries.append((stat.st_mtime, stat.st_size, name))
+
+        entries.sort()
+        for mtime, size, name in entries:
+            if total <= self.max_size:
+                break
+            if name in self._users or name in self._in_flight:
+                continue
+            LOG.info(_("Evicting image %(name)s, unused since %(when)s")
+                     % {"name": name, "when": time.ctime(mtime)})
+            os.unlink(os.path.join(self.base_path, name))
+            total -= size
+            self.metrics["evictions"] += 1
+
+    def stats(self):
+        """Return the counters of the cache and the images in use."""
+        stats = dict(self.metrics)
+        stats["images_in_use"] = len(self._users)
+        stats["downloads_in_progress"] = len(self._in_flight)
+        return stats
@@ -0,0 +1,109 @@
+# vim: tabstop=4 shiftwidth=4 softtabstop=4
+
+#    Licensed under the Apache License, Version 2.0 (the "License"); you may
+#    not use this file except in compliance with the License. You may obtain
+#    a copy of the License at
+#
+#         http://www.apache.org/licenses/LICENSE-2.0
+#
+#    Unless required by applicable law or agreed to in writing, software
+#    distributed under the License is distributed on an "AS IS" BASIS, WITHOUT
+#    WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied. See the
+#    License for the specific language governing permissions and limitations
+#    under the License.
+
+"""
+Multicast distribution of images to installing nodes with udpcast.
+
+Instances installing the same image within dodai_multicast_window seconds
+share a session: once the window closes, one udp-sender sends the image to
+all of them.  It starts as soon as every node of the session has connected
+with udp-receiver, or dodai_multicast_max_wait seconds after the first one
+did.  A node which misses the transmission falls back to http (see
+create.sh).
+
+"""
+
+import eventlet
+
+from nova import exception
+from nova import flags
+from nova import log as logging
+from nova import utils
+
+
+LOG = logging.getLogger('nova.virt.dodai.multicast')
+FLAGS = flags.FLAGS
+
+
+class Session(object):
+    """One transmission of an image to several nodes."""
+
+    def __init__(self, image_ref, image_path, portbase):
+        self.image_ref = image_ref
+        self.image_path = image_path
+        self.portbase = portbase
+        self.receivers = 0
+        self.sender = None
+
+
+class MulticastDistributor(object):
+    """Groups installations of an image into udp-sender sessions."""
+
+    def __init__(self, window=None, max_wait=None):
+        self.window = window
+        if self.window is None:
+            self.window = FLAGS.dodai_multicast_window
+        self.max_wait = max_wait or FLAGS.dodai_multicast_max_wait
+        # image_ref -> session still accepting receivers
+        self._open = {}
+        # portbase -> session being sent
+        self._sending = {}
+        self._next_port = 0
+
+    def join(self, image_ref, image_path):
+        """Add a receiver for image_ref and return the session portbase."""
+        image_ref = str(image_ref)
+        session = self._open.get(image_ref)
+        if session is None:
+            session = Session(image_ref, image_path, self._allocate_port())
+            self._open[image_ref] = session
+            eventlet.spawn_after(self.window, self._close, session)
+        session.receivers += 1
+        return session.portbase
+
+    def _allocate_port(self):
+        # udp-sender uses portbase and portbase + 1
+        for i in xrange(FLAGS.dodai_multicast_sessions):
+            portbase = FLAGS.dodai_multicast_portbase + self._next_port * 2
+            self._next_port = (self._next_port + 1) % \
+                              FLAGS.dodai_multicast_sessions
+            if portbase not in self._sending and \
+               portbase not in [s.portbase for s in self._open.values()]:
+                return portbase
+        raise exception.Error(_("No free multicast portbase"))
+
+    def _close(self, session):
+        if self._open.get(session.image_ref) is session:
+            del self._open[session.image_ref]
+        self._sending[session.portbase] = session
+        session.sender = eventlet.spawn(self._send, session)
+
+    def _send(self, session):
+        LOG.info(_("Multicasting image %(image_ref)s to %(receivers)s nodes "
+                   "on portbase %(portbase)s") % session.__dict__)
+        cmd = ["udp-sender",
+               "--nokbd",
+               "--file", session.image_path,
+               "--portbase", session.portbase,
+               "--min-receivers", session.receivers,
+               "--max-wait", self.max_wait]
+        if FLAGS.dodai_multicast_interface:
+            cmd += ["--interface", FLAGS.dodai_multicast_interface]
+        try:
+            utils.execute(*cmd)
+        except Exception as ex:
+            LOG.warn(_("Multicast of image %(image_ref)s failed: %(ex)s")
+                     % {"image_ref": session.image_ref, "ex": ex})
+        finally:
+            del self._sending[session.portbase]
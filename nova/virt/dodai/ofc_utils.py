@@ -1,71 +1,201 @@
+import time
+
+from eventlet import pools
+from suds import cache
 from suds.client import Client
 from nova import exception
 from nova import db
+from nova import flags
+from nova import log
 
 import logging
 
 logging.getLogger('suds').setLevel(logging.INFO)
 
-def update_for_run_instance(service_url, region_name, server_port1, server_port2, dpid1, dpid2):
-    # check region name
-    client = Client(service_url + "?wsdl")
+LOG = log.getLogger('nova.virt.dodai.ofc_utils')
+FLAGS = flags.FLAGS
 
-    client.service.setServerPort(dpid1, server_port1, region_name)
-    client.service.setServerPort(dpid2, server_port2, region_name)
-    client.service.save()
 
-def update_for_terminate_instance(service_url, region_name, server_port1, server_port2, dpid1, dpid2, vlan_id):
-    client = Client(service_url + "?wsdl")
-    client.service.clearServerPort(dpid1, server_port1)
-    client.service.clearServerPort(dpid2, server_port2)
-    client.service.save()
+class ClientPool(pools.Pool):
+    """Pool of SOAP clients of one OFC service.
 
-    dpid_datas = client.service.showSwitchDatapathId()
-    for dpid_data in dpid_datas:
-        ports = client.service.showPorts(dpid_data.dpid)
-        for port in ports:
-            if port.type != "ServerPort":
-                continue
+    The WSDL is downloaded and parsed once, by the first client; the other
+    clients are clones sharing it.  The parsed WSDL is also kept on disk so
+    that a restarted process does not parse it again.
+    """
 
-            if port.regionName == region_name:
-                return
+    def __init__(self, service_url, max_size=None):
+        pools.Pool.__init__(self,
+                            max_size=max_size or FLAGS.dodai_ofc_pool_size,
+                            order_as_stack=True)
+        self.service_url = service_url
+        self._client = None
+        self._regions = None
 
-    remove_region(service_url, region_name, vlan_id)
+    def create(self):
+        if self._client is None:
+            wsdl_cache = cache.ObjectCache(
+                                location=FLAGS.dodai_ofc_wsdl_cache_path,
+                                days=FLAGS.dodai_ofc_wsdl_cache_days)
+            self._client = Client(self.service_url + "?wsdl",
+                                  cache=wsdl_cache)
+            return self._client
+        return self._client.clone()
 
-def create_region(service_url, region_name, vlan_id):
-    client = Client(service_url + "?wsdl")
-    try:
-        client.service.createRegion(region_name)
-        client.service.save()
-    except:
-        raise exception.OFCRegionCreationFailed(region_name=region_name) 
+    def cached_regions(self):
+        """Return the names of the regions if cached, or None."""
+        if self._regions is not None:
+            fetched_at, names = self._regions
+            if time.time() - fetched_at < FLAGS.dodai_ofc_region_cache_ttl:
+                return names
+        return None
+
+    def regions(self, refresh=False):
+        """Return the names of the regions, cached for a while."""
+        if not refresh:
+            names = self.cached_regions()
+            if names is not None:
+                return names
+
+        with self.item() as client:
+            names = set(x.regionName for x in client.service.showRegion())
+        self._regions = (time.time(), names)
+        return names
+
+    def invalidate_regions(self):
+        self._regions = None
+
+
+_POOLS = {}
+
+
+def get_pool(service_url):
+    """Return the ClientPool shared by the whole process."""
+    pool = _POOLS.get(service_url)
+    if pool is None:
+        pool = _POOLS[service_url] = ClientPool(service_url)
+    return pool
 
-    try:
-        switches = db.switch_get_all(None)
-        for switch in switches:
-            client.service.setOuterPortAssociationSetting(switch["dpid"], switch["outer_port"], vlan_id, 65535, region_name)
 
+def update_for_run_instance(service_url, region_name, server_port1, server_port2, dpid1, dpid2):
+    # check region name
+    with get_pool(service_url).item() as client:
+        client.service.setServerPort(dpid1, server_port1, region_name)
+        client.service.setServerPort(dpid2, server_port2, region_name)
         client.service.save()
-    except:
-        client.service.destroyRegion(region_name)
+
+def update_for_terminate_instance(service_url, region_name, server_port1, server_port2, dpid1, dpid2, vlan_id):
+    with get_pool(service_url).item() as client:
+        client.service.clearServerPort(dpid1, server_port1)
+        client.service.clearServerPort(dpid2, server_port2)
         client.service.save()
-        raise exception.OFCRegionSettingOuterPortAssocFailed(region_name=region_name, vlan_id=vlan_id)
 
-def remove_region(service_url, region_name, vlan_id):
-    client = Client(service_url + "?wsdl")
+    # The machine must already be out of region_name in the db.
+    if not region_in_use(region_name):
+        remove_region(service_url, region_name, vlan_id)
+
+def region_in_use(region_name):
+    """Whether machines are still assigned to region_name.
+
+    Answered from the availability_zone of the machines in the dodai db,
+    which is set before the server ports of a machine are set on the OFC
+    and reset before they are cleared.
+    """
+    return db.bmm_count_by_availability_zone(None, region_name) > 0
+
+def regions_with_server_ports(service_url):
+    """Return the names of the regions having server ports on the OFC.
+
+    This walks every port of every switch; use region_in_use() unless the
+    OFC itself has to be checked.
+    """
+    regions = set()
+    with get_pool(service_url).item() as client:
+        dpid_datas = client.service.showSwitchDatapathId()
+        for dpid_data in dpid_datas:
+            ports = client.service.showPorts(dpid_data.dpid)
+            for port in ports:
+                if port.type == "ServerPort":
+                    regions.add(port.regionName)
+    return regions
+
+def reconcile_regions(service_url):
+    """Compare the regions used in the dodai db with the OFC.
+
+    Differences are logged and returned as a tuple of (regions only used
+    in the db, regions only used on the OFC).  Nothing is changed: a region
+    can legitimately be empty on the OFC while its first machine is being
+    installed.
+    """
+    db_regions = set(bmm["availability_zone"] for bmm in db.bmm_get_all(None))
+    db_regions.discard("resource_pool")
+    ofc_regions = regions_with_server_ports(service_url)
+
+    only_db = db_regions - ofc_regions
+    only_ofc = ofc_regions - db_regions
+    for region_name in only_db:
+        LOG.warn(_("Region %s has machines in the db but no server ports "
+                   "on the OFC") % region_name)
+    for region_name in only_ofc:
+        LOG.warn(_("Region %s has server ports on the OFC but no machines "
+                   "in the db") % region_name)
+    return only_db, only_ofc
+
+def create_region(service_url, region_name, vlan_id):
+    pool = get_pool(service_url)
+    try:
+        _create_region(pool, region_name, vlan_id)
+    finally:
+        pool.invalidate_regions()
+
+def _create_region(pool, region_name, vlan_id):
+    with pool.item() as client:
+        try:
+            client.service.createRegion(region_name)
+            client.service.save()
+        except:
+            raise exception.OFCRegionCreationFailed(region_name=region_name) 
+
+        try:
+            switches = db.switch_get_all(None)
+            for switch in switches:
+                client.service.setOuterPortAssociationSetting(switch["dpid"], switch["outer_port"], vlan_id, 65535, region_name)
+
+            client.service.save()
+        except:
+            client.service.destroyRegion(region_name)
+            client.service.save()
+            raise exception.OFCRegionSettingOuterPortAssocFailed(region_name=region_name, vlan_id=vlan_id)
 
+def remove_region(service_url, region_name, vlan_id):
+    pool = get_pool(service_url)
     try:
-        switches = db.switch_get_all(None)
-        for switch in switches:
-            client.service.clearOuterPortAssociationSetting(switch["dpid"], switch["outer_port"], vlan_id)
+        _remove_region(pool, region_name, vlan_id)
+    finally:
+        pool.invalidate_regions()
 
-        client.service.save()
-    except:
-        pass
+def _remove_region(pool, region_name, vlan_id):
+    with pool.item() as client:
+        try:
+            switches = db.switch_get_all(None)
+            for switch in switches:
+                client.service.clearOuterPortAssociationSetting(switch["dpid"], switch["outer_port"], vlan_id)
 
-    client.service.destroyRegion(region_name)
-    client.service.save()
+            client.service.save()
+        except:
+            pass
+
+        client.service.destroyRegion(region_name)
+        client.service.save()
 
-def has_region(service_url, region_name):
-    client = Client(service_url + "?wsdl")
-    return region_name in [x.regionName for x in client.service.showRegion()]
+def has_region(service_url, region_name, refresh=False):
+    """Whether the OFC has region_name.
+
+    Regions are created and removed by other processes too, so only a
+    cached "yes" is trusted; a region missing from the cache, or any region
+    when refresh is set, is looked up on the OFC.
+    """
+    pool = get_pool(service_url)
+    if not refresh and region_name in (pool.cached_regions() or ()):
+        return True
+    return region_name in pool.regions(refresh=True)
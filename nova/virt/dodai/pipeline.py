@@ -0,0 +1,138 @@
+# vim: tabstop=4 shiftwidth=4 softtabstop=4
+
+#    Licensed under the Apache License, Version 2.0 (the "License"); you may
+#    not use this file except in compliance with the License. You may obtain
+#    a copy of the License at
+#
+#         http://www.apache.org/licenses/LICENSE-2.0
+#
+#    Unless required by applicable law or agreed to in writing, software
+#    distributed under the License is distributed on an "AS IS" BASIS, WITHOUT
+#    WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied. See the
+#    License for the specific language governing permissions and limitations
+#    under the License.
+
+"""
+Provisioning pipeline of dodai bare metal instances.
+
+Every instance being provisioned goes through the phases below, each one
+run in the greenthread spawned for the instance by the compute manager:
+
+:select:     claim a machine.
+:image:      fetch the image into cobbler.
+:pxe:        write the install script and the PXE configuration.
+:install:    from powering the machine on until the OS is written, which is
+             when the node pulls the image from cobbler.
+:power:      send a power command to the machine: to start the install,
+             the reboot and the delete, and for the stop, start and reboot
+             of an instance.
+:boot:       wait for the node to boot the installer (inside install).
+:write:      wait for the installer to write the OS (inside install).
+:reboot:     power cycle after the OS is written.
+:installed:  wait for the first boot of the installed OS.
+:delete:     from powering the machine on until its disk is wiped, when
+             the instance is destroyed.
+
+dodai_provision_phase_limits caps how many instances may be in a phase at
+the same time, e.g. "image:4,power:16,install:32"; instances over the cap
+wait at the start of the phase.  Phases without a limit are unbounded.
+
+The time spent in each phase, and waiting for it, is reported to a
+timing.PhaseTimer under the operation running it: "spawn", "wipe" for
+the delete phase, or the power operation of an instance.
+
+"""
+
+import contextlib
+import time
+
+from eventlet import semaphore
+
+from nova import exception
+from nova import flags
+from nova import log as logging
+
+
+LOG = logging.getLogger('nova.virt.dodai.pipeline')
+FLAGS = flags.FLAGS
+
+PHASES = ("select", "image", "pxe", "install", "power", "boot", "write",
+          "reboot", "installed", "delete")
+
+
+def parse_limits(specs):
+    """Parse a list of "phase:limit" strings into a dict."""
+    limits = {}
+    for spec in specs:
+        try:
+            phase, limit = spec.split(":")
+            limit = int(limit)
+        except ValueError:
+            raise exception.Error(_("Invalid provision phase limit: %s")
+                                  % spec)
+        if phase not in PHASES:
+            raise exception.Error(_("Unknown provision phase: %s") % phase)
+        limits[phase] = limit
+    return limits
+
+
+class ProvisioningPipeline(object):
+    """Tracks instances through the phases and enforces their limits."""
+
+    def __init__(self, limits=None, timer=None):
+        if limits is None:
+            limits = parse_limits(FLAGS.dodai_provision_phase_limits)
+        self.limits = limits
+        self.timer = timer
+        self._semaphores = dict((phase, semaphore.Semaphore(limit))
+                                for phase, limit in limits.iteritems()
+                                if limit > 0)
+        # (instance_id, operation) -> (phase, "waiting" or "running")
+        self._instances = {}
+
+    @contextlib.contextmanager
+    def phase(self, instance_id, phase, operation="spawn"):
+        """Run the body as phase of operation of instance_id, within the
+        phase limit."""
+        key = (instance_id, operation)
+        previous = self._instances.get(key)
+        self._instances[key] = (phase, "waiting")
+        sem = self._semaphores.get(phase)
+        start = time.time()
+        if sem is not None:
+            if sem.locked():
+                LOG.debug(_("Instance %(instance_id)s waits for phase "
+                            "%(phase)s") % locals())
+            sem.acquire()
+            if self.timer:
+                self.timer.record(instance_id, operation, phase + "_wait",
+                                  time.time() - start)
+                start = time.time()
+        try:
+            self._instances[key] = (phase, "running")
+            LOG.debug(_("Instance %(instance_id)s enters phase %(phase)s")
+                      % locals())
+            yield
+        finally:
+            if self.timer:
+                self.timer.record(instance_id, operation, phase,
+                                  time.time() - start)
+            if sem is not None:
+                sem.release()
+            if previous is None:
+                self._instances.pop(key, None)
+            else:
+                self._instances[key] = previous
+
+    def in_progress(self):
+        """Return how many instances are in the pipeline."""
+        return len(self._instances)
+
+    def status(self):
+        """Return {phase: {"waiting": [ids], "running": [ids]}}."""
+        result = dict((phase, {"waiting": [], "running": []})
+                      for phase in PHASES)
+        for (instance_id, operation), (phase, state) in \
+                self._instances.items():
+            result[phase][state].append(instance_id)
+        return result
@@ -0,0 +1,176 @@
+# vim: tabstop=4 shiftwidth=4 softtabstop=4
+
+#    Licensed under the Apache License, Version 2.0 (the "License"); you may
+#    not use this file except in compliance with the License. You may obtain
+#    a copy of the License at
+#
+#         http://www.apache.org/licenses/LICENSE-2.0
+#
+#    Unless required by applicable law or agreed to in writing, software
+#    distributed under the License is distributed on an "AS IS" BASIS, WITHOUT
+#    WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied. See the
+#    License for the specific language governing permissions and limitations
+#    under the License.
+
+"""
+IPMI power management for dodai bare metal machines.
+
+All ipmitool invocations go through a shared BmcPool, which bounds the
+number of concurrent ipmitool processes, kills the ipmitool of a BMC not
+answering within dodai_ipmi_timeout seconds, caches power status for
+dodai_ipmi_status_cache_ttl seconds and lets concurrent status queries for
+the same BMC share a single ipmitool run.
+
+"""
+
+import time
+
+import eventlet
+from eventlet import timeout
+from eventlet.green import subprocess
+
+from nova import exception
+from nova import flags
+from nova import log as logging
+
+
+LOG = logging.getLogger('nova.virt.dodai.power')
+FLAGS = flags.FLAGS
+
+
+class BmcPool(object):
+    """Runs ipmitool for many BMCs concurrently."""
+
+    def __init__(self, pool_size=None, cache_ttl=None, ipmi_timeout=None):
+        self.pool_size = pool_size or FLAGS.dodai_ipmi_pool_size
+        self.cache_ttl = cache_ttl
+        if self.cache_ttl is None:
+            self.cache_ttl = FLAGS.dodai_ipmi_status_cache_ttl
+        self.ipmi_timeout = ipmi_timeout or FLAGS.dodai_ipmi_timeout
+        self._pool = eventlet.GreenPool(self.pool_size)
+        self._status_cache = {}
+        self._in_flight = {}
+
+    def execute(self, ip, subcommand):
+        """Run 'chassis power <subcommand>' on one BMC and return stdout.
+
+        A command changing the power state drops the cached status.
+        """
+        if subcommand != "status":
+            self.invalidate(ip)
+        return self._pool.spawn(self._execute, ip, subcommand).wait()
+
+    def status(self, ip, refresh=False):
+        """Return "on" or "off" for one BMC.
+
+        Errors and timeouts are raised to the caller.
+        """
+        if not refresh:
+            cached = self._status_cache.get(ip)
+            if cached and time.time() - cached[0] < self.cache_ttl:
+                return cached[1]
+
+        # Concurrent queries for the same BMC wait on one ipmitool run.
+        thread = self._in_flight.get(ip)
+        if thread is None:
+            thread = self._pool.spawn(self._query_status, ip)
+            self._in_flight[ip] = thread
+            thread.link(self._clear_in_flight, ip)
+        return thread.wait()
+
+    def status_all(self, ips, refresh=False):
+        """Return a dict mapping each BMC ip to "on", "off" or None.
+
+        BMCs are queried in parallel; a BMC which fails or does not answer
+        in time maps to None instead of failing the whole query.
+        """
+        def _status(ip):
+            try:
+                return self.status(ip, refresh)
+            except Exception as ex:
+                LOG.warn(_("Could not get power status of BMC %(ip)s: "
+                           "%(ex)s") % locals())
+                return None
+
+        ips = list(set(ips))
+        threads = [eventlet.spawn(_status, ip) for ip in ips]
+        return dict((ip, thread.wait()) for ip, thread in zip(ips, threads))
+
+    def invalidate(self, ip):
+        self._status_cache.pop(ip, None)
+
+    def _clear_in_flight(self, thread, ip):
+        if self._in_flight.get(ip) is thread:
+            del self._in_flight[ip]
+
+    def _query_status(self, ip):
+        out = self._execute(ip, "status")
+        # e.g. "Chassis Power is on"
+        status = out.split(" ")[3].strip()
+        self._status_cache[ip] = (time.time(), status)
+        return status
+
+    def _execute(self, ip, subcommand):
+        cmd = ["/usr/bin/ipmitool",
+               "-I", "lan",
+               "-H", ip,
+               "-U", FLAGS.ipmi_username,
+               "-P", FLAGS.ipmi_password,
+               "-R", str(FLAGS.dodai_ipmi_retries),
+               "chassis", "power", subcommand]
+        process = subprocess.Popen(cmd, stdin=subprocess.PIPE,
+                                   stdout=subprocess.PIPE,
+                                   stderr=subprocess.PIPE, close_fds=True)
+        try:
+            with timeout.Timeout(self.ipmi_timeout,
+                                 exception.BareMetalMachinePowerTimeout(
+                                                                ip=ip)):
+                out, err = process.communicate()
+        except exception.BareMetalMachinePowerTimeout:
+            # a hung ipmitool would be left behind at every poll
+            LOG.warn(_("ipmitool did not answer for BMC %s, killing it")
+                     % ip)
+            process.kill()
+            process.wait()
+            raise
+        if process.returncode:
+            raise exception.ProcessExecutionError(
+                            exit_code=process.returncode, stdout=out,
+                            stderr=err, cmd=" ".join(cmd))
+        return out
+
+
+_BMC_POOL = None
+
+
+def get_bmc_pool():
+    """Return the BmcPool shared by the whole process."""
+    global _BMC_POOL
+    if _BMC_POOL is None:
+        _BMC_POOL = BmcPool()
+    return _BMC_POOL
+
+
+class PowerManager(object):
+
+    def __init__(self, ip, bmc_pool=None):
+        self.ip = ip
+        self.bmc_pool = bmc_pool or get_bmc_pool()
+
+    def on(self):
+        return self._execute("on")
+
+    def off(self):
+        return self._execute("off")
+
+    def soft_off(self):
+        return self._execute("soft")
+
+    def reboot(self):
+        return self._execute("reset")
+
+    def status(self, refresh=False):
+        return self.bmc_pool.status(self.ip, refresh)
+
+    def _execute(self, subcommand):
+        return self.bmc_pool.execute(self.ip, subcommand)
@@ -0,0 +1,234 @@
+# vim: tabstop=4 shiftwidth=4 softtabstop=4
+
+#    Licensed under the Apache License, Version 2.0 (the "License"); you may
+#    not use this file except in compliance with the License. You may obtain
+#    a copy of the License at
+#
+#         http://www.apache.org/licenses/LICENSE-2.0
+#
+#    Unless required by applicable law or agreed to in writing, software
+#    distributed under the License is distributed on an "AS IS" BASIS, WITHOUT
+#    WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied. See the
+#    License for the specific language governing permissions and limitations
+#    under the License.
+
+"""
+Install state tracking for dodai bare metal instances.
+
+Nodes report their progress ("install", "install_reboot", "installed",
+"deleted") to the machine state monitor, which records the latest state in
+cobbler_path/instances/<instance_id>/state.  StateTracker reads and writes
+that file and lets greenthreads block until an instance reaches a given
+state.  The monitor runs inside nova-compute by default (see
+dodai_state_monitor_in_process), where a report wakes the waiters
+immediately; with dodai-machine-state-monitor instead, waiters fall back
+to re-reading the state file every dodai_state_poll_interval seconds.
+
+Every transition is appended with its time to dodai_state_log, and the
+time an instance spent in each state of its provisioning run, from
+"install" to "installed", is kept in a histogram served by the monitor at
+GET /stats.
+
+"""
+
+import os
+import time
+
+from eventlet import event
+from eventlet import timeout
+
+from nova import exception
+from nova import flags
+from nova import log as logging
+from nova import utils
+
+
+LOG = logging.getLogger('nova.virt.dodai.state')
+FLAGS = flags.FLAGS
+
+STATES = ("install", "install_reboot", "installed", "deleted")
+# states a node passes through while it is provisioned
+RUN_STATES = ("install", "install_reboot")
+
+# upper bounds in seconds of the duration histogram buckets
+DURATION_BUCKETS = (30, 60, 120, 300, 600, 900, 1800, 3600)
+
+
+class Histogram(object):
+    """Counts durations in DURATION_BUCKETS."""
+
+    def __init__(self, buckets=DURATION_BUCKETS):
+        self.buckets = buckets
+        self.counts = [0] * (len(buckets) + 1)
+        self.count = 0
+        self.total = 0.0
+
+    def observe(self, value):
+        index = 0
+        while index < len(self.buckets) and value > self.buckets[index]:
+            index += 1
+        self.counts[index] += 1
+        self.count += 1
+        self.total += value
+
+    def to_dict(self):
+        buckets = [(str(bound), count)
+                   for bound, count in zip(self.buckets, self.counts)]
+        buckets.append(("inf", self.counts[-1]))
+        return {"count": self.count,
+                "sum": self.total,
+                "buckets": buckets}
+
+
+class StateTracker(object):
+    """Keeps the install state of instances and wakes up waiters."""
+
+    def __init__(self, instances_path=None, log_path=None):
+        self.instances_path = instances_path or \
+                              os.path.join(FLAGS.cobbler_path, "instances")
+        self.log_path = log_path
+        if self.log_path is None:
+            self.log_path = FLAGS.dodai_state_log
+        self._log = None
+        self._waiters = {}
+        # instance_id -> (state, time it was reported) of the instances
+        # being provisioned
+        self._last = {}
+        # state -> Histogram of the time spent in the state
+        self.durations = {}
+
+    def _state_file(self, instance_id):
+        return os.path.join(self.instances_path, str(instance_id), "state")
+
+    def get_state(self, instance_id):
+        """Return the last state reported for instance_id, or ""."""
+        path = self._state_file(instance_id)
+        if not os.path.isfile(path):
+            return ""
+
+        f = open(path)
+        try:
+            return f.read().strip()
+        finally:
+            f.close()
+
+    def set_state(self, instance_id, state):
+        """Record a state reported by a node and wake up its waiters."""
+        path = self._state_file(instance_id)
+        dir_path = os.path.dirname(path)
+        if not os.path.exists(dir_path):
+            os.makedirs(dir_path)
+
+        previous = self.get_state(instance_id)
+        f = open(path, "w")
+        try:
+            f.write(state)
+        finally:
+            f.close()
+
+        self._record(str(instance_id), previous, state)
+        self.notify(instance_id, state)
+
+    def _record(self, instance_id, previous, state):
+        now = time.time()
+        phase, since = self._last.pop(instance_id, (None, None))
+        if phase == state and state != "install":
+            # the node reported the state again
+            self._last[instance_id] = (phase, since)
+        elif state in RUN_STATES:
+            self._last[instance_id] = (state, now)
+
+        # "install" starts a new provisioning run and "deleted" may abort
+        # one, durations are only measured between the states of a run
+        if phase and phase != state and state in ("install_reboot",
+                                                  "installed"):
+            histogram = self.durations.setdefault(phase, Histogram())
+            histogram.observe(now - since)
+
+        if self.log_path:
+            if self._log is None:
+                self._log = open(self.log_path, "a")
+            self._log.write("%.3f %s %s %s\n" % (now, instance_id,
+                                                 previous or "-", state))
+            self._log.flush()
+
+    def stats(self):
+        """Return the histograms of the time spent in each state."""
+        return dict((state, histogram.to_dict())
+                    for state, histogram in self.durations.iteritems())
+
+    def notify(self, instance_id, state):
+        """Wake up the greenthreads waiting on instance_id."""
+        waiter = self._waiters.pop(str(instance_id), None)
+        if waiter is not None:
+            waiter.send(state)
+
+    def wait_for_state(self, instance_id, states, check=None, interval=None,
+                       deadline=None):
+        """Block until instance_id reaches one of states.
+
+        :param states: a state or a list of states to wait for.
+        :param check: optional callable run before every look at the state,
+                      used to abort the wait (e.g. instance deleted).
+        :param interval: seconds to wait for a notification before the
+                         state file is read again.
+        :param deadline: seconds after which exception.Error is raised,
+                         None to wait forever.
+        :returns: the state that was reached.
+        """
+        if isinstance(states, basestring):
+            states = (states,)
+        if interval is None:
+            interval = FLAGS.dodai_state_poll_interval
+
+        error = exception.Error(_("Instance %(instance_id)s did not reach "
+                                  "%(states)s in %(deadline)s seconds")
+                                % locals())
+        with timeout.Timeout(deadline, error):
+            while True:
+                if check:
+                    check()
+
+                state = self.get_state(instance_id)
+                if state in states:
+                    LOG.debug(_("State of instance %(instance_id)s: "
+                                "%(state)s") % locals())
+                    return state
+
+                LOG.debug(_("Wait until instance %(instance_id)s reaches "
+                            "%(states)s, current state is '%(state)s'.")
+                          % locals())
+                waiter = self._waiters.setdefault(str(instance_id),
+                                                  event.Event())
+                with timeout.Timeout(interval, False):
+                    waiter.wait()
+
+
+class StateMonitorApp(object):
+    """WSGI application receiving state reports from nodes.
+
+    Nodes report with GET /<instance_id>/<state>, GET /stats returns the
+    state duration histograms as JSON.
+    """
+
+    def __init__(self, tracker=None):
+        self.tracker = tracker or StateTracker()
+
+    def __call__(self, environ, start_response):
+        parts = environ["PATH_INFO"].strip("/").split("/")
+        if parts == ["stats"]:
+            start_response('200 OK', [('Content-type', 'application/json')])
+            return utils.dumps(self.tracker.stats())
+
+        if len(parts) != 2 or not parts[0].isdigit() or \
+           parts[1] not in STATES:
+            LOG.warn(_("Invalid state report %s") % environ["PATH_INFO"])
+            start_response('400 Bad Request',
+                           [('Content-type', 'text/plain')])
+            return ""
+
+        instance_id, state = parts
+        self.tracker.set_state(instance_id, state)
+
+        start_response('200 OK', [('Content-type', 'text/plain')])
+        return ""
@@ -0,0 +1,110 @@
+# vim: tabstop=4 shiftwidth=4 softtabstop=4
+
+#    Licensed under the Apache License, Version 2.0 (the "License"); you may
+#    not use this file except in compliance with the License. You may obtain
+#    a copy of the License at
+#
+#         http://www.apache.org/licenses/LICENSE-2.0
+#
+#    Unless required by applicable law or agreed to in writing, software
+#    distributed under the License is distributed on an "AS IS" BASIS, WITHOUT
+#    WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied. See the
+#    License for the specific language governing permissions and limitations
+#    under the License.
+
+"""
+Install scripts and PXE configurations written for dodai nodes.
+
+Templates live in nova/virt/dodai/<name>.template and mark placeholders
+as @NAME@.  Each template is parsed once into its literal parts and
+placeholder names; rendering joins them in a single pass, so a value can
+never be mistaken for a placeholder.  Files are written to a temporary
+file next to the destination and renamed over it, so PXE clients and
+nodes never read a half-written file.
+
+"""
+
+import os
+import re
+import tempfile
+
+from nova import exception
+from nova import log as logging
+from nova import utils
+
+
+LOG = logging.getLogger('nova.virt.dodai.template')
+
+_PLACEHOLDER = re.compile(r"@([A-Z][A-Z0-9_]*)@")
+
+
+class Template(object):
+    """A template parsed into literal parts and placeholders."""
+
+    def __init__(self, text, name=None):
+        self.name = name
+        # literals at even indexes, placeholder names at odd ones
+        self._parts = _PLACEHOLDER.split(text)
+        self.placeholders = frozenset(self._parts[1::2])
+
+    def render(self, params):
+        """Return the text with every placeholder replaced from params."""
+        missing = self.placeholders - set(params)
+        if missing:
+            raise exception.Error(_("Template %(name)s misses %(missing)s")
+                                  % {"name": self.name,
+                                     "missing": ", ".join(sorted(missing))})
+
+        parts = self._parts[:]
+        for i in xrange(1, len(parts), 2):
+            parts[i] = str(params[parts[i]])
+        return "".join(parts)
+
+    def write(self, dest_path, params):
+        """Render into dest_path, atomically replacing it."""
+        content = self.render(params)
+
+        path = os.path.dirname(dest_path)
+        if not os.path.exists(path):
+            os.makedirs(path)
+
+        fd, tmp_path = tempfile.mkstemp(dir=path,
+                                        prefix=".%s." %
+                                               os.path.basename(dest_path))
+        try:
+            f = os.fdopen(fd, "w")
+            try:
+                f.write(content)
+            finally:
+                f.close()
+            os.chmod(tmp_path, 0644)
+            os.rename(tmp_path, dest_path)
+        except Exception:
+            os.unlink(tmp_path)
+            raise
+
+
+class TemplateSet(object):
+    """The templates of a directory, parsed once."""
+
+    def __init__(self, directory=None):
+        self.directory = directory or utils.abspath("virt/dodai")
+        self._templates = {}
+        for file_name in os.listdir(self.directory):
+            if file_name.endswith(".template"):
+                self._load(file_name[:-len(".template")])
+
+    def _load(self, name):
+        f = open(os.path.join(self.directory, name + ".template"))
+        try:
+            self._templates[name] = Template(f.read(), name)
+        finally:
+            f.close()
+
+    def get(self, name):
+        if name not in self._templates:
+            raise exception.Error(_("Unknown template %s") % name)
+        return self._templates[name]
+
+    def write(self, name, dest_path, params):
+        self.get(name).write(dest_path, params)
@@ -0,0 +1,137 @@
+# vim: tabstop=4 shiftwidth=4 softtabstop=4
+
+#    Licensed under the Apache License, Version 2.0 (the "License"); you may
+#    not use this file except in compliance with the License. You may obtain
+#    a copy of the License at
+#
+#         http://www.apache.org/licenses/LICENSE-2.0
+#
+#    Unless required by applicable law or agreed to in writing, software
+#    distributed under the License is distributed on an "AS IS" BASIS, WITHOUT
+#    WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied. See the
+#    License for the specific language governing permissions and limitations
+#    under the License.
+
+"""
+Timing of the provisioning phases of dodai instances.
+
+The pipeline reports how long each phase of a spawn or destroy took, and
+how long the instance waited for the phase limit as "<phase>_wait".  When
+the operation ends, its timings are published as a dodai.instance.<op>
+notification and appended as a JSON line to dodai_phase_log, which
+"nova-manage dodai_report phases" summarizes.
+
+"""
+
+import math
+import time
+
+from nova import flags
+from nova import log as logging
+from nova import utils
+from nova.notifier import api as notifier
+
+
+LOG = logging.getLogger('nova.virt.dodai.timing')
+FLAGS = flags.FLAGS
+
+
+class PhaseTimer(object):
+    """Collects the phase timings of the operations in progress."""
+
+    def __init__(self, log_path=None):
+        self.log_path = log_path
+        if self.log_path is None:
+            self.log_path = FLAGS.dodai_phase_log
+        # (instance_id, operation) -> record being built; a destroy and
+        # the wipe it queued may be timed at the same time
+        self._records = {}
+
+    def start(self, instance_id, operation, **labels):
+        """Start timing operation ("spawn" or "destroy") of instance_id.
+
+        labels, e.g. instance_type and image_ref, are kept in the record
+        to group the report.
+        """
+        record = {"instance_id": instance_id,
+                  "operation": operation,
+                  "started_at": time.time(),
+                  "phases": {}}
+        record.update(labels)
+        self._records[(instance_id, operation)] = record
+
+    def record(self, instance_id, operation, phase, seconds):
+        record = self._records.get((instance_id, operation))
+        if record is not None:
+            phases = record["phases"]
+            phases[phase] = phases.get(phase, 0.0) + seconds
+
+    def finish(self, instance_id, operation, result="success"):
+        """Publish and log the timings of operation of instance_id."""
+        record = self._records.pop((instance_id, operation), None)
+        if record is None:
+            return None
+
+        record["result"] = result
+        record["total"] = time.time() - record["started_at"]
+        notifier.notify(notifier.publisher_id("compute"),
+                        "dodai.instance.%s" % record["operation"],
+                        notifier.INFO, record)
+        if self.log_path:
+            try:
+                f = open(self.log_path, "a")
+                try:
+                    f.write(utils.dumps(record) + "\n")
+                finally:
+                    f.close()
+            except IOError as ex:
+                LOG.warn(_("Could not log phase timings: %s") % ex)
+        return record
+
+
+def load(path):
+    """Return the records of a phase log."""
+    records = []
+    f = open(path)
+    try:
+        for line in f:
+            if line.strip():
+                records.append(utils.loads(line))
+    finally:
+        f.close()
+    return records
+
+
+def percentile(values, percent):
+    """Return the nearest-rank percentile of sorted values."""
+    if not values:
+        return None
+    rank = int(math.ceil(percent / 100.0 * len(values))) - 1
+    return values[min(max(rank, 0), len(values) - 1)]
+
+
+def report(records, group_by=None, operation=None):
+    """Summarize records per group and phase.
+
+    :param group_by: record key to group by, e.g. "instance_type" or
+                     "image_ref", None for a single group.
+    :returns: a sorted list of (group, phase, count, p50, p95, p99).
+    """
+    durations = {}
+    for record in records:
+        if operation and record.get("operation") != operation:
+            continue
+        group = group_by and str(record.get(group_by)) or "all"
+        phases = dict(record["phases"])
+        phases["total"] = record["total"]
+        for phase, seconds in phases.iteritems():
+            durations.setdefault((group, phase), []).append(seconds)
+
+    rows = []
+    for (group, phase), values in sorted(durations.iteritems()):
+        values.sort()
+        rows.append((group, phase, len(values),
+                     percentile(values, 50),
+                     percentile(values, 95),
+                     percentile(values, 99)))
+    return rows
@@ -0,0 +1,227 @@
+# vim: tabstop=4 shiftwidth=4 softtabstop=4
+
+#    Licensed under the Apache License, Version 2.0 (the "License"); you may
+#    not use this file except in compliance with the License. You may obtain
+#    a copy of the License at
+#
+#         http://www.apache.org/licenses/LICENSE-2.0
+#
+#    Unless required by applicable law or agreed to in writing, software
+#    distributed under the License is distributed on an "AS IS" BASIS, WITHOUT
+#    WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied. See the
+#    License for the specific language governing permissions and limitations
+#    under the License.
+
+"""
+Warm pool of dodai machines pre-installed with popular images.
+
+A launch reusing an "active" machine of the resource pool installed with
+its image takes seconds, a launch on any other machine a full OS install.
+The warm pool keeps the launches of the last dodai_warm_pool_history_hours
+hours; for each instance type, each of its dodai_warm_pool_images most
+launched images should be installed on as many idle machines as it was
+launched, up to dodai_warm_pool_max_per_image.  The launches are read
+from the instances table the first time they are needed, so a restart of
+nova-compute does not forget them.
+
+Every dodai_warm_pool_interval seconds, missing machines are installed
+from "inactive" machines of the resource pool.  Machines given back to the
+resource pool by a terminate are installed with the image missing the
+most machines rather than the default image.  At most
+dodai_reinstall_concurrency of these installs run at once, so a storm of
+terminates does not saturate cobbler.  The instances of the warm machines
+belong to dodai_warm_pool_user_id and dodai_warm_pool_project_id.
+
+"""
+
+import calendar
+import datetime
+import time
+
+import eventlet
+from eventlet import semaphore
+
+from nova import context as nova_context
+from nova import db
+from nova import exception
+from nova import flags
+from nova import log as logging
+from nova.compute import instance_types
+from nova.compute import vm_states
+from nova.virt.dodai import allocator
+
+
+LOG = logging.getLogger('nova.virt.dodai.warm_pool')
+FLAGS = flags.FLAGS
+
+
+class WarmPoolManager(object):
+    """Keeps popular images installed on idle machines."""
+
+    def __init__(self, driver, concurrency=None):
+        self.driver = driver
+        self.allocator = allocator.MachineAllocator()
+        self.reinstalls = semaphore.Semaphore(
+                                concurrency or
+                                FLAGS.dodai_reinstall_concurrency)
+        # instance_id -> (time, instance_type, image_ref) of the recent
+        # launches, None until loaded
+        self._launches = None
+        # (instance_type, image_ref) -> installs in progress
+        self._installing = {}
+
+    def record_launch(self, instance_id, instance_type, image_ref):
+        # not loaded yet, the launch will be read with the others
+        if self._launches is not None:
+            self._launches[instance_id] = (time.time(), instance_type,
+                                           str(image_ref))
+
+    def _load_launches(self, context, since):
+        instances = db.instance_get_all_by_host_created_since(
+                            context.elevated(), FLAGS.host,
+                            datetime.datetime.utcfromtimestamp(since))
+        self._launches = {}
+        for instance in instances:
+            if instance["availability_zone"] == allocator.RESOURCE_POOL or \
+               not instance["instance_type"]:
+                continue
+            when = calendar.timegm(instance["created_at"].utctimetuple())
+            self._launches[instance["id"]] = (
+                    when, instance["instance_type"]["name"],
+                    str(instance["image_ref"]))
+
+    def targets(self, context):
+        """Return {(instance_type, image_ref): machines to keep warm}."""
+        since = time.time() - FLAGS.dodai_warm_pool_history_hours * 3600
+        if self._launches is None:
+            self._load_launches(context, since)
+        for instance_id, launch in self._launches.items():
+            if launch[0] < since:
+                del self._launches[instance_id]
+
+        counts = {}
+        for when, instance_type, image_ref in self._launches.values():
+            key = (instance_type, image_ref)
+            counts[key] = counts.get(key, 0) + 1
+
+        by_type = {}
+        for (instance_type, image_ref), count in counts.iteritems():
+            by_type.setdefault(instance_type, []).append((count, image_ref))
+
+        targets = {}
+        for instance_type, images in by_type.iteritems():
+            images.sort(reverse=True)
+            for count, image_ref in images[:FLAGS.dodai_warm_pool_images]:
+                targets[(instance_type, image_ref)] = \
+                        min(count, FLAGS.dodai_warm_pool_max_per_image)
+        return targets
+
+    def deficits(self, context, instance_type=None):
+        """Return {(instance_type, image_ref): machines missing}."""
+        targets = self.targets(context)
+        warm = {}
+        for type_name in set(key[0] for key in targets):
+            if instance_type and type_name != instance_type:
+                continue
+            for image_ref, count in self._warm_counts(context,
+                                                      type_name).iteritems():
+                warm[(type_name, image_ref)] = count
+
+        deficits = {}
+        for key, target in targets.iteritems():
+            if instance_type and key[0] != instance_type:
+                continue
+            missing = target - warm.get(key, 0) - \
+                      self._installing.get(key, 0)
+            if missing > 0:
+                deficits[key] = missing
+        return deficits
+
+    def _warm_counts(self, context, instance_type):
+        bmms = db.bmm_get_all_by_instance_type_and_status(
+                                context, instance_type, ["active"],
+                                allocator.RESOURCE_POOL)
+        instance_ids = [bmm["instance_id"] for bmm in bmms
+                        if bmm["instance_id"]]
+        counts = {}
+        for instance in db.instance_get_all_by_ids(context.elevated(),
+                                                   instance_ids):
+            image_ref = str(instance["image_ref"])
+            counts[image_ref] = counts.get(image_ref, 0) + 1
+        return counts
+
+    def image_for(self, context, instance_type):
+        """Return the image a machine of instance_type should get."""
+        deficits = self.deficits(context, instance_type)
+        if not deficits:
+            return str(FLAGS.dodai_default_image)
+        missing, key = max((missing, key)
+                           for key, missing in deficits.iteritems())
+        return key[1]
+
+    def reinstall(self, context, instance, bmm, instance_type):
+        """Install the image of instance on bmm for the resource pool."""
+        key = (instance_type, str(instance["image_ref"]))
+        self._installing[key] = self._installing.get(key, 0) + 1
+        try:
+            self._install(context, instance, bmm)
+        finally:
+            self._done(key)
+
+    def _install(self, context, instance, bmm):
+        with self.reinstalls:
+            self.driver._install_machine(context, instance, bmm,
+                                         allocator.RESOURCE_POOL, None, True)
+
+    def _done(self, key):
+        self._installing[key] -= 1
+        if not self._installing[key]:
+            del self._installing[key]
+
+    def replenish(self, context=None):
+        """Start the installs of the machines missing in the warm pool."""
+        context = context or nova_context.get_admin_context()
+        threads = []
+        for (instance_type, image_ref), missing in \
+                self.deficits(context).iteritems():
+            for i in xrange(missing):
+                try:
+                    bmm, reuse = self.allocator.allocate(
+                                        context, instance_type, image_ref,
+                                        1, for_resource_pool=True)[0]
+                except exception.BareMetalMachineUnavailable:
+                    break
+                LOG.info(_("Warming machine %(name)s with image "
+                           "%(image_ref)s") % {"name": bmm["name"],
+                                               "image_ref": image_ref})
+                key = (instance_type, image_ref)
+                # counted now so that the next deficits() sees it
+                self._installing[key] = self._installing.get(key, 0) + 1
+                threads.append(eventlet.spawn(self._warm, context, bmm,
+                                              instance_type, image_ref))
+        return threads
+
+    def _warm(self, context, bmm, instance_type, image_ref):
+        instance = None
+        try:
+            inst_type = instance_types.get_instance_type_by_name(
+                                                        instance_type)
+            instance = db.instance_create(context,
+                    {"availability_zone": allocator.RESOURCE_POOL,
+                     "user_id": FLAGS.dodai_warm_pool_user_id,
+                     "project_id": FLAGS.dodai_warm_pool_project_id,
+                     "host": FLAGS.host,
+                     "display_name": bmm["name"],
+                     "instance_type_id": inst_type["id"],
+                     "vcpus": inst_type["vcpus"],
+                     "vm_state": vm_states.BUILDING,
+                     "image_ref": image_ref})
+            self._install(context, instance, bmm)
+        except Exception:
+            LOG.exception(_("Warming machine %s failed") % bmm["name"])
+            db.bmm_update(context, bmm["id"], {"status": "inactive",
+                                               "instance_id": None})
+            if instance is not None:
+                db.instance_destroy(context, instance["id"])
+        finally:
+            self._done((instance_type, image_ref))
@@ -0,0 +1,104 @@
+# vim: tabstop=4 shiftwidth=4 softtabstop=4
+
+#    Licensed under the Apache License, Version 2.0 (the "License"); you may
+#    not use this file except in compliance with the License. You may obtain
+#    a copy of the License at
+#
+#         http://www.apache.org/licenses/LICENSE-2.0
+#
+#    Unless required by applicable law or agreed to in writing, software
+#    distributed under the License is distributed on an "AS IS" BASIS, WITHOUT
+#    WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied. See the
+#    License for the specific language governing permissions and limitations
+#    under the License.
+
+"""
+Deferred disk wipes of destroyed dodai instances.
+
+Destroying an instance only releases its network and its record; the
+machine stays "processing" while its disk is wiped in the background by
+delete.sh, at most dodai_wipe_concurrency machines at once.  The machine
+goes back to the resource pool once the wipe is done (see
+DodaiConnection.add_to_resource_pool).  A machine whose wipe failed or
+timed out is set to "error" instead.
+
+dodai_wipe_strategy chooses the wipe:
+
+:none:    no wipe, the next install overwrites the disk.
+:quick:   erase the partition table and filesystem signatures.
+:secure:  overwrite the whole disk with zeros.
+
+"""
+
+import eventlet
+from eventlet import semaphore
+from eventlet import timeout
+
+from nova import exception
+from nova import flags
+from nova import log as logging
+
+
+LOG = logging.getLogger('nova.virt.dodai.wipe')
+FLAGS = flags.FLAGS
+
+STRATEGIES = ("none", "quick", "secure")
+
+
+def get_strategy():
+    strategy = FLAGS.dodai_wipe_strategy
+    if strategy not in STRATEGIES:
+        raise exception.Error(_("Unknown wipe strategy: %s") % strategy)
+    return strategy
+
+
+class WipeQueue(object):
+    """Runs the wipes of machines in the background."""
+
+    def __init__(self, wipe, concurrency=None, wipe_timeout=None):
+        """:param wipe: callable wiping a machine, called with the
+                       arguments given to submit().
+        """
+        self.wipe = wipe
+        self._semaphore = semaphore.Semaphore(
+                                concurrency or FLAGS.dodai_wipe_concurrency)
+        self.wipe_timeout = wipe_timeout or FLAGS.dodai_wipe_timeout
+        # bmm_id -> greenthread wiping the machine
+        self._wiping = {}
+        # ids of the machines whose last wipe failed
+        self.failed = set()
+
+    def submit(self, bmm_id, *args):
+        """Queue the wipe of machine bmm_id and return at once."""
+        self.failed.discard(bmm_id)
+        thread = eventlet.spawn(self._run, bmm_id, *args)
+        self._wiping[bmm_id] = thread
+        thread.link(self._clear, bmm_id)
+        return thread
+
+    def wait(self, bmm_id):
+        """Wait for the wipe of bmm_id, if any, and raise its error."""
+        thread = self._wiping.get(bmm_id)
+        if thread is not None:
+            thread.wait()
+        if bmm_id in self.failed:
+            raise exception.Error(_("Wiping machine %s failed") % bmm_id)
+
+    def pending(self):
+        """Return the ids of the machines being or waiting to be wiped."""
+        return self._wiping.keys()
+
+    def _run(self, bmm_id, *args):
+        with self._semaphore:
+            LOG.debug(_("Wiping machine %s") % bmm_id)
+            try:
+                with timeout.Timeout(self.wipe_timeout,
+                                     exception.Error(_("Wipe timed out"))):
+                    self.wipe(*args)
+            except Exception:
+                LOG.exception(_("Wiping machine %s failed") % bmm_id)
+                self.failed.add(bmm_id)
+
+    def _clear(self, thread, bmm_id):
+        if self._wiping.get(bmm_id) is thread:
+            del self._wiping[bmm_id]
@@ -21,7 +21,14 @@
 Handling of VM disk images.
 """
 
+import hashlib
+import httplib
 import os
+import socket
+import time
+
+import eventlet
+from eventlet import greenthread
 
 from nova import exception
 from nova import flags
@@ -34,17 +41,271 @@ from nova import utils
 FLAGS = flags.FLAGS
 LOG = logging.getLogger('nova.virt.images')
 
+flags.DEFINE_integer('image_fetch_chunk_size', 1024 * 1024,
+                     'Bytes read at once while fetching an image')
+flags.DEFINE_integer('image_fetch_retries', 5,
+                     'Times a dropped image download is resumed')
+flags.DEFINE_integer('image_fetch_segments', 1,
+                     'Number of ranges of a large image fetched in parallel')
+flags.DEFINE_integer('image_fetch_segment_min_mb', 1024,
+                     'Size from which an image is fetched in segments')
+
+# totals of every fetch made by this process
+_FETCH_TOTALS = {'fetches': 0,
+                 'bytes': 0,
+                 'seconds': 0.0,
+                 'retries': 0}
+
+
+def get_fetch_stats():
+    """Return the totals of the image fetches made by this process."""
+    stats = dict(_FETCH_TOTALS)
+    if stats['seconds']:
+        stats['bytes_per_second'] = stats['bytes'] / stats['seconds']
+    else:
+        stats['bytes_per_second'] = 0
+    return stats
+
+
+class _RangesUnsupported(exception.Error):
+    pass
+
+
+class _ChecksumFile(object):
+    """File wrapper computing the md5 and size of what is written."""
+
+    def __init__(self, f):
+        self.f = f
+        self.md5 = hashlib.md5()
+        self.size = 0
+
+    def write(self, data):
+        self.md5.update(data)
+        self.size += len(data)
+        self.f.write(data)
+
+
+class ImageFetcher(object):
+    """Streams an image to a file, resuming dropped downloads.
+
+    Image services without get_range are read in one go with get.  From
+    Glance the image is read image_fetch_chunk_size bytes at a time; after
+    an error the download goes on from the last byte written, or from the
+    start if the server does not honour ranges.  A stream ending before the
+    size in the image metadata is resumed the same way.  Images of at least
+    image_fetch_segment_min_mb are split into image_fetch_segments ranges
+    fetched in parallel, or fetched in one stream if the server ignores
+    ranges.
+    """
+
+    def __init__(self, context, image_service, image_id, path):
+        self.context = context
+        self.image_service = image_service
+        self.image_id = image_id
+        self.path = path
+        self.chunk_size = FLAGS.image_fetch_chunk_size
+        self.retries = FLAGS.image_fetch_retries
+        self._md5 = None
+        # bytes announced by the image metadata, None if unknown
+        self._size = None
+        self.stats = {'bytes': 0,
+                      'seconds': 0.0,
+                      'first_byte_seconds': None,
+                      'retries': 0,
+                      'segments': 1,
+                      'checksum': None}
+
+    def fetch(self):
+        """Fetch the image into path and return its metadata."""
+        start = time.time()
+        try:
+            if hasattr(self.image_service, 'get_range'):
+                metadata = self._fetch_ranges()
+            else:
+                metadata = self._fetch_whole()
+        finally:
+            self.stats['seconds'] = time.time() - start
+            self._record()
+
+        LOG.debug(_('Fetched image %(image_id)s: %(stats)s') %
+                  {'image_id': self.image_id, 'stats': self.stats})
+        return metadata
 
-def fetch(context, image_href, path, _user_id, _project_id):
+    def _record(self):
+        _FETCH_TOTALS['fetches'] += 1
+        _FETCH_TOTALS['bytes'] += self.stats['bytes']
+        _FETCH_TOTALS['seconds'] += self.stats['seconds']
+        _FETCH_TOTALS['retries'] += self.stats['retries']
+        seconds = self.stats['seconds']
+        if seconds:
+            self.stats['bytes_per_second'] = self.stats['bytes'] / seconds
+        else:
+            self.stats['bytes_per_second'] = 0
+
+    def _fetch_whole(self):
+        with open(self.path, 'wb') as image_file:
+            checksum_file = _ChecksumFile(image_file)
+            metadata = self.image_service.get(self.context, self.image_id,
+                                              checksum_file)
+        self.stats['bytes'] = checksum_file.size
+        size = _image_size(metadata)
+        if size is not None and checksum_file.size != size:
+            raise exception.Error(_('Fetched %(fetched)d bytes of image '
+                                    '%(image_id)s instead of %(size)d') %
+                                  {'fetched': checksum_file.size,
+                                   'image_id': self.image_id,
+                                   'size': size})
+        self.stats['checksum'] = checksum_file.md5.hexdigest()
+        return metadata
+
+    def _fetch_ranges(self):
+        metadata = self.image_service.show(self.context, self.image_id)
+        size = _image_size(metadata)
+        segments = FLAGS.image_fetch_segments
+        if not size or segments <= 1 or \
+           size < FLAGS.image_fetch_segment_min_mb * 1024 * 1024:
+            return self._fetch_stream(metadata)
+
+        segment_size = (size + segments - 1) / segments
+        with open(self.path, 'wb') as image_file:
+            image_file.truncate(size)
+
+        def _fetch_segment(offset):
+            with open(self.path, 'r+b') as image_file:
+                image_file.seek(offset)
+                self._fetch_range(image_file, offset,
+                                  min(segment_size, size - offset))
+
+        pool = eventlet.GreenPool(segments)
+        try:
+            for _result in pool.imap(_fetch_segment,
+                                     range(0, size, segment_size)):
+                pass
+        except _RangesUnsupported:
+            for thread in list(pool.coroutines_running):
+                thread.kill()
+            LOG.warn(_('Image server does not support ranges, fetching '
+                       'image %s in one stream') % self.image_id)
+            self.stats['bytes'] = 0
+            return self._fetch_stream(metadata)
+        self.stats['segments'] = segments
+        self.stats['checksum'] = self._file_checksum()
+        return metadata
+
+    def _fetch_stream(self, metadata):
+        self._size = _image_size(metadata)
+        self._md5 = hashlib.md5()
+        with open(self.path, 'wb') as image_file:
+            self._fetch_range(image_file, 0, None, checksum=True)
+        self.stats['checksum'] = self._md5.hexdigest()
+        return metadata
+
+    def _fetch_range(self, image_file, start, length, checksum=False):
+        """Write length bytes from start, or the rest of the image."""
+        offset = start
+        attempt = 0
+        request_time = time.time()
+        while True:
+            try:
+                self._read_range(image_file, start, offset, length,
+                                 checksum, request_time)
+                return
+            except (IOError, socket.error, httplib.HTTPException), e:
+                attempt += 1
+                if attempt > self.retries:
+                    raise
+                self.stats['retries'] += 1
+                offset = image_file.tell()
+                LOG.warn(_('Fetch of image %(image_id)s failed at byte '
+                           '%(offset)s, resuming: %(e)s') %
+                         {'image_id': self.image_id, 'offset': offset,
+                          'e': e})
+                greenthread.sleep(min(2 ** attempt, 30))
+
+    def _read_range(self, image_file, start, offset, length, checksum,
+                    request_time):
+        remaining = None
+        if length is not None:
+            remaining = length - (offset - start)
+        response, partial = self.image_service.get_range(self.context,
+                                                         self.image_id,
+                                                         offset, remaining)
+        if length is not None and not partial:
+            # other segments share the file, it must not be rewritten
+            raise _RangesUnsupported(_('Image server does not support '
+                                       'ranges'))
+        if offset and not partial:
+            # the whole image is sent again
+            image_file.seek(0)
+            image_file.truncate()
+            self.stats['bytes'] -= offset
+            if checksum:
+                self._md5 = hashlib.md5()
+
+        while remaining is None or remaining > 0:
+            read_size = self.chunk_size
+            if remaining is not None:
+                read_size = min(read_size, remaining)
+            chunk = response.read(read_size)
+            if not chunk:
+                break
+            if self.stats['first_byte_seconds'] is None:
+                self.stats['first_byte_seconds'] = time.time() - request_time
+            image_file.write(chunk)
+            if checksum:
+                self._md5.update(chunk)
+            self.stats['bytes'] += len(chunk)
+            if remaining is not None:
+                remaining -= len(chunk)
+
+        if remaining:
+            raise IOError(_('Connection closed with %d bytes left')
+                          % remaining)
+        if length is None and self._size is not None and \
+           image_file.tell() < self._size:
+            # resumed from the last byte written by _fetch_range
+            raise IOError(_('Connection closed at byte %(offset)d of '
+                            '%(size)d') % {'offset': image_file.tell(),
+                                           'size': self._size})
+
+    def _file_checksum(self):
+        md5 = hashlib.md5()
+        with open(self.path, 'rb') as image_file:
+            while True:
+                chunk = image_file.read(self.chunk_size)
+                if not chunk:
+                    break
+                md5.update(chunk)
+        return md5.hexdigest()
+
+
+def _image_size(metadata):
+    size = metadata.get('size') or \
+           metadata.get('properties', {}).get('size')
+    if size is None:
+        return None
+    return int(size)
+
+
+def fetch(context, image_href, path, _user_id, _project_id, stats=None):
+    """Fetch an image into path and return its metadata.
+
+    :param stats: optional dict filled with the bytes, seconds,
+                  first_byte_seconds, bytes_per_second, retries, segments
+                  and md5 checksum of the fetch.
+    """
     # TODO(vish): Improve context handling and add owner and auth data
     #             when it is added to glance.  Right now there is no
     #             auth checking in glance, so we assume that access was
     #             checked before we got here.
     (image_service, image_id) = nova.image.get_image_service(context,
                                                              image_href)
-    with open(path, "wb") as image_file:
-        metadata = image_service.get(context, image_id, image_file)
-    return metadata
+    fetcher = ImageFetcher(context, image_service, image_id, path)
+    try:
+        return fetcher.fetch()
+    finally:
+        if stats is not None:
+            stats.update(fetcher.stats)
 
 def show(context, image_href):
     (image_service, image_id) = nova.image.get_image_service(context,
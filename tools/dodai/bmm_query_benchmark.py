@@ -0,0 +1,183 @@
+#!/usr/bin/env python
+# vim: tabstop=4 shiftwidth=4 softtabstop=4
+
+#    Licensed under the Apache License, Version 2.0 (the "License"); you may
+#    not use this file except in compliance with the License. You may obtain
+#    a copy of the License at
+#
+#         http://www.apache.org/licenses/LICENSE-2.0
+#
+#    Unless required by applicable law or agreed to in writing, software
+#    distributed under the License is distributed on an "AS IS" BASIS, WITHOUT
+#    WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied. See the
+#    License for the specific language governing permissions and limitations
+#    under the License.
+
+"""
+Times the dodai bare metal machine queries before and after the indexes of
+dodai migration 003.
+
+A scratch sqlite database is filled with --machines machines (and one
+switch per machine), every query is run --warmup times untimed and
+--repeat times timed on the schema of version 002, the database is
+upgraded and the queries are run again.
+
+  tools/dodai/bmm_query_benchmark.py --machines=2000 --repeat=1000 \
+      --warmup=200
+
+ms per query, before and after the upgrade:
+
+  query                                     2000 machines  10000 machines
+  bmm_get_by_instance_id                    1.408  1.190   1.774  1.377
+  bmm_get_by_name                           1.241  1.461   1.928  1.995
+  bmm_get_all_by_instance_type_and_zone     1.285  1.055   2.292  1.334
+  bmm_get_all_by_instance_type_and_status   5.737  5.282  24.350 21.783
+  bmm_get_by_availability_zone              1.368  1.107   2.502  1.414
+  switch_get_by_dpid_and_outer_port         0.938  0.962   1.242  1.178
+
+Even the cheapest lookup takes about 1ms, which no index can save.  The
+lookups by name and by switch port gained nothing from an index and are
+left unindexed.  The instance_type and status lookup loads every free
+machine of the type; the index only saves the scan under the loading.
+"""
+
+import gettext
+import os
+import random
+import sys
+import tempfile
+import time
+
+possible_topdir = os.path.normpath(os.path.join(os.path.abspath(sys.argv[0]),
+                                   os.pardir,
+                                   os.pardir,
+                                   os.pardir))
+if os.path.exists(os.path.join(possible_topdir, 'nova', '__init__.py')):
+    sys.path.insert(0, possible_topdir)
+
+gettext.install('nova', unicode=1)
+
+from nova import db
+from nova import flags
+from nova import utils
+from nova.db.sqlalchemy import migration
+from nova.db.sqlalchemy import models
+from nova.db.sqlalchemy import session
+
+
+FLAGS = flags.FLAGS
+flags.DEFINE_integer('machines', 10000, 'number of machines to create')
+flags.DEFINE_integer('repeat', 200, 'times each query is run')
+flags.DEFINE_integer('warmup', 50, 'untimed runs of each query before '
+                     'the timed ones')
+
+INSTANCE_TYPES = ["m1.small", "m1.medium", "m1.large", "m1.xlarge"]
+STATUSES = ["inactive", "active", "processing", "used"]
+CLUSTERS = 50
+
+
+def populate(count):
+    engine = session.get_engine_dodai()
+    now = utils.utcnow()
+    machines = []
+    switches = []
+    for i in xrange(count):
+        status = random.choice(STATUSES)
+        if status in ("inactive", "active"):
+            zone = "resource_pool"
+        else:
+            zone = "cluster%d,%d" % (i % CLUSTERS, 100 + i % CLUSTERS)
+        machines.append({"created_at": now,
+                         "deleted": i % 10 == 0,
+                         "name": "node%05d" % i,
+                         "instance_id": i + 1 if status != "inactive"
+                                        else None,
+                         "instance_type": INSTANCE_TYPES[i % 4],
+                         "availability_zone": zone,
+                         "status": status,
+                         "dpid1": "%016x" % (i / 48),
+                         "server_port1": i % 48})
+        switches.append({"created_at": now,
+                         "deleted": False,
+                         "dpid": "%016x" % (i / 48),
+                         "outer_port": i % 48})
+    engine.execute(models.BareMetalMachine.__table__.insert(), machines)
+    engine.execute(models.Switch.__table__.insert(), switches)
+
+
+def queries(count):
+    def _pick():
+        return random.randint(0, count - 1)
+
+    return [
+        ("bmm_get_by_instance_id",
+         lambda: _call(db.bmm_get_by_instance_id, None, _pick() + 1)),
+        ("bmm_get_by_name",
+         lambda: _call(db.bmm_get_by_name, None, "node%05d" % _pick())),
+        ("bmm_get_all_by_instance_type_and_zone",
+         lambda: db.bmm_get_all_by_instance_type_and_zone(
+                     None, random.choice(INSTANCE_TYPES),
+                     "cluster%d,%d" % (_pick() % CLUSTERS,
+                                       100 + _pick() % CLUSTERS))),
+        ("bmm_get_all_by_instance_type_and_status",
+         lambda: db.bmm_get_all_by_instance_type_and_status(
+                     None, random.choice(INSTANCE_TYPES), ["inactive"],
+                     "resource_pool")),
+        ("bmm_get_by_availability_zone",
+         lambda: db.bmm_get_by_availability_zone(
+                     None, "cluster%d,%d" % (_pick() % CLUSTERS,
+                                             100 + _pick() % CLUSTERS))),
+        ("switch_get_by_dpid_and_outer_port",
+         lambda: db.switch_get_by_dpid_and_outer_port(
+                     None, "%016x" % (_pick() / 48), _pick() % 48)),
+        ]
+
+
+def _call(func, *args):
+    try:
+        return func(*args)
+    except Exception:
+        # deleted machines are not found
+        return None
+
+
+def run(count, repeat, warmup):
+    results = {}
+    for name, query in queries(count):
+        # fill the page cache and the sqlalchemy compiled statements
+        for i in xrange(warmup):
+            query()
+        random.seed(0)
+        start = time.time()
+        for i in xrange(repeat):
+            query()
+        results[name] = (time.time() - start) * 1000.0 / repeat
+    return results
+
+
+def main():
+    argv = FLAGS(sys.argv)
+    fd, path = tempfile.mkstemp(suffix=".sqlite")
+    os.close(fd)
+    FLAGS.sql_connection_dodai = "sqlite:///%s" % path
+    try:
+        migration.db_sync_dodai(2)
+        random.seed(0)
+        populate(FLAGS.machines)
+        before = run(FLAGS.machines, FLAGS.repeat, FLAGS.warmup)
+
+        migration.db_sync_dodai()
+        after = run(FLAGS.machines, FLAGS.repeat, FLAGS.warmup)
+    finally:
+        os.unlink(path)
+
+    print "%d machines, %d runs per query, ms per query" % (FLAGS.machines,
+                                                          FLAGS.repeat)
+    print "%-42s %10s %10s %8s" % ("query", "before", "after", "speedup")
+    for name, query in queries(FLAGS.machines):
+        print "%-42s %10.3f %10.3f %7.1fx" % (name, before[name], after[name],
+                                              before[name] / after[name])
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,112 @@
+#!/usr/bin/env python
+# vim: tabstop=4 shiftwidth=4 softtabstop=4
+
+#    Licensed under the Apache License, Version 2.0 (the "License"); you may
+#    not use this file except in compliance with the License. You may obtain
+#    a copy of the License at
+#
+#         http://www.apache.org/licenses/LICENSE-2.0
+#
+#    Unless required by applicable law or agreed to in writing, software
+#    distributed under the License is distributed on an "AS IS" BASIS, WITHOUT
+#    WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied. See the
+#    License for the specific language governing permissions and limitations
+#    under the License.
+
+"""
+Compares the run_instances admission check loading every machine of the
+instance type, as done before, with reading the bmm_capacity counters,
+for inventories of growing size in a scratch sqlite database.
+
+  tools/dodai/capacity_benchmark.py --machines=100,1000,10000 --checks=200
+"""
+
+import gettext
+import os
+import sys
+import tempfile
+import time
+
+possible_topdir = os.path.normpath(os.path.join(os.path.abspath(sys.argv[0]),
+                                   os.pardir,
+                                   os.pardir,
+                                   os.pardir))
+if os.path.exists(os.path.join(possible_topdir, 'nova', '__init__.py')):
+    sys.path.insert(0, possible_topdir)
+
+gettext.install('nova', unicode=1)
+
+from nova import db
+from nova import flags
+from nova import utils
+from nova.db.sqlalchemy import migration
+from nova.db.sqlalchemy import models
+from nova.db.sqlalchemy import session
+
+
+FLAGS = flags.FLAGS
+flags.DEFINE_list('machines', ['100', '1000', '10000'],
+                  'inventory sizes measured')
+flags.DEFINE_integer('checks', 200, 'admission checks per inventory size')
+
+STATUSES = ("inactive", "active", "processing", "used")
+
+
+def scan_count(instance_type):
+    available_count = 0
+    for bmm in db.bmm_get_all_by_instance_type(None, instance_type):
+        if bmm["status"] == "inactive" or bmm["status"] == "active":
+            available_count += 1
+    return available_count
+
+
+def counter_count(instance_type):
+    return db.bmm_capacity_count(None, instance_type,
+                                 ["inactive", "active"])
+
+
+def _grow(total, size):
+    """Add machines until there are size of them."""
+    now = utils.utcnow()
+    machines = [{"created_at": now,
+                 "deleted": False,
+                 "name": "node%05d" % i,
+                 "instance_type": "m1.small",
+                 "availability_zone": "resource_pool",
+                 "status": STATUSES[i % len(STATUSES)]}
+                for i in xrange(total, size)]
+    if machines:
+        session.get_engine_dodai().execute(
+                models.BareMetalMachine.__table__.insert(), machines)
+    db.bmm_capacity_rebuild(None)
+
+
+def _time(func):
+    start = time.time()
+    for i in xrange(FLAGS.checks):
+        result = func("m1.small")
+    return result, (time.time() - start) * 1000 / FLAGS.checks
+
+
+def main():
+    FLAGS(sys.argv)
+    fd, path = tempfile.mkstemp(suffix=".sqlite")
+    os.close(fd)
+    FLAGS.sql_connection_dodai = "sqlite:///%s" % path
+    try:
+        migration.db_sync_dodai()
+        print '%10s %14s %14s' % ('machines', 'scan ms', 'counters ms')
+        total = 0
+        for size in sorted(int(size) for size in FLAGS.machines):
+            _grow(total, size)
+            total = size
+            scanned, scan_time = _time(scan_count)
+            counted, counter_time = _time(counter_count)
+            assert scanned == counted
+            print '%10d %14.3f %14.3f' % (size, scan_time, counter_time)
+    finally:
+        os.unlink(path)
+
+
+if __name__ == '__main__':
+    main()
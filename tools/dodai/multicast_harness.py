@@ -0,0 +1,160 @@
+#!/usr/bin/env python
+# vim: tabstop=4 shiftwidth=4 softtabstop=4
+
+#    Licensed under the Apache License, Version 2.0 (the "License"); you may
+#    not use this file except in compliance with the License. You may obtain
+#    a copy of the License at
+#
+#         http://www.apache.org/licenses/LICENSE-2.0
+#
+#    Unless required by applicable law or agreed to in writing, software
+#    distributed under the License is distributed on an "AS IS" BASIS, WITHOUT
+#    WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied. See the
+#    License for the specific language governing permissions and limitations
+#    under the License.
+
+"""
+Compares http and multicast distribution of an image to N local receivers.
+
+The image is served once by a local http server to N concurrent clients,
+as cobbler does when N nodes install at once, then sent once by
+udp-sender to N udp-receiver processes, as done with
+dodai_image_distribution=multicast.  Receivers write to /dev/null.  The
+wall time and the bytes sent by the server are printed for both.
+
+udpcast (udp-sender and udp-receiver) must be installed.
+
+  tools/dodai/multicast_harness.py --receivers=20 --size_mb=256
+"""
+
+import BaseHTTPServer
+import gettext
+import os
+import SimpleHTTPServer
+import subprocess
+import sys
+import tempfile
+import threading
+import time
+import urllib2
+
+possible_topdir = os.path.normpath(os.path.join(os.path.abspath(sys.argv[0]),
+                                   os.pardir,
+                                   os.pardir,
+                                   os.pardir))
+if os.path.exists(os.path.join(possible_topdir, 'nova', '__init__.py')):
+    sys.path.insert(0, possible_topdir)
+
+gettext.install('nova', unicode=1)
+
+from nova import flags
+
+
+FLAGS = flags.FLAGS
+flags.DEFINE_integer('receivers', 20, 'number of simulated nodes')
+flags.DEFINE_integer('size_mb', 256, 'size of the test image')
+flags.DEFINE_integer('portbase', 9500, 'udp portbase of the session')
+flags.DEFINE_string('interface', 'lo', 'interface udp-sender sends on')
+
+
+class _CountingHandler(SimpleHTTPServer.SimpleHTTPRequestHandler):
+    bytes_sent = 0
+
+    def copyfile(self, source, outputfile):
+        while True:
+            data = source.read(1024 * 1024)
+            if not data:
+                break
+            outputfile.write(data)
+            _CountingHandler.bytes_sent += len(data)
+
+    def log_message(self, *args):
+        pass
+
+
+class _ThreadingServer(BaseHTTPServer.HTTPServer):
+    def process_request(self, request, client_address):
+        thread = threading.Thread(target=self._handle,
+                                  args=(request, client_address))
+        thread.start()
+
+    def _handle(self, request, client_address):
+        self.finish_request(request, client_address)
+        self.close_request(request)
+
+
+def http_run(image_path, receivers):
+    os.chdir(os.path.dirname(image_path))
+    server = _ThreadingServer(('127.0.0.1', 0), _CountingHandler)
+    thread = threading.Thread(target=server.serve_forever)
+    thread.setDaemon(True)
+    thread.start()
+    url = 'http://127.0.0.1:%d/%s' % (server.server_address[1],
+                                      os.path.basename(image_path))
+
+    def _fetch():
+        response = urllib2.urlopen(url)
+        while response.read(1024 * 1024):
+            pass
+
+    start = time.time()
+    clients = [threading.Thread(target=_fetch) for i in xrange(receivers)]
+    for client in clients:
+        client.start()
+    for client in clients:
+        client.join()
+    elapsed = time.time() - start
+    server.shutdown()
+    return elapsed, _CountingHandler.bytes_sent
+
+
+def multicast_run(image_path, receivers):
+    devnull = open(os.devnull, 'w')
+    start = time.time()
+    sender = subprocess.Popen(['udp-sender', '--nokbd',
+                               '--file', image_path,
+                               '--portbase', str(FLAGS.portbase),
+                               '--interface', FLAGS.interface,
+                               '--min-receivers', str(receivers),
+                               '--max-wait', '30'],
+                              stdout=devnull, stderr=devnull)
+    nodes = [subprocess.Popen(['udp-receiver', '--nokbd',
+                               '--portbase', str(FLAGS.portbase),
+                               '--interface', FLAGS.interface,
+                               '--start-timeout', '60',
+                               '--file', os.devnull],
+                              stdout=devnull, stderr=devnull)
+             for i in xrange(receivers)]
+    failed = len([node for node in nodes if node.wait() != 0])
+    sender.wait()
+    elapsed = time.time() - start
+    if failed:
+        print '%d receivers failed' % failed
+    return elapsed, os.path.getsize(image_path)
+
+
+def main():
+    FLAGS(sys.argv)
+    fd, image_path = tempfile.mkstemp(suffix='.img')
+    try:
+        f = os.fdopen(fd, 'wb')
+        block = os.urandom(1024 * 1024)
+        for i in xrange(FLAGS.size_mb):
+            f.write(block)
+        f.close()
+
+        http_time, http_bytes = http_run(image_path, FLAGS.receivers)
+        mc_time, mc_bytes = multicast_run(image_path, FLAGS.receivers)
+    finally:
+        os.unlink(image_path)
+
+    print '%d receivers, %d MB image' % (FLAGS.receivers, FLAGS.size_mb)
+    print '%-10s %10s %14s' % ('mode', 'seconds', 'MB sent')
+    print '%-10s %10.1f %14.1f' % ('http', http_time,
+                                   http_bytes / 1024.0 / 1024.0)
+    print '%-10s %10.1f %14.1f' % ('multicast', mc_time,
+                                   mc_bytes / 1024.0 / 1024.0)
+
+
+if __name__ == '__main__':
+    main()
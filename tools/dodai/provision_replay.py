@@ -0,0 +1,212 @@
+#!/usr/bin/env python
+# vim: tabstop=4 shiftwidth=4 softtabstop=4
+
+#    Licensed under the Apache License, Version 2.0 (the "License"); you may
+#    not use this file except in compliance with the License. You may obtain
+#    a copy of the License at
+#
+#         http://www.apache.org/licenses/LICENSE-2.0
+#
+#    Unless required by applicable law or agreed to in writing, software
+#    distributed under the License is distributed on an "AS IS" BASIS, WITHOUT
+#    WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied. See the
+#    License for the specific language governing permissions and limitations
+#    under the License.
+
+"""
+Measures the orchestration overhead of dodai installs.
+
+Installs --instances instances at once through DodaiConnection with a
+fake BMC and a fake node: powering a machine on makes the node report
+"install", "install_reboot" and "installed" after the durations of the
+boot, write and installed phases, taken from a phase log
+(--phase_log, as written to dodai_phase_log) or from --boot, --write and
+--installed.  Durations are divided by --speedup.  Nothing leaves the
+host: the database, the image cache and IPMI are faked.
+
+The time an instance takes minus the time its fake node took is the
+overhead of the driver: templates, pipeline limits, state waits and
+polling.
+
+  tools/dodai/provision_replay.py --instances=200 --speedup=100
+"""
+
+import gettext
+import os
+import shutil
+import sys
+import tempfile
+import time
+
+import eventlet
+eventlet.monkey_patch()
+
+possible_topdir = os.path.normpath(os.path.join(os.path.abspath(sys.argv[0]),
+                                   os.pardir,
+                                   os.pardir,
+                                   os.pardir))
+if os.path.exists(os.path.join(possible_topdir, 'nova', '__init__.py')):
+    sys.path.insert(0, possible_topdir)
+
+gettext.install('nova', unicode=1)
+
+from nova import flags
+from nova.virt.dodai import connection
+from nova.virt.dodai import power
+from nova.virt.dodai import timing
+
+
+FLAGS = flags.FLAGS
+flags.DEFINE_integer('instances', 100, 'number of instances installed')
+flags.DEFINE_float('speedup', 100.0, 'divisor of the node durations')
+flags.DEFINE_string('phase_log', None, 'phase log to replay durations of')
+flags.DEFINE_float('boot', 120.0, 'seconds from power on to "install"')
+flags.DEFINE_float('write', 300.0, 'seconds from "install" to '
+                                   '"install_reboot"')
+flags.DEFINE_float('installed', 120.0, 'seconds from power on to '
+                                       '"installed"')
+
+
+class FakeNode(object):
+    """Reports the install states of one machine to the state tracker."""
+
+    def __init__(self, tracker, instance_id, durations):
+        self.tracker = tracker
+        self.instance_id = instance_id
+        self.durations = durations
+        self.power = "off"
+        self.installing = True
+        self.simulated = 0.0
+
+    def _after(self, seconds, state):
+        eventlet.spawn_after(seconds / FLAGS.speedup, self.tracker.set_state,
+                             self.instance_id, state)
+
+    def power_on(self):
+        self.power = "on"
+        if self.installing:
+            self.installing = False
+            boot, write = self.durations["boot"], self.durations["write"]
+            self._after(boot, "install")
+            self._after(boot + write, "install_reboot")
+            self.simulated += (boot + write) / FLAGS.speedup
+        else:
+            self._after(self.durations["installed"], "installed")
+            self.simulated += self.durations["installed"] / FLAGS.speedup
+
+
+class FakeBmcPool(object):
+    def __init__(self):
+        self.nodes = {}
+
+    def execute(self, ip, subcommand):
+        node = self.nodes[ip]
+        if subcommand in ("on", "reset"):
+            node.power_on()
+        elif subcommand in ("off", "soft"):
+            node.power = "off"
+        return ""
+
+    def status(self, ip, refresh=False):
+        return self.nodes[ip].power
+
+
+class FakeImageCache(object):
+    def fetch(self, context, image_ref, user_id, project_id):
+        return {"id": image_ref, "name": "replay", "properties": {}}
+
+    def release(self, image_ref):
+        pass
+
+    def path(self, image_ref):
+        return "/dev/null"
+
+
+def _durations():
+    if not FLAGS.phase_log:
+        return [{"boot": FLAGS.boot,
+                 "write": FLAGS.write,
+                 "installed": FLAGS.installed}]
+
+    durations = []
+    for record in timing.load(FLAGS.phase_log):
+        phases = record["phases"]
+        if record.get("operation") == "spawn" and \
+           record.get("result") == "success" and \
+           "boot" in phases and "write" in phases:
+            durations.append({"boot": phases["boot"],
+                              "write": phases["write"],
+                              "installed": phases.get("installed", 0.0)})
+    if not durations:
+        sys.exit("No successful spawn in %s" % FLAGS.phase_log)
+    return durations
+
+
+def _fake_db():
+    connection.db.bmm_update = lambda context, bmm_id, values: None
+    connection.db.instance_update = lambda context, instance_id, values: None
+    connection.db.instance_get = lambda context, instance_id: \
+                                     {"id": instance_id, "deleted": False}
+
+
+def main():
+    FLAGS(sys.argv)
+    path = tempfile.mkdtemp()
+    FLAGS.cobbler_path = path
+    FLAGS.pxe_boot_path = os.path.join(path, "pxe")
+    FLAGS.dodai_state_log = ""
+    FLAGS.dodai_phase_log = os.path.join(path, "phases.log")
+    FLAGS.dodai_state_poll_interval = 3600
+    _fake_db()
+    bmc_pool = FakeBmcPool()
+    power._BMC_POOL = bmc_pool
+    os.makedirs(FLAGS.pxe_boot_path)
+
+    conn = connection.DodaiConnection()
+    conn.image_cache = FakeImageCache()
+    durations = _durations()
+
+    def _install(i):
+        instance = {"id": i, "image_ref": 1, "user_id": "replay",
+                    "project_id": "replay"}
+        ip = "10.0.%d.%d" % (i / 250, i % 250)
+        bmm = {"id": i, "name": "node%d" % i, "ipmi_ip": ip,
+               "pxe_ip": ip, "pxe_mac": "00:00:00:00:%02x:%02x" %
+                                         (i / 256, i % 256),
+               "storage_ip": None, "storage_mac": None,
+               "service_mac1": None, "service_mac2": None}
+        node = FakeNode(conn.state_tracker, i,
+                        durations[i % len(durations)])
+        bmc_pool.nodes[ip] = node
+
+        conn.timer.start(i, "spawn", instance_type="replay", image_ref=1)
+        start = time.time()
+        conn._install_machine(None, instance, bmm, "resource_pool", None)
+        elapsed = time.time() - start
+        conn.timer.finish(i, "spawn")
+        return elapsed, node
+
+    try:
+        start = time.time()
+        pool = eventlet.GreenPool(FLAGS.instances)
+        results = list(pool.imap(_install, xrange(FLAGS.instances)))
+        wall = time.time() - start
+        rows = timing.report(timing.load(FLAGS.dodai_phase_log))
+    finally:
+        shutil.rmtree(path)
+
+    overheads = sorted(elapsed - node.simulated for elapsed, node in results)
+    print '%d instances in %.2f seconds' % (FLAGS.instances, wall)
+    print 'overhead per instance: p50 %.3f p95 %.3f p99 %.3f seconds' % (
+            timing.percentile(overheads, 50),
+            timing.percentile(overheads, 95),
+            timing.percentile(overheads, 99))
+    print '%-16s %6s %10s %10s %10s' % ('phase', 'count', 'p50', 'p95',
+                                        'p99')
+    for group, phase, count, p50, p95, p99 in rows:
+        print '%-16s %6d %10.3f %10.3f %10.3f' % (phase, count, p50, p95,
+                                                  p99)
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,116 @@
+#!/usr/bin/env python
+# vim: tabstop=4 shiftwidth=4 softtabstop=4
+
+#    Licensed under the Apache License, Version 2.0 (the "License"); you may
+#    not use this file except in compliance with the License. You may obtain
+#    a copy of the License at
+#
+#         http://www.apache.org/licenses/LICENSE-2.0
+#
+#    Unless required by applicable law or agreed to in writing, software
+#    distributed under the License is distributed on an "AS IS" BASIS, WITHOUT
+#    WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied. See the
+#    License for the specific language governing permissions and limitations
+#    under the License.
+
+"""
+Compares writing create.sh by reading the template and replacing each
+parameter, as done before, with rendering the compiled template.
+
+  tools/dodai/template_benchmark.py --renders=10000
+"""
+
+import gettext
+import os
+import shutil
+import sys
+import tempfile
+import time
+
+possible_topdir = os.path.normpath(os.path.join(os.path.abspath(sys.argv[0]),
+                                   os.pardir,
+                                   os.pardir,
+                                   os.pardir))
+if os.path.exists(os.path.join(possible_topdir, 'nova', '__init__.py')):
+    sys.path.insert(0, possible_topdir)
+
+gettext.install('nova', unicode=1)
+
+from nova import flags
+from nova import utils
+from nova.virt.dodai import template
+
+
+FLAGS = flags.FLAGS
+flags.DEFINE_integer('renders', 10000, 'number of scripts written')
+
+
+def _params(i):
+    return {"INSTANCE_ID": i,
+            "COBBLER": "10.0.0.1",
+            "HOST_NAME": "instance-%08x" % i,
+            "STORAGE_IP": "10.1.0.%d" % (i % 250),
+            "STORAGE_MAC": "00:00:00:00:00:01",
+            "PXE_IP": "10.2.0.%d" % (i % 250),
+            "PXE_MAC": "00:00:00:00:00:02",
+            "SERVICE_MAC1": "00:00:00:00:00:03",
+            "SERVICE_MAC2": "00:00:00:00:00:04",
+            "IMAGE_ID": 1,
+            "IMAGE_TYPE": "ext3",
+            "ROOT_SIZE": 10,
+            "SWAP_SIZE": 2,
+            "EPHEMERAL_SIZE": 100,
+            "KDUMP_SIZE": 1,
+            "MONITOR_PORT": 5555,
+            "DEPLOY_MODE": "copy",
+            "IMAGE_COMPRESSION": "none",
+            "DISTRIBUTION": "http",
+            "MULTICAST_PORTBASE": 9000,
+            "MULTICAST_TIMEOUT": 900}
+
+
+def replace_write(dest_path, params):
+    f = open(utils.abspath("virt/dodai/create.sh.template"), "r")
+    content = f.read()
+    f.close()
+    for key, value in params.iteritems():
+        content = content.replace("@%s@" % key, str(value))
+    f = open(dest_path, "w")
+    f.write(content)
+    f.close()
+
+
+def main():
+    FLAGS(sys.argv)
+    path = tempfile.mkdtemp()
+    dest_path = os.path.join(path, "create.sh")
+    try:
+        start = time.time()
+        for i in xrange(FLAGS.renders):
+            replace_write(dest_path, _params(i))
+        replace_time = time.time() - start
+
+        start = time.time()
+        tmpl = template.TemplateSet().get("create.sh")
+        for i in xrange(FLAGS.renders):
+            tmpl.render(_params(i))
+        render_time = time.time() - start
+
+        start = time.time()
+        for i in xrange(FLAGS.renders):
+            tmpl.write(dest_path, _params(i))
+        write_time = time.time() - start
+    finally:
+        shutil.rmtree(path)
+
+    print '%d renders of create.sh' % FLAGS.renders
+    print '%-24s %10s %10s' % ('method', 'seconds', 'us/render')
+    for name, elapsed in (('read+replace+write', replace_time),
+                          ('compiled render', render_time),
+                          ('compiled atomic write', write_time)):
+        print '%-24s %10.3f %10.1f' % (name, elapsed,
+                                       elapsed * 1000000 / FLAGS.renders)
+
+
+if __name__ == '__main__':
+    main()